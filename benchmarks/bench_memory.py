@@ -0,0 +1,78 @@
+"""
+用户战绩记录的内存占用对比
+
+用法: python benchmarks/bench_memory.py [用户数，默认 1000000]
+
+分别测量三种表示方式存放 N 个用户战绩时的内存：
+  dict       旧版格式，每个用户一个六键字典
+  slots      UserRecord（__slots__）
+  snapshot   内存映射的二进制快照（RecordMap，未访问的记录不占 Python 堆）
+"""
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.records import USER_FIELDS, UserRecord  # noqa: E402
+from core.snapshot import Snapshot, encode_snapshot, write_snapshot  # noqa: E402
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    data = build()
+    elapsed = time.perf_counter() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return data, current, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    # ID 字符串在测量前创建，各项结果都不含ID本身的内存
+    user_ids = [str(100000000 + i) for i in range(count)]
+
+    def build_dict():
+        return {
+            uid: dict(zip(USER_FIELDS, (i % 500, i % 300, i % 200, 0, i % 7, i % 3)))
+            for i, uid in enumerate(user_ids)
+        }
+
+    def build_slots():
+        return {
+            uid: UserRecord(i % 500, i % 300, i % 200, 0, i % 7, i % 3)
+            for i, uid in enumerate(user_ids)
+        }
+
+    results = {"users": count}
+    dict_data, results["dict_bytes"], results["dict_seconds"] = measure(build_dict)
+    del dict_data
+    slots_data, results["slots_bytes"], results["slots_seconds"] = measure(build_slots)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "roulette_stats.1.bin")
+        write_snapshot(path, encode_snapshot([(None, slots_data.items(), [])]))
+        del slots_data
+        results["snapshot_file_bytes"] = os.path.getsize(path)
+        snapshot, results["snapshot_bytes"], results["snapshot_open_seconds"] = measure(
+            lambda: Snapshot(path)
+        )
+        users = snapshot.users(None)
+        start = time.perf_counter()
+        users.get(user_ids[count // 2])
+        results["snapshot_lookup_seconds"] = time.perf_counter() - start
+        snapshot.close()
+
+    results["per_user_dict"] = round(results["dict_bytes"] / count, 1)
+    results["per_user_slots"] = round(results["slots_bytes"] / count, 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+GameManager / Room / StatsManager 微基准
+
+用法: python benchmarks/bench_suite.py [--sizes 1000,100000,1000000] [--groups 5000]
+                                       [--output 结果.json] [--baseline 上次结果.json]
+
+覆盖：
+  gm.*        数千个群的 create_room / get_room / del_room（双人与多人房间）、try_shoot，
+              以及多线程各自操作不同群时的吞吐
+  room.*      Room.shoot 双人、多人模式打完一局
+  stats.*     不同用户规模下 record_game_result、各排行榜（首次建索引与后续查询分开计时）、
+              wilson/bayes 排序（有一局新结果后重新打分）与百分位、近期排行与宿敌查询
+  elo.*       按顺序重放对决重算等级分
+  io.*        加载（启动）/ 合并保存耗时，附带快照文件大小 file_bytes
+
+结果以 JSON 输出（默认打印到标准输出）；给出 --baseline 时逐项对比，变慢超过 --threshold 的项标记为回退。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.elo import EloRatings  # noqa: E402
+from core.model import NO_ROOM, GameManager, Room  # noqa: E402
+from core.records import PairRecord, UserRecord  # noqa: E402
+from core.snapshot import encode_snapshot, snapshot_path, write_snapshot  # noqa: E402
+from core.stats import StatsManager  # noqa: E402
+
+
+class Suite:
+    def __init__(self):
+        self.results = []
+
+    def timeit(self, name: str, func, ops: int = 1, repeat: int = 1, **params):
+        """执行 func repeat 次取最快一次，func 每次完成 ops 次操作"""
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        self.add(name, best, ops, **params)
+        return best
+
+    def add(self, name: str, seconds: float, ops: int = 1, extra: dict = None, **params):
+        """登记一项结果，extra 为附带的非计时数据（如文件大小）"""
+        result = {
+            "name": name,
+            "params": params,
+            "ops": ops,
+            "seconds": round(seconds, 6),
+            "us_per_op": round(seconds / ops * 1e6, 3),
+        }
+        if extra:
+            result.update(extra)
+        self.results.append(result)
+        print(f"{name:<32} {json.dumps(params, ensure_ascii=False):<28} {result['us_per_op']:>12.3f} us/op", file=sys.stderr)
+
+
+def bench_game_manager(suite: Suite, groups: int):
+    gm = GameManager()
+    group_ids = [str(600000000 + i) for i in range(groups)]
+    players = [(str(10000 + 2 * i), str(10001 + 2 * i)) for i in range(groups)]
+
+    def create():
+        for group_id, (p1, p2) in zip(group_ids, players):
+            gm.create_room([p1, p2, group_id], 60)
+            gm.create_room(["", "", group_id], 60)
+
+    def get():
+        for group_id, (p1, p2) in zip(group_ids, players):
+            gm.get_room([p1, "", group_id])
+            gm.get_room(["", "", group_id])
+
+    def delete():
+        for group_id, (p1, p2) in zip(group_ids, players):
+            gm.del_room(group_id=group_id, players=[p1, p2])
+
+    suite.timeit("gm.create_room", create, ops=2 * groups, groups=groups)
+    suite.timeit("gm.get_room", get, ops=2 * groups, repeat=3, groups=groups)
+    suite.timeit("gm.del_room", delete, ops=groups, groups=groups)
+
+    def shoot():
+        for group_id, (p1, p2) in zip(group_ids, players):
+            gm.create_room([p1, p2, group_id], 60)
+            # 不是 p1 的回合时返回 NOT_YOUR_TURN，由 p2 开枪，直到中枪注销房间
+            while gm.try_shoot(group_id, p1).outcome != NO_ROOM:
+                gm.try_shoot(group_id, p2)
+
+    suite.timeit("gm.try_shoot_game", shoot, ops=groups, groups=groups)
+
+    for threads in (1, 4):
+        def worker(offset: int):
+            for group_id, (p1, p2) in list(zip(group_ids, players))[offset::threads]:
+                gm.create_room([p1, p2, group_id], 60)
+                gm.get_room([p1, "", group_id])
+                gm.del_room(group_id=group_id, players=[p1, p2])
+
+        def run():
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            for t in workers:
+                t.start()
+            for t in workers:
+                t.join()
+
+        suite.timeit("gm.concurrent_lifecycle", run, ops=groups, repeat=3, groups=groups, threads=threads)
+
+
+def bench_room(suite: Suite, games: int):
+    random.seed(1)
+
+    def duel():
+        for _ in range(games):
+            room = Room(["1", "2"], 60)
+            while not room.over:
+                room.shoot(room.players[room.next_idx])
+
+    def multi():
+        shooters = [str(i) for i in range(6)]
+        for _ in range(games):
+            room = Room([], 60)
+            for shooter in shooters:
+                if room.shoot(shooter):
+                    break
+
+    suite.timeit("room.shoot_duel_game", duel, ops=games, repeat=3, games=games)
+    suite.timeit("room.shoot_multi_game", multi, ops=games, repeat=3, games=games)
+
+
+def build_data_dir(data_dir: str, users: int) -> str:
+    """直接编码一份含 users 名用户、每人约 2 条对战记录的快照，省去逐局录入"""
+    random.seed(users)
+    user_ids = [str(100000000 + i) for i in range(users)]
+    records = []
+    for user_id in user_ids:
+        total = random.randint(1, 200)
+        wins = random.randint(0, total)
+        records.append((user_id, UserRecord(total, wins, total - wins, 0, random.randint(0, 8), 0)))
+    pvp = {}
+    for i in range(users):
+        for j in (i + 1, i + 7):
+            if j < users:
+                pvp[(user_ids[i], user_ids[j])] = PairRecord(3, 1, 2)
+    path = snapshot_path(data_dir, 1)
+    write_snapshot(path, encode_snapshot([(None, records, pvp.items())]))
+    return path
+
+
+def bench_stats(suite: Suite, users: int, games: int):
+    with tempfile.TemporaryDirectory() as data_dir:
+        path = build_data_dir(data_dir, users)
+
+        start = time.perf_counter()
+        # 后台线程间隔设得足够长，只测内存中的记录开销
+        stats = StatsManager(data_dir, compact_every=10 ** 9, flush_interval=3600, flush_batch=10 ** 9)
+        suite.add("io.load", time.perf_counter() - start, extra={"file_bytes": os.path.getsize(path)}, users=users)
+
+        suite.timeit("stats.top_players_cold", lambda: stats.get_top_players(limit=5), users=users)
+        for name, getter in (
+            ("stats.top_players", lambda: stats.get_top_players(limit=5)),
+            ("stats.unlucky_players", lambda: stats.get_unlucky_players(limit=5)),
+            ("stats.active_players", lambda: stats.get_active_players(limit=5)),
+        ):
+            suite.timeit(name, lambda: [getter() for _ in range(100)], ops=100, repeat=3, users=users)
+
+        probe = str(100000000)
+        for sort_by in ("wilson", "bayes"):
+            suite.timeit(f"stats.top_players_{sort_by}_cold", lambda: stats.get_top_players(limit=5, sort_by=sort_by),
+                         users=users)
+
+            def rescored():
+                # 每次查询前都有一局新结果，缓存的分数作废
+                for _ in range(10):
+                    stats.record_game_result(probe, [], False)
+                    stats.get_top_players(limit=5, sort_by=sort_by)
+
+            suite.timeit(f"stats.top_players_{sort_by}", rescored, ops=10, users=users)
+        suite.timeit("stats.percentile", lambda: [stats.get_percentile(probe) for _ in range(100)], ops=100, users=users)
+
+        random.seed(2)
+        sample = [str(100000000 + random.randrange(users)) for _ in range(2 * games)]
+        groups = [str(600000000 + i % 50) for i in range(games)]
+
+        def record():
+            for i in range(games):
+                loser, winner = sample[2 * i], sample[2 * i + 1]
+                if loser != winner:
+                    stats.record_game_result(loser, [winner], True, groups[i])
+
+        suite.timeit("stats.record_game_result", record, ops=games, users=users)
+        duels = [(groups[i], sample[2 * i + 1], sample[2 * i]) for i in range(games) if sample[2 * i] != sample[2 * i + 1]]
+        suite.timeit("elo.rebuild", lambda: EloRatings().rebuild(duels), ops=len(duels), repeat=3, users=users)
+        suite.timeit("stats.flush", stats.flush, users=users, games=games)
+
+        for window in ("day", "week", "month"):
+            suite.timeit(
+                f"stats.top_players_{window}",
+                lambda: [stats.get_top_players(limit=5, window=window) for _ in range(10)],
+                ops=10, users=users,
+            )
+        suite.timeit("stats.rivals_cold", lambda: stats.get_rivals(sample[0]), users=users)
+        suite.timeit(
+            "stats.rivals",
+            lambda: [stats.get_rivals(user_id) for user_id in sample[:1000]],
+            ops=1000, users=users,
+        )
+
+        start = time.perf_counter()
+        stats.compact()
+        suite.add(
+            "io.compact", time.perf_counter() - start,
+            extra={"file_bytes": os.path.getsize(snapshot_path(data_dir, stats._generation))}, users=users,
+        )
+        start = time.perf_counter()
+        stats.close()
+        suite.add("io.close", time.perf_counter() - start, users=users)
+
+
+def compare(results, baseline_file: str, threshold: float) -> int:
+    """与上次结果逐项对比，返回回退项数"""
+    with open(baseline_file, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def key(result):
+        return result["name"], json.dumps(result["params"], sort_keys=True)
+
+    old = {key(result): result for result in baseline["results"]}
+    regressions = 0
+    for result in results:
+        before = old.get(key(result))
+        if not before or not before["us_per_op"]:
+            continue
+        ratio = result["us_per_op"] / before["us_per_op"]
+        regressed = ratio > 1 + threshold
+        regressions += regressed
+        mark = "  <-- 回退" if regressed else ""
+        print(f"{result['name']:<32} {json.dumps(result['params']):<28} x{ratio:.2f}{mark}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转盘插件微基准")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="用户规模，逗号分隔")
+    parser.add_argument("--groups", type=int, default=5000, help="GameManager 测试的群数")
+    parser.add_argument("--games", type=int, default=20000, help="Room / 录入战绩测试的局数")
+    parser.add_argument("--output", help="结果写入的 JSON 文件，默认打印到标准输出")
+    parser.add_argument("--baseline", help="用于对比的上次结果 JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定为回退的变慢比例")
+    args = parser.parse_args()
+
+    suite = Suite()
+    bench_game_manager(suite, args.groups)
+    bench_room(suite, args.games)
+    for users in (int(size) for size in args.sizes.split(",")):
+        bench_stats(suite, users, min(args.games, 10 * users))
+
+    report = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": suite.results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        sys.exit(1 if compare(suite.results, args.baseline, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+"""
+转盘规则蒙特卡洛模拟
+
+用法: python benchmarks/simulate_room.py [--games 50000000] [--seed 1] [--chunk 4000000]
+                                         [--surrender 先手阈值,后手阈值 ...] [--verify 200000]
+                                         [--output 结果.json]
+
+按 Room 的规则批量模拟（需要 numpy）：
+  双人  bullet 均匀取 1~6，先手 next_idx 均匀取 0/1，两人轮流开枪，第 bullet 枪中枪
+  多人  n 人按加入顺序各开一枪，第 bullet 个开枪的人中枪；bullet 大于 n 时无人中枪（游戏超时结束）
+认输策略以“剩余弹位阈值”表示：轮到某人时剩余弹位（6 - 已开枪数）不大于阈值就认输，0 表示从不认输。
+最后一发时剩余 1 个弹位且必中，此时认输与开枪结果相同。
+
+输出：各座位（先手 / 后手、发起者 / 被挑战者、多人模式的加入顺序）的败率，游戏长度（开枪数）分布，
+以及不同认输策略下的变化。
+
+--verify N 用真实的 GameManager / Room 打 N 局（双人与多人），检查：
+  1. 按 Room 实际抽到的 bullet / next_idx 逐局重放模拟内核，败者、开枪数、是否认输完全一致
+  2. Room 的抽样分布与模拟结果的败率在 5 个标准差之内
+任一项不一致时以状态码 1 退出。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.model import ALREADY_JOINED, BANG, ENDED, MISS, NOT_YOUR_TURN, GameManager  # noqa: E402
+
+CHAMBERS = 6
+
+
+def draw(rng: np.random.Generator, n: int):
+    """与 Room.__init__ 相同的抽样：(bullet, 先手玩家下标)"""
+    bullet = rng.integers(1, CHAMBERS + 1, n, dtype=np.int8)
+    first = rng.integers(0, 2, n, dtype=np.int8)
+    return bullet, first
+
+
+def play_duel(bullet: np.ndarray, first: np.ndarray, surrender=(0, 0)):
+    """
+    双人模式内核
+    :param first: 先手玩家下标（Room.next_idx 的初值），players[0] 为发起者
+    :param surrender: (先手阈值, 后手阈值)
+    :return: (败者下标, 开枪数, 是否认输)
+    """
+    end = bullet.copy()  # 结束于第几个回合（中枪的一枪，或认输的回合）
+    surrendered = np.zeros(len(bullet), dtype=bool)
+    for turn in range(1, CHAMBERS + 1):
+        # 第 turn 回合由先手（turn 为奇数）或后手开枪，剩余弹位 CHAMBERS - turn + 1
+        threshold = surrender[(turn - 1) % 2]
+        if threshold >= CHAMBERS - turn + 1:
+            quit_now = (end >= turn) & ~surrendered
+            end[quit_now] = turn
+            surrendered |= quit_now
+    loser = (first + end - 1) & 1
+    shots = end - surrendered
+    return loser.astype(np.int8), shots.astype(np.int8), surrendered
+
+
+def play_multi(bullet: np.ndarray, players: int, surrender: int = 0):
+    """
+    多人模式内核：players 人按加入顺序各开一枪
+    :param surrender: 轮到某人时剩余弹位不大于该值就认输
+    :return: (败者的加入顺序，无人中枪为 -1, 开枪数, 是否认输)
+    """
+    end = np.where(bullet <= players, bullet, 0).astype(np.int8)  # 0 表示全员开过枪、无人中枪
+    surrendered = np.zeros(len(bullet), dtype=bool)
+    for turn in range(1, players + 1):
+        if surrender >= CHAMBERS - turn + 1:
+            quit_now = ((end >= turn) | (end == 0)) & ~surrendered
+            end[quit_now] = turn
+            surrendered |= quit_now
+    loser = end.astype(np.int8) - 1
+    shots = np.where(end == 0, players, end - surrendered).astype(np.int8)
+    return loser, shots, surrendered
+
+
+class Tally:
+    """按块累加计数"""
+
+    def __init__(self, seats: int):
+        self.games = 0
+        self.losses = np.zeros(seats + 1, dtype=np.int64)  # 最后一格为无人中枪
+        self.order_losses = np.zeros(2, dtype=np.int64)    # 双人模式：先手 / 后手
+        self.shots = np.zeros(CHAMBERS + 1, dtype=np.int64)
+        self.surrendered = 0
+
+    def add(self, loser: np.ndarray, shots: np.ndarray, surrendered: np.ndarray, first: np.ndarray = None):
+        self.games += len(loser)
+        self.losses += np.bincount(np.where(loser < 0, len(self.losses) - 1, loser), minlength=len(self.losses))
+        if first is not None:
+            self.order_losses += np.bincount((loser - first) & 1, minlength=2)
+        self.shots += np.bincount(shots, minlength=CHAMBERS + 1)
+        self.surrendered += int(surrendered.sum())
+
+    def report(self) -> dict:
+        games = self.games or 1
+        result = {
+            "games": self.games,
+            "loss_by_seat": [round(x / games, 6) for x in self.losses[:-1]],
+            "no_loser": round(self.losses[-1] / games, 6),
+            "shots": {str(i): round(x / games, 6) for i, x in enumerate(self.shots) if x},
+            "mean_shots": round(float((self.shots * np.arange(CHAMBERS + 1)).sum()) / games, 4),
+            "surrendered": round(self.surrendered / games, 6),
+        }
+        if self.order_losses.any():
+            result["loss_by_order"] = [round(x / games, 6) for x in self.order_losses]
+        return result
+
+
+def simulate_duel(rng: np.random.Generator, games: int, chunk: int, surrender=(0, 0)) -> dict:
+    tally = Tally(2)
+    for start in range(0, games, chunk):
+        bullet, first = draw(rng, min(chunk, games - start))
+        tally.add(*play_duel(bullet, first, surrender), first=first)
+    return tally.report()
+
+
+def simulate_multi(rng: np.random.Generator, games: int, chunk: int, players: int, surrender: int = 0) -> dict:
+    tally = Tally(players)
+    for start in range(0, games, chunk):
+        bullet, _ = draw(rng, min(chunk, games - start))
+        tally.add(*play_multi(bullet, players, surrender))
+    return tally.report()
+
+
+def room_duels(games: int, seed: int, surrender=(0, 0)):
+    """
+    用真实的 GameManager 打双人局，返回每局 (bullet, 先手下标, 败者下标, 开枪数, 是否认输)
+    轮到的人按策略认输或开枪，同时检查不是自己回合时开枪与认输都会被拒绝
+    """
+    random.seed(seed)
+    gm = GameManager()
+    players = ["1", "2"]
+    rows = []
+    for _ in range(games):
+        room = gm.create_room(kids=[*players, "g"])
+        bullet, first = room.bullet, room.next_idx
+        order = 0
+        while True:
+            shooter = players[room.next_idx]
+            other = players[1 - room.next_idx]
+            assert gm.try_shoot("g", other).outcome == NOT_YOUR_TURN
+            assert gm.try_surrender("g", other).outcome == NOT_YOUR_TURN
+            if surrender[order % 2] >= CHAMBERS - room.round:
+                assert gm.try_surrender("g", shooter).outcome == ENDED
+                rows.append((bullet, first, players.index(shooter), room.round, True))
+                break
+            result = gm.try_shoot("g", shooter)
+            if result.outcome == BANG:
+                rows.append((bullet, first, players.index(shooter), result.round, False))
+                break
+            assert result.outcome == MISS
+            order += 1
+    return rows
+
+
+def room_multis(games: int, seed: int, players: int, surrender: int = 0):
+    """用真实的 GameManager 打多人局，返回每局 (bullet, 败者加入顺序或 -1, 开枪数, 是否认输)"""
+    random.seed(seed)
+    gm = GameManager()
+    rows = []
+    for _ in range(games):
+        room = gm.create_room(kids=["", "", "g"])
+        bullet = room.bullet
+        for seat in range(players):
+            shooter = str(seat)
+            if surrender >= CHAMBERS - room.round:
+                assert gm.try_surrender("g", shooter).outcome == ENDED
+                rows.append((bullet, seat, room.round, True))
+                break
+            result = gm.try_shoot("g", shooter)
+            if result.outcome == BANG:
+                rows.append((bullet, seat, result.round, False))
+                break
+            assert result.outcome == MISS
+            assert gm.try_shoot("g", shooter).outcome == ALREADY_JOINED  # 同一人不能再开第二枪
+        else:
+            # 人数不足、无人中枪，等同游戏超时结束
+            rows.append((bullet, -1, room.round, False))
+            assert gm.teardown("g", room)
+    return rows
+
+
+def within(observed: float, expected: float, games: int, sigmas: float = 5.0) -> bool:
+    """二项分布比例 observed 是否在 expected 的 sigmas 个标准差之内"""
+    return abs(observed - expected) <= sigmas * max(np.sqrt(expected * (1 - expected) / games), 1e-9)
+
+
+def verify(games: int, seed: int, chunk: int, scenarios) -> int:
+    """真实 Room 与模拟内核对照，返回不一致的项数"""
+    failures = 0
+    rng = np.random.default_rng(seed)
+    for surrender in scenarios:
+        rows = np.array(room_duels(games, seed, surrender), dtype=np.int64)
+        bullet, first = rows[:, 0].astype(np.int8), rows[:, 1].astype(np.int8)
+        loser, shots, surrendered = play_duel(bullet, first, surrender)
+        mismatched = int(((loser != rows[:, 2]) | (shots != rows[:, 3]) | (surrendered != rows[:, 4])).sum())
+        simulated = simulate_duel(rng, max(games * 20, chunk), chunk, surrender)
+        observed = float(((rows[:, 2] - rows[:, 1]) & 1).mean())
+        ok = not mismatched and within(1 - observed, simulated["loss_by_order"][0], games)
+        failures += not ok
+        print(f"双人 认输阈值={surrender}: 逐局不一致 {mismatched}，Room 先手败率 {1 - observed:.4f}，"
+              f"模拟 {simulated['loss_by_order'][0]:.4f} {'✅' if ok else '❌'}")
+
+    for players in range(2, CHAMBERS + 1):
+        rows = np.array(room_multis(games, seed, players), dtype=np.int64)
+        loser, shots, surrendered = play_multi(rows[:, 0].astype(np.int8), players)
+        mismatched = int(((loser != rows[:, 1]) | (shots != rows[:, 2]) | (surrendered != rows[:, 3])).sum())
+        simulated = simulate_multi(rng, max(games * 20, chunk), chunk, players)
+        observed = [float((rows[:, 1] == seat).mean()) for seat in range(players)]
+        ok = not mismatched and all(
+            within(o, s, games) for o, s in zip(observed, simulated["loss_by_seat"])
+        )
+        failures += not ok
+        print(f"多人 {players} 人: 逐局不一致 {mismatched}，Room 各座位败率 "
+              f"{' '.join(f'{x:.4f}' for x in observed)} {'✅' if ok else '❌'}")
+    return failures
+
+
+def parse_surrender(text: str):
+    first, _, second = text.partition(",")
+    return int(first), int(second or first)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="转盘规则蒙特卡洛模拟")
+    parser.add_argument("--games", type=int, default=50_000_000, help="每种情形模拟的局数")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--chunk", type=int, default=4_000_000, help="每批向量化模拟的局数")
+    parser.add_argument("--surrender", action="append", type=parse_surrender,
+                        help="双人认输策略 先手阈值,后手阈值，可多次给出；默认比较几种常见策略")
+    parser.add_argument("--verify", type=int, default=0, help="用真实 Room 打这么多局对照模拟结果")
+    parser.add_argument("--output", help="结果写入的 JSON 文件")
+    args = parser.parse_args()
+
+    scenarios = args.surrender or [(0, 0), (1, 1), (2, 0), (0, 2), (3, 3)]
+    rng = np.random.default_rng(args.seed)
+    report = {"duel": {}, "multi": {}}
+
+    start = time.perf_counter()
+    for surrender in scenarios:
+        result = report["duel"][f"{surrender[0]},{surrender[1]}"] = simulate_duel(rng, args.games, args.chunk, surrender)
+        first_loss, second_loss = result["loss_by_order"]
+        print(f"双人 认输阈值 先手{surrender[0]}/后手{surrender[1]}: 先手败率 {first_loss:.4f}，后手 {second_loss:.4f}；"
+              f"发起者败率 {result['loss_by_seat'][0]:.4f}；平均开枪 {result['mean_shots']}，认输 {result['surrendered']:.4f}")
+    for players in range(2, CHAMBERS + 1):
+        result = report["multi"][str(players)] = simulate_multi(rng, args.games, args.chunk, players)
+        print(f"多人 {players} 人: 各座位败率 {' '.join(f'{x:.4f}' for x in result['loss_by_seat'])}，"
+              f"无人中枪 {result['no_loser']:.4f}，平均开枪 {result['mean_shots']}")
+    elapsed = time.perf_counter() - start
+    total = args.games * (len(scenarios) + CHAMBERS - 1)
+    report["games_per_second"] = round(total / elapsed)
+    print(f"共模拟 {total} 局，{elapsed:.2f}s（{total / elapsed / 1e6:.1f} M 局/秒）")
+
+    failures = verify(args.verify, args.seed, args.chunk, scenarios) if args.verify else 0
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if failures:
+        print(f"❌ {failures} 项与真实 Room 不一致", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
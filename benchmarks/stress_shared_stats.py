@@ -0,0 +1,144 @@
+"""
+多进程共享战绩库压力测试
+
+用法: python benchmarks/stress_shared_stats.py [--processes 4] [--games 2000] [--users 50] [--groups 5]
+                                              [--data-dir 目录]
+
+启动若干进程，同时以多进程共享模式（SqliteStatsManager(shared=True)）向同一数据目录录入对局，
+每个进程的对局序列由固定种子生成。全部结束后按同样的种子重放出期望的用户战绩、对战记录与按天汇总，
+与库中数据逐行比对，有任何丢失或重复时以状态码 1 退出。
+未指定 --data-dir 时使用临时目录，结束后删除。
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.sqlite_stats import GLOBAL_SCOPE, SqliteStatsManager  # noqa: E402
+from core.windows import today  # noqa: E402
+
+
+def games_of(worker: int, games: int, users: int, groups: int):
+    """第 worker 个进程录入的对局：[(败者, 胜者列表, 是否双人, 群号), ...]"""
+    rng = random.Random(worker)
+    for _ in range(games):
+        group_id = str(600000000 + rng.randrange(groups))
+        if rng.random() < 0.8:
+            loser, winner = rng.sample(range(users), 2)
+            yield str(10000 + loser), [str(10000 + winner)], True, group_id
+        else:
+            yield str(10000 + rng.randrange(users)), [], False, group_id
+
+
+def worker_main(data_dir: str, worker: int, games: int, users: int, groups: int, barrier, results):
+    stats = SqliteStatsManager(data_dir, shared=True)
+    barrier.wait()
+    start = time.perf_counter()
+    for loser, winners, is_pvp, group_id in games_of(worker, games, users, groups):
+        stats.record_game_result(loser, winners, is_pvp, group_id)
+    results.put((worker, time.perf_counter() - start))
+    stats.close()
+
+
+def expected_rows(processes: int, games: int, users: int, groups: int):
+    """重放全部对局，返回与三张表对应的期望数据"""
+    user_rows, pvp_rows, daily_rows = {}, {}, {}
+    day = today()
+    for worker in range(processes):
+        for loser, winners, is_pvp, group_id in games_of(worker, games, users, groups):
+            for scope in (GLOBAL_SCOPE, group_id):
+                row = user_rows.setdefault((scope, loser), [0, 0, 0])
+                row[0] += 1
+                row[2] += 1
+                daily_rows.setdefault((scope, day, loser), [0, 0])[0] += 1
+                for winner in winners:
+                    row = user_rows.setdefault((scope, winner), [0, 0, 0])
+                    row[0] += 1
+                    row[1] += 1
+                    counts = daily_rows.setdefault((scope, day, winner), [0, 0])
+                    counts[0] += 1
+                    counts[1] += 1
+                if is_pvp:
+                    user1, user2 = sorted([loser, winners[0]])
+                    row = pvp_rows.setdefault((scope, user1, user2), [0, 0, 0])
+                    row[0] += 1
+                    row[1 if winners[0] == user1 else 2] += 1
+    return user_rows, pvp_rows, daily_rows
+
+
+def verify(data_dir: str, processes: int, games: int, users: int, groups: int) -> int:
+    """与库中数据比对，返回不一致的行数"""
+    expected = expected_rows(processes, games, users, groups)
+    conn = sqlite3.connect(os.path.join(data_dir, "roulette_stats.db"))
+    actual = (
+        {(g, u): [t, w, l] for g, u, t, w, l in conn.execute(
+            "SELECT group_id, user_id, total, wins, losses FROM users")},
+        {(g, u1, u2): [t, w1, w2] for g, u1, u2, t, w1, w2 in conn.execute(
+            "SELECT group_id, user1_id, user2_id, total, user1_wins, user2_wins FROM pvp")},
+        {(g, d, u): [t, w] for g, d, u, t, w in conn.execute(
+            "SELECT group_id, day, user_id, total, wins FROM daily")},
+    )
+    conn.close()
+    mismatches = 0
+    for table, want, got in zip(("users", "pvp", "daily"), expected, actual):
+        for key in want.keys() | got.keys():
+            if want.get(key) != got.get(key):
+                mismatches += 1
+                if mismatches <= 10:
+                    print(f"{table} {key}: 期望 {want.get(key)}，实际 {got.get(key)}", file=sys.stderr)
+    return mismatches
+
+
+def run(args, data_dir: str):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(args.processes)
+    results = ctx.Queue()
+    workers = [
+        ctx.Process(target=worker_main, args=(data_dir, i, args.games, args.users, args.groups, barrier, results))
+        for i in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    elapsed = time.perf_counter() - start
+    if any(process.exitcode for process in workers):
+        print("有进程异常退出", file=sys.stderr)
+        sys.exit(1)
+
+    total_games = args.processes * args.games
+    for worker, seconds in sorted(results.get() for _ in workers):
+        print(f"进程 {worker}: {args.games} 局 {seconds:.2f}s ({seconds / args.games * 1e6:.0f} us/局)")
+    print(f"合计 {total_games} 局，{elapsed:.2f}s（含进程启动）")
+
+    mismatches = verify(data_dir, args.processes, args.games, args.users, args.groups)
+    if mismatches:
+        print(f"❌ {mismatches} 行与期望不一致", file=sys.stderr)
+        sys.exit(1)
+    print("✅ 数据一致")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多进程共享战绩库压力测试")
+    parser.add_argument("--processes", type=int, default=4, help="同时录入的进程数")
+    parser.add_argument("--games", type=int, default=2000, help="每个进程录入的局数")
+    parser.add_argument("--users", type=int, default=50, help="用户数，越少越容易在同一行上冲突")
+    parser.add_argument("--groups", type=int, default=5, help="群数")
+    parser.add_argument("--data-dir", help="数据目录（应为空，结束后保留），默认使用临时目录")
+    args = parser.parse_args()
+
+    if args.data_dir:
+        run(args, args.data_dir)
+    else:
+        with tempfile.TemporaryDirectory(prefix="roulette-stress-") as data_dir:
+            run(args, data_dir)
+
+if __name__ == "__main__":
+    main()
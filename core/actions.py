@@ -0,0 +1,200 @@
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional
+
+from .metrics import current_command, metrics
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个，最多积攒 burst 个"""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """距离有可用令牌还需等待的秒数，rate 不大于 0 表示不限速"""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class Action:
+    __slots__ = ("kind", "group_id", "func", "description", "command", "attempts", "queued_at", "last_error")
+
+    def __init__(self, kind: str, group_id: str, func: Callable[[], Awaitable], description: str):
+        self.kind = kind
+        self.group_id = group_id
+        self.func = func
+        self.description = description
+        self.command = current_command.get()
+        self.attempts = 0
+        self.queued_at = time.monotonic()
+        self.last_error = ""
+
+
+class ActionQueue:
+    """
+    发往平台的禁言、消息等动作队列
+    指令处理器 submit() 后立即返回；每个有待办动作的群一个工作任务，按提交顺序逐个执行，
+    执行前须同时拿到本群与全局的令牌，同时进行中的平台请求数受 concurrency 限制。
+    失败按指数退避重试，用尽次数或队列已满的动作进入死信（内存中保留最近若干条，并追加到死信文件）。
+    """
+
+    def __init__(self, rate: float = 10, burst: float = 20, group_rate: float = 1, group_burst: float = 5,
+                 concurrency: int = 4, max_attempts: int = 4, backoff: float = 1.0, timeout: float = 30,
+                 max_pending: int = 1000, dead_letter_file: Optional[str] = None, dead_letter_size: int = 200):
+        """
+        :param rate: 全局每秒动作数
+        :param group_rate: 单群每秒动作数
+        :param concurrency: 同时进行中的平台请求上限
+        :param max_attempts: 最多尝试次数（含第一次）
+        :param backoff: 第一次重试前等待的秒数，之后每次翻倍并加随机抖动
+        :param max_pending: 排队动作总数上限，超出时新动作直接进入死信
+        """
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_attempts = max(1, max_attempts)
+        self.backoff = backoff
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.dead_letter_file = dead_letter_file
+        self._global = TokenBucket(rate, burst)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._queues: Dict[str, Deque[Action]] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._concurrency = max(1, concurrency)
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._pending = 0
+        self.dead_letters: Deque[Dict] = deque(maxlen=dead_letter_size)
+
+    def __len__(self) -> int:
+        """排队及执行中的动作数"""
+        return self._pending
+
+    def submit(self, kind: str, group_id: str, func: Callable[[], Awaitable], description: str = "") -> bool:
+        """
+        提交动作，需在事件循环中调用
+        :param kind: 动作种类，如 "ban" / "send"，用于统计
+        :param func: 无参协程函数，每次尝试调用一次，抛出异常视为失败
+        :return: 是否已入队（队列已满时返回 False，动作进入死信）
+        """
+        action = Action(kind, str(group_id or ""), func, description)
+        if self._pending >= self.max_pending:
+            action.last_error = "队列已满"
+            self._dead_letter(action, "dropped")
+            return False
+        self._pending += 1
+        self._queues.setdefault(action.group_id, deque()).append(action)
+        if action.group_id not in self._workers:
+            self._workers[action.group_id] = asyncio.get_running_loop().create_task(self._work(action.group_id))
+        return True
+
+    async def _acquire_tokens(self, group_id: str):
+        bucket = self._buckets.get(group_id)
+        if bucket is None:
+            bucket = self._buckets[group_id] = TokenBucket(self.group_rate, self.group_burst)
+        while True:
+            wait = max(bucket.delay(), self._global.delay())
+            if wait <= 0:
+                bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(wait)
+
+    async def _work(self, group_id: str):
+        """逐个执行一个群的动作，队列空时退出"""
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self._concurrency)
+        queue = self._queues[group_id]
+        try:
+            while queue:
+                action = queue[0]
+                await self._execute(action)
+                queue.popleft()
+                self._pending -= 1
+        finally:
+            self._workers.pop(group_id, None)
+            if not queue:
+                self._queues.pop(group_id, None)
+            if len(self._buckets) > 256:
+                self._prune_buckets()
+
+    def _prune_buckets(self):
+        """丢弃已回满、且没有待办动作的群的令牌桶（重新创建的桶同样是满的）"""
+        for group_id, bucket in list(self._buckets.items()):
+            if group_id not in self._queues:
+                bucket.delay()
+                if bucket.tokens >= bucket.burst:
+                    del self._buckets[group_id]
+
+    async def _execute(self, action: Action):
+        current_command.set(action.command)
+        while True:
+            await self._acquire_tokens(action.group_id)
+            if action.attempts == 0:
+                metrics.observe("roulette_action_wait_seconds", time.monotonic() - action.queued_at, kind=action.kind)
+            action.attempts += 1
+            async with self._slots:
+                try:
+                    await asyncio.wait_for(action.func(), self.timeout)
+                except Exception as e:
+                    action.last_error = str(e) or type(e).__name__
+                else:
+                    metrics.inc("roulette_actions_total", kind=action.kind, status="ok")
+                    return
+            if action.attempts >= self.max_attempts:
+                self._dead_letter(action, "dead")
+                return
+            metrics.inc("roulette_actions_total", kind=action.kind, status="retry")
+            delay = self.backoff * 2 ** (action.attempts - 1)
+            await asyncio.sleep(delay * random.uniform(1, 1.5))
+
+    def _dead_letter(self, action: Action, status: str):
+        metrics.inc("roulette_actions_total", kind=action.kind, status=status)
+        entry = {
+            "ts": round(time.time(), 3),
+            "kind": action.kind,
+            "g": action.group_id,
+            "desc": action.description,
+            "attempts": action.attempts,
+            "error": action.last_error,
+        }
+        self.dead_letters.append(entry)
+        print(f"[Roulette] 动作 {action.kind}（{action.description}）失败 {action.attempts} 次后放弃: {action.last_error}")
+        if self.dead_letter_file:
+            try:
+                with open(self.dead_letter_file, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"[Roulette] 写入死信文件失败: {e}")
+
+    async def close(self, timeout: float = 5):
+        """等待队列中的动作执行完（至多 timeout 秒），其余取消"""
+        workers: List[asyncio.Task] = list(self._workers.values())
+        if workers:
+            _, still_running = await asyncio.wait(workers, timeout=timeout)
+            for task in still_running:
+                task.cancel()
+            if still_running:
+                await asyncio.gather(*still_running, return_exceptions=True)
+        if self._pending:
+            print(f"[Roulette] 插件卸载，放弃 {self._pending} 个未执行的动作")
+        self._queues.clear()
+        self._pending = 0
@@ -0,0 +1,168 @@
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from .elo import RATED_MIN_GAMES
+from .metrics import metrics
+from .ranking import score_of
+from .windows import today
+
+# 排行榜 -> (排序指标, 上榜最少局数)
+# rate_high 胜率越高越靠前，rate_low 胜率越低越靠前，total 局数越多越靠前，rating 等级分越高越靠前（门槛为对决场数）
+BOARDS: Dict[str, Tuple[str, int]] = {
+    "top": ("rate_high", 5),
+    "unlucky": ("rate_low", 5),
+    "active": ("total", 0),
+    "rating": ("rating", RATED_MIN_GAMES),
+}
+
+BoardKey = Tuple[str, str, Optional[str]]  # (群号，私聊为空串, 排行榜, 时间窗口)
+
+
+class _Entry:
+    __slots__ = ("text", "scope", "members", "cutoff", "day", "expire_at")
+
+    def __init__(self, text: str, scope: Optional[str], members: Set[str], cutoff: Optional[float],
+                 day: Optional[int], expire_at: float):
+        self.text = text
+        self.scope = scope          # 生成时实际使用的数据范围，None 为全局
+        self.members = members      # 榜上的 user_id
+        self.cutoff = cutoff        # 榜尾的排序分数，榜未满时为 None（任何达标用户都能上榜）
+        self.day = day              # 近期排行生成的日期，跨天后窗口滚动，条目作废
+        self.expire_at = expire_at
+
+
+class BoardCache:
+    """
+    排行榜回复缓存
+    以 (群号, 排行榜, 时间窗口) 为键缓存最终的回复文本，ttl 秒后过期（兜底昵称变化）。
+    每局结果只检查同一数据范围的条目：参与者在榜上，或其新战绩达标且不差于榜尾时作废，
+    其余条目不受影响，重复查询只需一次字典查找。
+    """
+
+    def __init__(self, ttl: float = 300, maxsize: int = 1024, sort_by: str = "rate"):
+        """
+        :param ttl: 条目有效期（秒），不大于 0 时不缓存
+        :param sort_by: 胜率类榜单的排序方式（core.ranking.SORT_KEYS）
+        """
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.sort_by = sort_by
+        self._data: OrderedDict[BoardKey, _Entry] = OrderedDict()
+        self._by_scope: Dict[Optional[str], Set[BoardKey]] = {}
+        self._version = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def version(self) -> int:
+        """生成回复前取得版本号，put() 时版本已变说明期间有新结果，不再缓存"""
+        return self._version
+
+    def get(self, group_id: Optional[str], board: str, window: Optional[str]) -> Optional[str]:
+        key = (group_id or "", board, window)
+        entry = self._data.get(key)
+        if entry is not None:
+            if entry.expire_at > time.monotonic() and (entry.day is None or entry.day == today()):
+                self._data.move_to_end(key)
+                metrics.inc("roulette_board_cache_total", result="hit")
+                return entry.text
+            self._drop(key)
+        metrics.inc("roulette_board_cache_total", result="miss")
+        return None
+
+    def put(self, group_id: Optional[str], board: str, window: Optional[str], scope: Optional[str],
+            rows: List[Tuple[str, float, Dict]], limit: int, text: str, version: int):
+        """
+        缓存一份回复
+        :param scope: 生成时的数据范围（stats.board_scope()）
+        :param rows: 统计后端返回的原始排行 [(user_id, 排序指标, stats), ...]
+        :param limit: 查询的名次数，rows 不足 limit 条说明榜未满
+        """
+        if self.ttl <= 0 or version != self._version:
+            return
+        key = (group_id or "", board, window)
+        self._drop(key)
+        self._data[key] = _Entry(
+            text,
+            scope,
+            {user_id for user_id, _, _ in rows},
+            self._score(board, rows[-1][2]) if len(rows) >= limit else None,
+            today() if window else None,
+            time.monotonic() + self.ttl,
+        )
+        self._by_scope.setdefault(scope, set()).add(key)
+        while len(self._data) > self.maxsize:
+            self._drop(next(iter(self._data)))
+
+    def _drop(self, key: BoardKey):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            keys = self._by_scope.get(entry.scope)
+            keys.discard(key)
+            if not keys:
+                del self._by_scope[entry.scope]
+
+    def on_result(self, group_id: Optional[str], user_ids: Iterable[str],
+                  lookup: Callable[[str, Optional[str], Optional[str]], Optional[Dict]]):
+        """
+        一局结果写入战绩后调用，作废可能变化的排行榜
+        :param user_ids: 本局战绩有变化的用户
+        :param lookup: lookup(user_id, 群号或 None, 时间窗口) 返回该用户在这一范围的最新战绩
+        """
+        self._version += 1
+        if not self._data:
+            return
+        user_ids = list(user_ids)
+        scopes = [None] if not group_id else [group_id, None]
+        stats_cache: Dict[Tuple[str, Optional[str], Optional[str]], Optional[Dict]] = {}
+
+        def stats_of(user_id: str, scope: Optional[str], window: Optional[str]) -> Optional[Dict]:
+            key = (user_id, scope, window)
+            if key not in stats_cache:
+                stats_cache[key] = lookup(user_id, scope, window)
+            return stats_cache[key]
+
+        stale = []
+        for scope in scopes:
+            for key in self._by_scope.get(scope, ()):
+                entry = self._data[key]
+                if group_id and key[0] == group_id and entry.scope != group_id:
+                    # 本群此前没有数据、显示的是全局排行，现在有了自己的数据
+                    stale.append(key)
+                elif any(self._affects(entry, key[1], stats_of(user_id, scope, key[2]), user_id)
+                         for user_id in user_ids):
+                    stale.append(key)
+        for key in stale:
+            self._drop(key)
+
+    def _score(self, board: str, stats: Dict) -> float:
+        """榜单的排序分数：胜率类为 score_of()，赌狗榜为局数，等级分榜为等级分"""
+        metric, _ = BOARDS[board]
+        if metric == "total":
+            return stats["total"]
+        if metric == "rating":
+            return stats["rating"]
+        return score_of(self.sort_by, stats["wins"], stats["total"], lowest=metric == "rate_low")
+
+    def _affects(self, entry: _Entry, board: str, stats: Optional[Dict], user_id: str) -> bool:
+        if user_id in entry.members:
+            return True
+        metric, min_games = BOARDS[board]
+        if metric.startswith("rate_") and self.sort_by == "bayes":
+            # 任何一局都会改变范围内的平均胜率，即全部用户的平滑分数
+            return True
+        if not stats or stats.get("rated_games" if metric == "rating" else "total", 0) < max(min_games, 1):
+            return False
+        if entry.cutoff is None:
+            return True
+        # 与榜尾持平时名次取决于次级排序，同样作废
+        score = self._score(board, stats)
+        if metric == "rate_low":
+            return score <= entry.cutoff
+        return score >= entry.cutoff
+
+    def clear(self):
+        self._version += 1
+        self._data.clear()
+        self._by_scope.clear()
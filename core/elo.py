@@ -0,0 +1,193 @@
+import gc
+import heapq
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# 双人对决的 Elo 等级分
+#
+# 每人初始 DEFAULT_RATING 分；一场对决后胜者得到 K × (1 - 预期胜率)，败者扣去同样的分数，
+# 预期胜率 = 1 / (1 + 10^((对手分 - 自己分) / 400))。全局与各群分别计分，多人模式不计分。
+# 分数与对局顺序有关：更改 K 值后需要按时间顺序重放全部对决（见 rebuild() 与 iter_duels()）。
+
+DEFAULT_RATING = 1500.0
+DEFAULT_K = 32.0
+RATED_MIN_GAMES = 5  # 上等级分榜至少需要的对决场数
+
+
+def expected_score(rating: float, opponent: float) -> float:
+    """rating 对阵 opponent 的预期胜率"""
+    return 1.0 / (1.0 + 10.0 ** ((opponent - rating) / 400.0))
+
+
+def rating_delta(winner_rating: float, loser_rating: float, k: float = DEFAULT_K) -> float:
+    """一场对决中胜者得到（败者失去）的分数"""
+    return k * (1.0 - expected_score(winner_rating, loser_rating))
+
+
+class EloRatings:
+    """
+    各范围的等级分
+    范围 -> user_id -> (等级分, 已计分的对决场数)，None 为全局；每场对决只改写两名玩家，O(1)。
+    元组整体替换、不原地修改，dump() 只需浅复制各范围的字典。
+    """
+
+    def __init__(self, k: float = DEFAULT_K, initial: float = DEFAULT_RATING):
+        self.k = k
+        self.initial = initial
+        self._scopes: Dict[Optional[str], Dict[str, Tuple[float, int]]] = {}
+
+    def get(self, scope: Optional[str], user_id: str) -> Optional[Tuple[float, int]]:
+        """返回 (等级分, 对决场数)，没有打过对决时为 None"""
+        return self._scopes.get(scope, {}).get(user_id)
+
+    def update(self, scope: Optional[str], winner_id: str, loser_id: str):
+        """记录一场对决"""
+        users = self._scopes.get(scope)
+        if users is None:
+            users = self._scopes[scope] = {}
+        winner_rating, winner_games = users.get(winner_id, (self.initial, 0))
+        loser_rating, loser_games = users.get(loser_id, (self.initial, 0))
+        delta = rating_delta(winner_rating, loser_rating, self.k)
+        users[winner_id] = (winner_rating + delta, winner_games + 1)
+        users[loser_id] = (loser_rating - delta, loser_games + 1)
+
+    def board(self, scope: Optional[str], limit: int, min_games: int = RATED_MIN_GAMES) -> List[Tuple[str, float, int]]:
+        """
+        等级分排行，分数相同时对决多者在前，再按 user_id 从大到小
+        :return: [(user_id, 等级分, 对决场数), ...]
+        """
+        rows = (
+            (user_id, rating, games)
+            for user_id, (rating, games) in self._scopes.get(scope, {}).items()
+            if games >= min_games
+        )
+        return heapq.nlargest(limit, rows, key=lambda row: (row[1], row[2], row[0]))
+
+    def rebuild(self, duels: Iterable[Tuple[Optional[str], str, str]]) -> int:
+        """
+        清空后按顺序重放对决
+        :param duels: (群号或 None, 胜者, 败者)，每场同时计入全局与所在群
+        :return: 重放的对决场数
+        """
+        # 热循环：局部变量、内联公式，避免每场的方法调用与属性查找；
+        # 期间只新建大量不含循环引用的小元组，暂停循环回收，免得它反复扫描越来越大的表
+        k, initial = self.k, self.initial
+        scopes: Dict[Optional[str], Dict[str, Tuple[float, int]]] = {}
+        start = (initial, 0)
+        global_users = scopes[None] = {}
+        get_scope = scopes.get
+        count = 0
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for group_id, winner_id, loser_id in duels:
+                if group_id:
+                    group_users = get_scope(group_id)
+                    if group_users is None:
+                        group_users = scopes[group_id] = {}
+                    targets = (global_users, group_users)
+                else:
+                    targets = (global_users,)
+                for users in targets:
+                    winner_rating, winner_games = users.get(winner_id, start)
+                    loser_rating, loser_games = users.get(loser_id, start)
+                    delta = k * (1.0 - 1.0 / (1.0 + 10.0 ** ((loser_rating - winner_rating) / 400.0)))
+                    users[winner_id] = (winner_rating + delta, winner_games + 1)
+                    users[loser_id] = (loser_rating - delta, loser_games + 1)
+                count += 1
+        finally:
+            if gc_enabled:
+                gc.enable()
+        self._scopes = scopes
+        return count
+
+    def items(self) -> Iterator[Tuple[Optional[str], str, float, int]]:
+        """遍历全部 (范围, user_id, 等级分, 对决场数)"""
+        for scope, users in self._scopes.items():
+            for user_id, (rating, games) in users.items():
+                yield scope, user_id, rating, games
+
+    def dump(self) -> Dict:
+        """序列化为 JSON 可写的结构，全局范围记为空字符串"""
+        return {scope or "": users.copy() for scope, users in self._scopes.items() if users}
+
+    def load(self, data: Dict):
+        self._scopes = {
+            scope or None: {user_id: (float(rating), int(games)) for user_id, (rating, games) in users.items()}
+            for scope, users in data.items()
+        }
+
+
+def check_coverage(replayed: int, recorded: int, force: bool = False):
+    """
+    重算前检查对局历史是否覆盖了战绩中的全部对决
+    早于对局历史功能、历史已被清理或只导入了战绩时，缺少的对决在重算后不计分，相关玩家的分数会向初始分回落
+    :param replayed: 从对局历史重放的对决场数
+    :param recorded: 战绩中记录的对决场数
+    :raises ValueError: 有对决不在对局历史中且未指定 force
+    """
+    if replayed < recorded and not force:
+        raise ValueError(
+            f"对局历史只有 {replayed} 场对决，战绩中共记录了 {recorded} 场；"
+            f"重算会丢掉其余 {recorded - replayed} 场（早于对局历史、历史已清理或导入的战绩）对等级分的影响"
+        )
+
+
+def history_dirs(data_dir: str) -> List[str]:
+    """数据目录下全部对局历史目录：单实例的 history/ 与多实例部署的 instances/<id>/history/"""
+    dirs = [os.path.join(data_dir, "history")]
+    instances = os.path.join(data_dir, "instances")
+    if os.path.isdir(instances):
+        dirs.extend(sorted(os.path.join(instances, name, "history") for name in os.listdir(instances)))
+    return [path for path in dirs if os.path.isdir(path)]
+
+
+def iter_duels(histories) -> Iterator[Tuple[Optional[str], str, str]]:
+    """
+    从一个或多个对局历史（HistoryLog）按结束时间顺序给出计入战绩的对决
+    :return: (群号或 None, 胜者, 败者)
+    """
+    streams = [history.iter_events(mode="pvp") for history in histories]
+    if not streams:
+        return
+    events = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=lambda event: event["ts"])
+    for event in events:
+        if event["l"] and len(event["w"]) == 1:
+            yield event["g"], event["w"][0], event["l"]
+
+
+if __name__ == "__main__":
+    # 命令行工具：python -m core.elo <数据目录> [--k 32] [--force]
+    # 按对局历史重算等级分，会直接改写数据目录中的战绩，请先停止 AstrBot（运行中请使用 /转盘数据 重算等级分）
+    import argparse
+    import sys
+
+    from .history import HistoryLog
+    from .sqlite_stats import SqliteStatsManager
+    from .stats import StatsManager
+
+    parser = argparse.ArgumentParser(prog="python -m core.elo", description="按对局历史重算等级分")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="战绩存储方式，与插件配置一致")
+    parser.add_argument("--k", type=float, default=DEFAULT_K, help="K 值，与插件配置 elo_k 一致")
+    parser.add_argument("--force", action="store_true", help="对局历史没有覆盖全部对决时仍然重算")
+    parser.add_argument("data_dir")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        parser.error(f"数据目录不存在: {args.data_dir}")
+    if args.backend == "sqlite":
+        manager = SqliteStatsManager(args.data_dir, flush_interval=None, rating_k=args.k)
+    else:
+        manager = StatsManager(args.data_dir, flush_interval=None, rating_k=args.k)
+    logs = [HistoryLog(path, flush_interval=None) for path in history_dirs(args.data_dir)]
+    try:
+        count = manager.rebuild_ratings(iter_duels(logs), force=args.force)
+        print(f"[Roulette] 已按 {count} 场对决重算等级分", file=sys.stderr)
+    except ValueError as e:
+        print(f"[Roulette] {e}，未做改动；确认后加 --force 重算", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        for log in logs:
+            log.close()
+        manager.close()
@@ -0,0 +1,178 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .writer import BackgroundWriter
+
+
+# 对局历史日志
+#
+# history/events.<序号>.<首条时间戳>.ndjson，每行一局，只追加；当前段超过 segment_bytes 后换新段。
+# 每行的字段（键名从简）：
+#   ts 结束时间  st 开始时间  g 群号  m 模式 pvp/multi  p 参与者
+#   l 败者（无人受罚时为 null）  w 计入战绩的胜者  o 结局  b 实弹位置  r 已开枪数  bt 禁言秒数
+# 结局 o：shot 中枪 / surrender 认输 / timeout 最后一发超时 / exit 主动退出 / expired 游戏超时 / admin 管理员结束
+
+OUTCOMES = ("shot", "surrender", "timeout", "exit", "expired", "admin")
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class HistoryLog:
+    """
+    分段轮转的对局历史日志
+    写入方式与战绩一致：record() 只登记到内存，由后台线程合并追加；
+    读取为逐行流式生成器，按时间范围跳过整段，按群号做行内预筛后才解析。
+    """
+
+    def __init__(self, history_dir: str, segment_bytes: int = 4 * 1024 * 1024,
+                 flush_interval: Optional[float] = 2.0, flush_batch: int = 100):
+        self.history_dir = history_dir
+        os.makedirs(history_dir, exist_ok=True)
+        self.segment_bytes = max(1024, segment_bytes)
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._pending: List[str] = []
+        self._file = None
+        self._seq = 0
+        segments = self.segments()
+        if segments:
+            self._seq = segments[-1][0]
+            self._file = open(segments[-1][2], 'a', encoding='utf-8')
+        self._writer = None
+        if flush_interval is not None:
+            self._writer = BackgroundWriter(
+                self.flush, interval=flush_interval, max_pending=flush_batch, name="roulette-history"
+            )
+
+    def segments(self) -> List[Tuple[int, int, str]]:
+        """按顺序列出日志段 [(序号, 首条时间戳, 路径), ...]"""
+        found = []
+        for name in os.listdir(self.history_dir):
+            parts = name.split(".")
+            if len(parts) != 4 or parts[0] != "events" or parts[3] != "ndjson":
+                continue
+            if parts[1].isdigit() and parts[2].isdigit():
+                found.append((int(parts[1]), int(parts[2]), os.path.join(self.history_dir, name)))
+        found.sort()
+        return found
+
+    def record(self, group_id: Optional[str], room, outcome: str, loser_id: Optional[str] = None,
+               winner_ids: Optional[List[str]] = None, ended_at: Optional[float] = None):
+        """
+        记录一局已结束的游戏
+        :param room: 结束时的 Room
+        :param outcome: 结局，见 OUTCOMES
+        :param loser_id: 败者，无人受罚时为 None
+        :param winner_ids: 计入战绩的胜者
+        """
+        ended_at = time.time() if ended_at is None else ended_at
+        event = {
+            "ts": round(ended_at, 3),
+            "st": round(room.started_at, 3),
+            "g": group_id,
+            "m": "pvp" if room.players else "multi",
+            "p": room.get_all_participants(),
+            "l": loser_id,
+            "w": winner_ids or [],
+            "o": outcome,
+            "b": room.bullet,
+            "r": room.round,
+            "bt": room.ban_time,
+        }
+        with self._lock:
+            self._pending.append(_dumps(event))
+        if self._writer:
+            self._writer.mark_dirty()
+        else:
+            self.flush()
+
+    def flush(self):
+        """把登记的事件追加到当前段，必要时换新段"""
+        with self._io_lock:
+            with self._lock:
+                lines, self._pending = self._pending, []
+            for line in lines:
+                try:
+                    if self._file is None or self._file.tell() >= self.segment_bytes:
+                        self._rotate(json.loads(line)["ts"])
+                    self._file.write(line + "\n")
+                except Exception as e:
+                    print(f"[Roulette] 写入对局历史失败: {e}")
+            if lines and self._file:
+                self._file.flush()
+
+    def _rotate(self, first_ts: float):
+        """开启新的日志段（调用方持有 _io_lock）"""
+        if self._file:
+            self._file.close()
+        self._seq += 1
+        path = os.path.join(self.history_dir, f"events.{self._seq:08d}.{int(first_ts)}.ndjson")
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def close(self):
+        """停止后台写入线程并写完剩余事件"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self.flush()
+        with self._io_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+    def iter_events(self, group_id: Optional[str] = None, user_id: Optional[str] = None,
+                    since: Optional[float] = None, until: Optional[float] = None,
+                    mode: Optional[str] = None) -> Iterator[Dict]:
+        """
+        按写入顺序流式读取对局，内存占用与日志大小无关
+        :param group_id: 只看该群
+        :param user_id: 只看该用户参与的对局
+        :param since: 结束时间下限（含）
+        :param until: 结束时间上限（不含）
+        :param mode: 只看该模式 pvp/multi
+        """
+        group_marker = f'"g":{_dumps(group_id)},' if group_id is not None else None
+        user_marker = _dumps(user_id) if user_id is not None else None
+        mode_marker = f'"m":{_dumps(mode)},' if mode is not None else None
+        segments = self.segments()
+        for i, (_, first_ts, path) in enumerate(segments):
+            # 时间随写入顺序递增（文件名中的首条时间戳取整到秒）：
+            # 本段首条已到上限则后面都不用看；下一段首条早于下限则本段整段跳过
+            if until is not None and first_ts >= until:
+                break
+            if since is not None and i + 1 < len(segments) and segments[i + 1][1] + 1 <= since:
+                continue
+            try:
+                f = open(path, 'r', encoding='utf-8')
+            except OSError as e:
+                print(f"[Roulette] 读取对局历史 {path} 失败: {e}")
+                continue
+            with f:
+                for line in f:
+                    if group_marker and group_marker not in line:
+                        continue
+                    if user_marker and user_marker not in line:
+                        continue
+                    if mode_marker and mode_marker not in line:
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中途崩溃留下的残缺行
+                        continue
+                    if since is not None and event["ts"] < since:
+                        continue
+                    if until is not None and event["ts"] >= until:
+                        continue
+                    if group_id is not None and event["g"] != group_id:
+                        continue
+                    if user_id is not None and user_id not in event["p"]:
+                        continue
+                    if mode is not None and event["m"] != mode:
+                        continue
+                    yield event
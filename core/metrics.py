@@ -0,0 +1,241 @@
+import contextvars
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# 延迟直方图的桶上界（秒），与 Prometheus 客户端默认值一致
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 当前正在处理的指令名，平台请求的计数按它归属到指令
+current_command: contextvars.ContextVar[str] = contextvars.ContextVar("roulette_command", default="")
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+    items = key + extra
+    if not items:
+        return ""
+    escaped = (
+        (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for k, v in items
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+class Histogram:
+    """固定桶直方图，记录次数、总和与各桶计数"""
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # 最后一格为 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """按桶上界估计分位数，落在 +Inf 桶时返回最后一个有限上界"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return self.buckets[-1]
+
+
+class MetricsRegistry:
+    """
+    进程内指标
+    计数器与直方图按 (名称, 标签) 存放，加一次锁即可更新，可在事件循环和后台写入线程中共用；
+    仪表（gauge）以回调形式注册，导出时才取值。render() 输出 Prometheus 文本格式。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help: Dict[str, Tuple[str, str]] = {}  # 名称 -> (类型, 说明)
+        self._counters: Dict[str, Dict[LabelKey, float]] = {}
+        self._histograms: Dict[str, Dict[LabelKey, Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._gauges: Dict[str, Callable[[], float]] = {}
+        self._dump_stop: Optional[threading.Event] = None
+
+    def describe(self, name: str, kind: str, help_text: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self._help[name] = (kind, help_text)
+        if kind == "histogram":
+            self._buckets[name] = buckets
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(self._buckets.get(name, DEFAULT_BUCKETS))
+            histogram.observe(value)
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float]):
+        """注册导出时才求值的仪表"""
+        self._help[name] = ("gauge", help_text)
+        self._gauges[name] = func
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """计时上下文：把耗时记入直方图 name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def track_command(self, command: str):
+        """
+        指令处理器装饰器：统计调用次数、异常次数与耗时，并把期间的平台请求归属到该指令
+        耗时包含各次 yield 之间框架发送消息的时间
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                token = current_command.set(command)
+                start = time.perf_counter()
+                status = "ok"
+                try:
+                    async for result in func(*args, **kwargs):
+                        yield result
+                except BaseException:
+                    status = "error"
+                    raise
+                finally:
+                    try:
+                        current_command.reset(token)
+                    except ValueError:
+                        # 生成器在其他上下文中被关闭
+                        pass
+                    self.observe("roulette_command_seconds", time.perf_counter() - start, command=command)
+                    self.inc("roulette_commands_total", command=command, status=status)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def track_rpc(self, rpc: str):
+        """平台请求计时，按当前指令归属"""
+        command = current_command.get()
+        start = time.perf_counter()
+        status = "ok"
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe("roulette_rpc_seconds", time.perf_counter() - start, rpc=rpc)
+            self.inc("roulette_rpc_total", rpc=rpc, command=command, status=status)
+
+    def counters(self, name: str) -> Dict[LabelKey, float]:
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def histograms(self, name: str) -> Dict[LabelKey, Histogram]:
+        with self._lock:
+            return dict(self._histograms.get(name, {}))
+
+    def gauge_values(self) -> Dict[str, float]:
+        values = {}
+        for name, func in self._gauges.items():
+            try:
+                values[name] = func()
+            except Exception as e:
+                print(f"[Roulette] 读取指标 {name} 失败: {e}")
+        return values
+
+    def render(self) -> str:
+        """导出为 Prometheus 文本格式"""
+        lines: List[str] = []
+
+        def header(name: str, kind: str):
+            help_text = self._help.get(name, (kind, name))[1]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        for name, value in sorted(self.gauge_values().items()):
+            header(name, "gauge")
+            lines.append(f"{name} {value}")
+        with self._lock:
+            for name in sorted(self._counters):
+                header(name, "counter")
+                for key, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(key)} {value}")
+            for name in sorted(self._histograms):
+                header(name, "histogram")
+                for key, histogram in sorted(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', repr(bound)),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_format_labels(key, (('le', '+Inf'),))} {histogram.count}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                    lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: str):
+        """写入指标文件（先写临时文件再改名，供 node_exporter textfile 等采集）"""
+        tmp_file = path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_file, path)
+
+    def start_dump(self, path: str, interval: float):
+        """启动后台线程，每 interval 秒写一次指标文件"""
+        self.stop_dump()
+        stop = self._dump_stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval):
+                try:
+                    self.dump(path)
+                except Exception as e:
+                    print(f"[Roulette] 写入指标文件失败: {e}")
+
+        threading.Thread(target=run, name="roulette-metrics", daemon=True).start()
+
+    def stop_dump(self):
+        if self._dump_stop:
+            self._dump_stop.set()
+            self._dump_stop = None
+
+
+# 进程内共享的指标
+metrics = MetricsRegistry()
+metrics.describe("roulette_commands_total", "counter", "指令调用次数")
+metrics.describe("roulette_command_seconds", "histogram", "指令处理耗时（秒）")
+metrics.describe("roulette_rpc_total", "counter", "平台请求次数（按发起指令归属）")
+metrics.describe("roulette_rpc_seconds", "histogram", "平台请求耗时（秒）")
+metrics.describe("roulette_name_cache_total", "counter", "昵称缓存查询次数")
+metrics.describe("roulette_board_cache_total", "counter", "排行榜回复缓存查询次数")
+metrics.describe("roulette_stats_seconds", "histogram", "战绩记录与落盘耗时（秒）")
+metrics.describe("roulette_rooms_reaped_total", "counter", "因定时器丢失被回收的房间数")
+metrics.describe("roulette_actions_total", "counter", "平台动作结果（ok 成功 / retry 重试 / dead 放弃 / dropped 队列已满）")
+metrics.describe("roulette_action_wait_seconds", "histogram", "平台动作从提交到首次执行的排队耗时（秒）")
@@ -1,12 +1,27 @@
+import itertools
 import random
 import threading
-from typing import List, Optional
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from .room_store import RoomStore
+from .timer_wheel import TimerHandle, TimingWheel
+
+
+# 进程内递增的房间号，定时器等只保存房间号而不引用房间对象
+_room_ids = itertools.count(1)
 
 
 class Room:
-    """内部房间类，不对外暴露 room_id"""
+    """
+    内部房间类，room_id 只用于定时器等在进程内找回房间
+    timers 为该房间的定时器（种类 -> 句柄），由 GameManager 登记并在注销房间时统一取消
+    origin 为开局所在会话的标识（unified_msg_origin），重启恢复后用它发送超时提示
+    """
 
-    def __init__(self, players: list[str], ban_time:int):
+    def __init__(self, players: list[str], ban_time:int, origin: str = ""):
+        self.room_id = next(_room_ids)
+        self.origin = origin
         self.players = players
         self.ban_time = ban_time
         self.bullet = random.randint(1, 6)
@@ -14,6 +29,9 @@ class Room:
         # 双人模式：随机先手
         self.next_idx: Optional[int] = random.randint(0, 1) if players else None
         self.participated: set = set()  # 记录多人模式下已参与的玩家
+        self.started_at = time.time()
+        self.updated_at = self.started_at  # 最近一次状态变化
+        self.timers: Dict[str, TimerHandle] = {}
 
     @property
     def over(self) -> bool:
@@ -38,6 +56,7 @@ class Room:
                 return False
             self.participated.add(shooter)
             self.round += 1
+            self.updated_at = time.time()
             return self.round == self.bullet
 
         # 双人模式：固定玩家列表
@@ -49,11 +68,49 @@ class Room:
             return False
 
         self.round += 1
+        self.updated_at = time.time()
         # 切换枪手
         self.next_idx = 1 - self.next_idx
 
         return self.round == self.bullet
     
+    def to_state(self) -> Dict:
+        """可 JSON 序列化的房间状态，定时器只保存种类和到期时间"""
+        return {
+            "room_id": self.room_id,
+            "origin": self.origin,
+            "players": self.players,
+            "ban_time": self.ban_time,
+            "bullet": self.bullet,
+            "round": self.round,
+            "next_idx": self.next_idx,
+            "participated": sorted(self.participated),
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+            "timers": {kind: handle.deadline for kind, handle in self.timers.items() if not handle.cancelled},
+        }
+
+    @classmethod
+    def from_state(cls, state: Dict) -> "Room":
+        """由 to_state() 的结果重建房间（分配新的 room_id，不含定时器）"""
+        room = cls(list(state["players"]), state["ban_time"], state.get("origin", ""))
+        room.bullet = state["bullet"]
+        room.round = state["round"]
+        room.next_idx = state["next_idx"]
+        room.participated = set(state["participated"])
+        room.started_at = state["started_at"]
+        room.updated_at = state["updated_at"]
+        return room
+
+    def has_live_timer(self) -> bool:
+        return any(not handle.cancelled for handle in self.timers.values())
+
+    def release(self):
+        """取消房间的全部定时器"""
+        for handle in self.timers.values():
+            handle.cancel()
+        self.timers.clear()
+
     def get_all_participants(self) -> List[str]:
         """获取所有参与者（包括固定玩家和多人模式下的参与者）"""
         if self.players:
@@ -61,62 +118,347 @@ class Room:
         return list(self.participated)
 
 
-class GameManager:
+# GameManager 状态转换的结果
+NO_ROOM = "no_room"                # 没有可操作的房间
+NOT_YOUR_TURN = "not_your_turn"    # 双人模式不是该玩家的回合
+ALREADY_JOINED = "already_joined"  # 多人模式已参与过
+LAST_ROUND = "last_round"          # 最后一发由该玩家开枪，不能退出
+MISS = "miss"                      # 开枪没响，游戏继续
+BANG = "bang"                      # 中枪，房间已注销
+ENDED = "ended"                    # 认输/退出成功，房间已注销
+
+
+class Transition(NamedTuple):
+    """
+    一次原子状态转换的结果
+    round / next_player 是转换完成那一刻的快照，调用方 await 之后房间可能已被其他指令推进，不应再读 room 上的同名字段
+    """
+    outcome: str
+    room: Optional[Room] = None
+    round: int = 0
+    next_player: Optional[str] = None
+
+
+class _GroupRooms:
+    """一个群内的房间：玩家 -> 双人房间，以及至多一个多人房间"""
+
+    __slots__ = ("players", "multi")
+
+    def __init__(self):
+        self.players: Dict[str, Room] = {}
+        self.multi: Optional[Room] = None
+
+
+class _Stripe:
+    __slots__ = ("lock", "groups")
+
     def __init__(self):
-        self._lock = threading.Lock()
-        self.room: dict[str, Room] = {}  # player_id -> room 实例
+        self.lock = threading.Lock()
+        self.groups: Dict[str, _GroupRooms] = {}
+
+
+class GameManager:
+    """
+    房间注册表
+    按群号哈希分成若干条带，每条带一把锁管理 群 -> 玩家 -> 房间 的嵌套索引，不同群的操作互不阻塞。
+    锁只在同步代码里短暂持有、从不跨越 await，可同时在事件循环和其他线程中使用。
+    开枪、认输、退出都在同一次持锁内完成“检查回合 + 推进状态 + 必要时注销房间”，
+    并发送达的同一指令只有一个能成功。
+    每个房间的定时器登记在房间上（arm），注销房间（teardown 及各终局转换）时一并取消；
+    定时器丢失而滞留的房间由 reap 回收。
+    给出 store 时，每次房间状态变化都登记到 RoomStore，重启后由 restore 恢复。
+    """
+
+    def __init__(self, stripes: int = 64, timers: Optional[TimingWheel] = None, store: Optional[RoomStore] = None):
+        self._stripes = [_Stripe() for _ in range(max(1, stripes))]
+        self.timers = timers
+        self.store = store
+
+    def _save(self, group_id: str, room: Room):
+        """登记房间最新状态（调用方持有条带锁）"""
+        if self.store:
+            self.store.put(group_id, room.to_state())
+
+    def _stripe(self, group_id: str) -> _Stripe:
+        return self._stripes[hash(group_id) % len(self._stripes)]
+
+    @staticmethod
+    def _find(rooms: Optional[_GroupRooms], player_id: str) -> Optional[Room]:
+        """玩家所在的房间：优先双人，其次本群多人（调用方持有条带锁）"""
+        if rooms is None:
+            return None
+        if player_id and (room := rooms.players.get(player_id)):
+            return room
+        return rooms.multi
+
+    @staticmethod
+    def _registered(rooms: Optional[_GroupRooms], room: Room) -> bool:
+        if rooms is None:
+            return False
+        return rooms.multi is room or any(rooms.players.get(p) is room for p in room.players)
+
+    def _unregister(self, stripe: _Stripe, group_id: str, room: Room) -> bool:
+        """从索引中注销房间并取消它的定时器，房间已不在索引中时返回 False（调用方持有条带锁）"""
+        room.release()
+        if self.store:
+            self.store.delete(room.room_id)
+        rooms = stripe.groups.get(group_id)
+        if rooms is None:
+            return False
+        removed = False
+        if rooms.multi is room:
+            rooms.multi = None
+            removed = True
+        for p in room.players:
+            if rooms.players.get(p) is room:
+                del rooms.players[p]
+                removed = True
+        if not rooms.players and rooms.multi is None:
+            del stripe.groups[group_id]
+        return removed
 
     def create_room(
-        self, kids: list[str], ban_time: int = 0
+        self, kids: list[str], ban_time: int = 0, origin: str = ""
     ) -> Room | None:
-        """创建房间"""
+        """
+        创建房间
+        :param origin: 开局所在会话的标识
+        """
         sender_id, target_id, group_id = kids[0], kids[1], kids[2]
-        with self._lock:
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            rooms = stripe.groups.get(group_id)
             # 双人模式：检查双方是否在游戏中
             if sender_id and target_id:
-                k1 = f"{group_id}:{sender_id}"
-                k2 = f"{group_id}:{target_id}"
-                if k1 in self.room or k2 in self.room:
+                if rooms and (sender_id in rooms.players or target_id in rooms.players):
                     return None
-                room = Room(players=[sender_id, target_id], ban_time=ban_time)
-                self.room[k1] = room
-                self.room[k2] = room
+                room = Room(players=[sender_id, target_id], ban_time=ban_time, origin=origin)
+                if rooms is None:
+                    rooms = stripe.groups[group_id] = _GroupRooms()
+                rooms.players[sender_id] = room
+                rooms.players[target_id] = room
+                self._save(group_id, room)
                 return room
             # 多人模式：只检查群是否已有多人游戏
             elif group_id:
-                k_group = f"{group_id}:group"
-                if k_group in self.room:
+                if rooms and rooms.multi:
                     return None
-                room = Room(players=[], ban_time=ban_time)
-                self.room[k_group] = room
+                room = Room(players=[], ban_time=ban_time, origin=origin)
+                if rooms is None:
+                    rooms = stripe.groups[group_id] = _GroupRooms()
+                rooms.multi = room
+                self._save(group_id, room)
                 return room
 
     def get_room(self, kids: list[str]) -> Room | None:
         """获取房间"""
         sender_id, target_id, group_id = kids[0], kids[1], kids[2]
-        with self._lock:
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            rooms = stripe.groups.get(group_id)
+            if rooms is None:
+                return None
             if sender_id:
-                if room := self.room.get(f"{group_id}:{sender_id}"): return room
+                if room := rooms.players.get(sender_id): return room
             if target_id:
-                if room := self.room.get(f"{group_id}:{target_id}"): return room
+                if room := rooms.players.get(target_id): return room
             if group_id:
-                if room := self.room.get(f"{group_id}:group"): return room
+                return rooms.multi
             return None
 
+    def find_room(self, group_id: str, room_id: int) -> Room | None:
+        """按房间号查找仍在进行的房间"""
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            rooms = stripe.groups.get(group_id)
+            if rooms is None:
+                return None
+            if rooms.multi and rooms.multi.room_id == room_id:
+                return rooms.multi
+            return next((room for room in rooms.players.values() if room.room_id == room_id), None)
+
+    def room_count(self) -> int:
+        """进行中的房间数"""
+        count = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for rooms in stripe.groups.values():
+                    # 双人房间在玩家表中有两个键
+                    count += len(rooms.players) // 2 + (rooms.multi is not None)
+        return count
+
     def has_room(self, kid: str, group_id: str) -> bool:
         """玩家是否已在房间"""
-        with self._lock:
-            return f"{group_id}:{kid}" in self.room
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            rooms = stripe.groups.get(group_id)
+            return rooms is not None and kid in rooms.players
 
     def del_room(self, group_id: str, players: list[str] = None):
         """即销毁房间"""
-        with self._lock:
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            rooms = stripe.groups.get(group_id)
+            if rooms is None:
+                return
             if players:
                 for p in players:
-                    k = f"{group_id}:{p}"
-                    if k in self.room:
-                        self.room.pop(k)
-            
-            k_group = f"{group_id}:group"
-            if k_group in self.room:
-                self.room.pop(k_group)
+                    if room := rooms.players.pop(p, None):
+                        room.release()
+                        if self.store:
+                            self.store.delete(room.room_id)
+            if rooms.multi:
+                rooms.multi.release()
+                if self.store:
+                    self.store.delete(rooms.multi.room_id)
+            rooms.multi = None
+            if not rooms.players:
+                del stripe.groups[group_id]
+
+    def teardown(self, group_id: str, room: Room) -> bool:
+        """
+        注销指定房间并释放它的全部资源（索引项与定时器），仅当它仍在注册表中时返回 True
+        超时任务、管理员结束等以此抢占房间，与并发的开枪/认输之间只有一方能结束同一局
+        """
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            return self._unregister(stripe, group_id, room)
+
+    def arm(self, group_id: str, room: Room, kind: str, delay: float, callback: Callable, *args) -> Optional[TimerHandle]:
+        """
+        为房间登记定时器，同一种类只保留最新的一个；房间已结束时不登记并返回 None
+        需在事件循环中调用
+        :param kind: 定时器种类，如 "game" / "last_round"
+        """
+        return self.arm_at(group_id, room, kind, time.time() + delay, callback, *args)
+
+    def arm_at(self, group_id: str, room: Room, kind: str, deadline: float, callback: Callable, *args) -> Optional[TimerHandle]:
+        """同 arm，按墙钟到期时间登记（恢复房间时沿用原到期时间）"""
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            if not self._registered(stripe.groups.get(group_id), room):
+                return None
+            old = room.timers.pop(kind, None)
+            if old:
+                old.cancel()
+            handle = room.timers[kind] = self.timers.schedule_at(deadline, callback, *args)
+            self._save(group_id, room)
+            return handle
+
+    def disarm(self, group_id: str, room: Room, kind: str):
+        """取消房间的某种定时器"""
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            handle = room.timers.pop(kind, None)
+            if handle:
+                handle.cancel()
+                if self._registered(stripe.groups.get(group_id), room):
+                    self._save(group_id, room)
+
+    def timer_count(self) -> int:
+        """各房间上待触发的定时器数"""
+        count = 0
+        for stripe in self._stripes:
+            with stripe.lock:
+                for rooms in stripe.groups.values():
+                    for room in {*rooms.players.values(), *([rooms.multi] if rooms.multi else [])}:
+                        count += sum(not handle.cancelled for handle in room.timers.values())
+        return count
+
+    def restore(self, saved: List[Dict]) -> List[Tuple[str, Room, Dict[str, float]]]:
+        """
+        重新登记 RoomStore.load() 读出的房间，与已有房间冲突的跳过
+        定时器需由调用方按返回的到期时间用 arm_at 重新登记
+        :return: [(group_id, room, {定时器种类: 到期时间}), ...]
+        """
+        restored = []
+        for item in saved:
+            group_id, state = item["g"], item["room"]
+            room = Room.from_state(state)
+            stripe = self._stripe(group_id)
+            with stripe.lock:
+                rooms = stripe.groups.get(group_id)
+                if room.players:
+                    if rooms and any(p in rooms.players for p in room.players):
+                        continue
+                elif rooms and rooms.multi:
+                    continue
+                if rooms is None:
+                    rooms = stripe.groups[group_id] = _GroupRooms()
+                if room.players:
+                    for p in room.players:
+                        rooms.players[p] = room
+                else:
+                    rooms.multi = room
+                self._save(group_id, room)
+            restored.append((group_id, room, state.get("timers", {})))
+        return restored
+
+    def reap(self, idle: float, now: Optional[float] = None) -> List[Tuple[str, Room]]:
+        """
+        回收没有任何待触发定时器、且已闲置 idle 秒以上的房间
+        这类房间通常是处理器中途出错、定时器没登记上留下的，正常情况下不会出现
+        :return: 被回收的 [(group_id, room), ...]
+        """
+        now = time.time() if now is None else now
+        reaped = []
+        for stripe in self._stripes:
+            with stripe.lock:
+                for group_id, rooms in list(stripe.groups.items()):
+                    candidates = {*rooms.players.values(), *([rooms.multi] if rooms.multi else [])}
+                    for room in candidates:
+                        if not room.has_live_timer() and now - room.updated_at >= idle:
+                            self._unregister(stripe, group_id, room)
+                            reaped.append((group_id, room))
+        return reaped
+
+    def try_shoot(self, group_id: str, shooter: str) -> Transition:
+        """
+        原子开枪：查房间、检查回合、推进轮次在同一次持锁内完成，中枪时同时注销房间
+        :return: outcome 为 NO_ROOM / NOT_YOUR_TURN / ALREADY_JOINED / MISS / BANG
+        """
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            room = self._find(stripe.groups.get(group_id), shooter)
+            if room is None or room.over:
+                return Transition(NO_ROOM)
+            if not room.can_shoot(shooter):
+                outcome = ALREADY_JOINED if not room.players and shooter in room.participated else NOT_YOUR_TURN
+                return Transition(outcome, room, room.round)
+            hit = room.shoot(shooter)
+            next_player = room.players[room.next_idx] if room.next_idx is not None else None
+            if hit:
+                self._unregister(stripe, group_id, room)
+                return Transition(BANG, room, room.round, next_player)
+            self._save(group_id, room)
+            return Transition(MISS, room, room.round, next_player)
+
+    def try_surrender(self, group_id: str, user_id: str) -> Transition:
+        """
+        原子认输：必须轮到该玩家，成功时注销房间
+        :return: outcome 为 NO_ROOM / NOT_YOUR_TURN / ENDED
+        """
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            room = self._find(stripe.groups.get(group_id), user_id)
+            if room is None:
+                return Transition(NO_ROOM)
+            if not room.can_shoot(user_id):
+                return Transition(NOT_YOUR_TURN, room, room.round)
+            self._unregister(stripe, group_id, room)
+            return Transition(ENDED, room, room.round)
+
+    def try_exit(self, group_id: str, user_id: str) -> Transition:
+        """
+        原子退出：最后一发轮到该玩家时不允许，成功时注销房间
+        :return: outcome 为 NO_ROOM / LAST_ROUND / ENDED
+        """
+        stripe = self._stripe(group_id)
+        with stripe.lock:
+            room = self._find(stripe.groups.get(group_id), user_id)
+            if room is None:
+                return Transition(NO_ROOM)
+            if 6 - room.round == 1 and room.can_shoot(user_id):
+                return Transition(LAST_ROUND, room, room.round)
+            self._unregister(stripe, group_id, room)
+            return Transition(ENDED, room, room.round)
@@ -0,0 +1,103 @@
+from bisect import bisect_left, insort
+from typing import Dict, Hashable, Iterable, Iterator, List, Tuple
+
+
+class RankIndex:
+    """
+    有序排名索引
+    维护 (排序键..., user_id) 的分块有序列表：全部键按序切成若干块，每块不超过 2 × BLOCK 个元素，
+    另存每块的最大键。更新时先对块最大键二分找到所在块（O(log n)），再在块内二分插入/删除，
+    移动的元素不超过块长（与用户总数无关）；块过大时对半拆分，块为空时移除。
+    取前 k 名只需从一端依次读取 k 个元素。
+    """
+
+    BLOCK = 512
+
+    def __init__(self):
+        self._blocks: List[List[Tuple]] = []
+        self._maxes: List[Tuple] = []  # 每块的最大键，与 _blocks 对齐
+        self._key_of: Dict[str, Tuple] = {}  # user_id -> 当前键
+
+    def __len__(self) -> int:
+        return len(self._key_of)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._key_of
+
+    def bulk_load(self, entries: Iterable[Tuple[str, Tuple]]):
+        """一次性装载 (user_id, 排序键) 并整体排序，用于首次建立索引"""
+        for user_id, key in entries:
+            self._key_of[user_id] = (*key, user_id)
+        keys = sorted(self._key_of.values())
+        self._blocks = [keys[i:i + self.BLOCK] for i in range(0, len(keys), self.BLOCK)]
+        self._maxes = [block[-1] for block in self._blocks]
+
+    def update(self, user_id: str, *key: Hashable):
+        """插入或移动用户的位置"""
+        new_key = (*key, user_id)
+        old_key = self._key_of.get(user_id)
+        if old_key == new_key:
+            return
+        if old_key is not None:
+            self._remove_key(old_key)
+        self._insert_key(new_key)
+        self._key_of[user_id] = new_key
+
+    def discard(self, user_id: str):
+        """移除用户（不存在时忽略）"""
+        old_key = self._key_of.pop(user_id, None)
+        if old_key is not None:
+            self._remove_key(old_key)
+
+    def _insert_key(self, key: Tuple):
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            return
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            # 比全部键都大：追加到最后一块
+            i -= 1
+            self._blocks[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._blocks[i], key)
+        block = self._blocks[i]
+        if len(block) > 2 * self.BLOCK:
+            half = len(block) // 2
+            self._blocks[i:i + 1] = [block[:half], block[half:]]
+            self._maxes[i:i + 1] = [block[half - 1], block[-1]]
+
+    def _remove_key(self, key: Tuple):
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            return
+        block = self._blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return
+        del block[j]
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+        elif j == len(block):
+            self._maxes[i] = block[-1]
+
+    def count_below(self, *key: Hashable) -> int:
+        """键小于 key 的用户数；key 可以只给前几项，如 (胜率,) 表示胜率严格低于它的用户数"""
+        i = bisect_left(self._maxes, key)
+        if i == len(self._blocks):
+            return len(self._key_of)
+        return sum(len(block) for block in self._blocks[:i]) + bisect_left(self._blocks[i], key)
+
+    def highest(self) -> Iterator[str]:
+        """按键从大到小依次给出 user_id"""
+        for block in reversed(self._blocks):
+            for i in range(len(block) - 1, -1, -1):
+                yield block[i][-1]
+
+    def lowest(self) -> Iterator[str]:
+        """按键从小到大依次给出 user_id"""
+        for block in self._blocks:
+            for key in block:
+                yield key[-1]
@@ -0,0 +1,224 @@
+import math
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # 未安装 numpy 时退回逐个计算，结果相同
+    np = None
+
+
+# 排行榜排序方式
+#   rate    原始胜率 wins / total
+#   wilson  Wilson 置信区间：胜率榜按下界、散财榜按上界排序，局数少的极端胜率不会轻易霸榜
+#   bayes   贝叶斯平滑：(wins + 权重 × 范围内平均胜率) / (total + 权重)
+SORT_KEYS = ("rate", "wilson", "bayes")
+
+# 并列规则（两种存储、全部战绩与近期排行一致）：
+#   赌圣榜 / 赌狗榜 / 等级分榜按 (分数, 局数, user_id) 整体从大到小，
+#   散财榜按 (分数, 局数, user_id) 整体从小到大，即恰为赌圣榜的逆序
+
+WILSON_Z = 1.96             # 95% 置信
+BAYES_PRIOR_WEIGHT = 10     # 先验相当于按平均胜率打过的局数
+
+
+def wilson_bound(wins: int, total: int, upper: bool = False, z: float = WILSON_Z) -> float:
+    """单个用户胜率的 Wilson 置信区间下界（upper=True 时为上界）"""
+    if total <= 0:
+        return 0.0
+    p = wins / total
+    z2 = z * z
+    center = p + z2 / (2 * total)
+    margin = z * math.sqrt(p * (1 - p) / total + z2 / (4 * total * total))
+    # 全负的下界、全胜的上界恰为 0 / 1，直接给出，避免这些用户之间按浮点误差排序
+    if not upper and wins == 0:
+        return 0.0
+    if upper and wins == total:
+        return 1.0
+    return (center + margin if upper else center - margin) / (1 + z2 / total)
+
+
+def score_of(sort_by: str, wins: int, total: int, lowest: bool = False, prior: float = 0.5,
+             weight: float = BAYES_PRIOR_WEIGHT) -> float:
+    """
+    单个用户的排序分数
+    :param lowest: 是否用于散财榜（胜率低者在前），wilson 此时取上界
+    :param prior: bayes 的先验胜率（范围内的平均胜率）
+    """
+    if total <= 0:
+        return 0.0
+    if sort_by == "wilson":
+        return wilson_bound(wins, total, upper=lowest)
+    if sort_by == "bayes":
+        return (wins + weight * prior) / (total + weight)
+    return wins / total
+
+
+class CounterTable:
+    """
+    一个范围内全部用户的数组化计数
+    user_id -> 下标，局数 / 胜场存放在连续数组中；一局结果只改写对应下标，O(1)。
+    排序分数在查询时对整列一次算出（有 numpy 时向量化）并缓存：之后的改动只重算该用户的分数，
+    bayes 的先验随每局结果变化，改动后整列重算。取排行用部分选择，单个用户的百分位只需一次整列比较，都不排序全表。
+    """
+
+    def __init__(self, prior_weight: float = BAYES_PRIOR_WEIGHT):
+        self.prior_weight = prior_weight
+        self._ids: List[str] = []
+        self._pos: Dict[str, int] = {}
+        if np is not None:
+            self._total = np.zeros(64, dtype=np.int64)
+            self._wins = np.zeros(64, dtype=np.int64)
+        else:
+            self._total = array("q")
+            self._wins = array("q")
+        self._cache: Dict[Tuple, object] = {}
+
+    @classmethod
+    def from_counts(cls, counts: Iterable[Tuple[str, int, int]], prior_weight: float = BAYES_PRIOR_WEIGHT) -> "CounterTable":
+        """由 (user_id, 局数, 胜场) 一次性建立"""
+        table = cls(prior_weight)
+        totals, wins = [], []
+        for user_id, user_total, user_wins in counts:
+            if user_id in table._pos:
+                totals[table._pos[user_id]], wins[table._pos[user_id]] = user_total, user_wins
+                continue
+            table._pos[user_id] = len(table._ids)
+            table._ids.append(user_id)
+            totals.append(user_total)
+            wins.append(user_wins)
+        if np is not None:
+            table._total = np.array(totals or [0], dtype=np.int64)
+            table._wins = np.array(wins or [0], dtype=np.int64)
+        else:
+            table._total = array("q", totals)
+            table._wins = array("q", wins)
+        return table
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def set(self, user_id: str, total: int, wins: int):
+        """写入用户的最新计数"""
+        index = self._pos.get(user_id)
+        if index is None:
+            index = self._append(user_id)
+        self._total[index] = total
+        self._wins[index] = wins
+        self._refresh(index)
+
+    def add(self, user_id: str, total: int, wins: int):
+        """在用户的计数上累加"""
+        index = self._pos.get(user_id)
+        if index is None:
+            index = self._append(user_id)
+        self._total[index] += total
+        self._wins[index] += wins
+        self._refresh(index)
+
+    def _append(self, user_id: str) -> int:
+        index = self._pos[user_id] = len(self._ids)
+        self._ids.append(user_id)
+        if np is None:
+            self._total.append(0)
+            self._wins.append(0)
+        elif index == len(self._total):
+            self._total = np.concatenate([self._total, np.zeros_like(self._total)])
+            self._wins = np.concatenate([self._wins, np.zeros_like(self._wins)])
+        # 已缓存的分数列少了这个用户，整列作废
+        self._cache.clear()
+        return index
+
+    def _refresh(self, index: int):
+        """只重算一个用户的已缓存分数；bayes 的先验随之变化，整列作废"""
+        total, wins = int(self._total[index]), int(self._wins[index])
+        for key in list(self._cache):
+            _, sort_by, lowest = key
+            if sort_by == "bayes":
+                del self._cache[key]
+            else:
+                self._cache[key][index] = score_of(sort_by, wins, total, lowest)
+
+    def _columns(self):
+        n = len(self._ids)
+        return self._total[:n], self._wins[:n]
+
+    def prior(self) -> float:
+        """范围内的平均胜率（全部胜场 / 全部局数）"""
+        total, wins = self._columns()
+        all_games = int(total.sum()) if np is not None else sum(total)
+        return (int(wins.sum()) if np is not None else sum(wins)) / all_games if all_games else 0.5
+
+    def scores(self, sort_by: str, lowest: bool = False):
+        """全部用户的排序分数，与 user_id 下标对齐；局数为 0 的用户为 0"""
+        key = ("scores", sort_by, lowest)
+        cached = self._cache.get(key)
+        if cached is not None:
+            return cached
+        total, wins = self._columns()
+        if np is None:
+            prior = self.prior()
+            scores = [score_of(sort_by, w, t, lowest, prior, self.prior_weight) for t, w in zip(total, wins)]
+        else:
+            n = np.maximum(total, 1).astype(np.float64)
+            p = wins / n
+            if sort_by == "wilson":
+                z2 = WILSON_Z * WILSON_Z
+                margin = WILSON_Z * np.sqrt(p * (1 - p) / n + z2 / (4 * n * n))
+                scores = (p + z2 / (2 * n) + (margin if lowest else -margin)) / (1 + z2 / n)
+                scores = np.where(wins == total, 1.0, scores) if lowest else np.where(wins == 0, 0.0, scores)
+            elif sort_by == "bayes":
+                scores = (wins + self.prior_weight * self.prior()) / (total + self.prior_weight)
+            else:
+                scores = p
+            scores = np.where(total > 0, scores, 0.0)
+        self._cache[key] = scores
+        return scores
+
+    def _eligible(self, min_games: int):
+        total, _ = self._columns()
+        threshold = max(min_games, 1)
+        if np is None:
+            return [i for i, t in enumerate(total) if t >= threshold]
+        return np.flatnonzero(total >= threshold)
+
+    def top(self, limit: int, sort_by: str = "rate", lowest: bool = False, min_games: int = 0) -> List[Tuple[str, int, int]]:
+        """
+        按分数取排行，分数相同时局数多者在前、再按 user_id 从大到小（散财榜整体相反，见文件开头的并列规则）
+        只对可能进入前 limit 名的用户（含与第 limit 名同分者）做 Python 层排序
+        :return: [(user_id, 局数, 胜场), ...]
+        """
+        eligible = self._eligible(min_games)
+        if limit <= 0 or not len(eligible):
+            return []
+        scores = self.scores(sort_by, lowest)
+        total, wins = self._columns()
+        sign = 1 if lowest else -1
+        if np is None:
+            candidates = eligible
+        else:
+            keys = sign * scores[eligible]
+            k = min(limit, len(eligible)) - 1
+            threshold = np.partition(keys, k)[k]
+            candidates = eligible[keys <= threshold].tolist()
+        candidates.sort(key=lambda i: (scores[i], total[i], self._ids[i]), reverse=not lowest)
+        return [(self._ids[i], int(total[i]), int(wins[i])) for i in candidates[:limit]]
+
+    def percentile(self, user_id: str, sort_by: str = "rate", min_games: int = 0) -> Optional[float]:
+        """
+        单个用户的百分位：分数严格低于该用户的达标用户占比（0~1）
+        :return: 未上榜（局数不足或没有记录）时为 None
+        """
+        index = self._pos.get(user_id)
+        total, _ = self._columns()
+        threshold = max(min_games, 1)
+        if index is None or total[index] < threshold:
+            return None
+        scores = self.scores(sort_by)
+        score = scores[index]
+        if np is None:
+            eligible = [i for i, t in enumerate(total) if t >= threshold]
+            below = sum(1 for i in eligible if scores[i] < score)
+            return below / len(eligible)
+        eligible = total >= threshold
+        return int(np.count_nonzero(eligible & (scores < score))) / int(np.count_nonzero(eligible))
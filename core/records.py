@@ -0,0 +1,101 @@
+from typing import Dict, Optional, Tuple
+
+
+USER_FIELDS = ("total", "wins", "losses", "win_streak", "max_win_streak", "current_streak")
+
+
+class UserRecord:
+    """
+    单个用户的战绩计数
+    使用 __slots__ 存放 6 个计数，比六个键的 dict 小得多；对外仍通过 to_dict() 给出原来的字典格式。
+    """
+
+    __slots__ = USER_FIELDS
+
+    def __init__(self, total: int = 0, wins: int = 0, losses: int = 0, win_streak: int = 0, max_win_streak: int = 0, current_streak: int = 0):
+        self.total = total
+        self.wins = wins
+        self.losses = losses
+        self.win_streak = win_streak
+        self.max_win_streak = max_win_streak
+        self.current_streak = current_streak
+
+    @classmethod
+    def from_dict(cls, stats: Dict) -> "UserRecord":
+        return cls(*(stats.get(k, 0) for k in USER_FIELDS))
+
+    def astuple(self) -> Tuple[int, ...]:
+        return (self.total, self.wins, self.losses, self.win_streak, self.max_win_streak, self.current_streak)
+
+    def copy(self) -> "UserRecord":
+        return UserRecord(*self.astuple())
+
+    def to_dict(self) -> Dict:
+        return dict(zip(USER_FIELDS, self.astuple()))
+
+    @property
+    def win_rate(self) -> float:
+        return self.wins / self.total if self.total > 0 else 0
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, UserRecord) and self.astuple() == other.astuple()
+
+    def __repr__(self) -> str:
+        return f"UserRecord{self.astuple()}"
+
+
+def user_values(stats) -> Tuple[int, ...]:
+    """取出 UserRecord 或旧版字典中的 6 个计数"""
+    if isinstance(stats, UserRecord):
+        return stats.astuple()
+    return tuple(stats.get(k, 0) for k in USER_FIELDS)
+
+
+class PairRecord:
+    """
+    两名玩家之间的对战计数
+    以 (user1_id, user2_id)（user1_id < user2_id）为键保存，取代旧版 f"{user1_id}_{user2_id}" 字符串键
+    和 f"{uid}_wins" 动态字段的字典格式。
+    """
+
+    __slots__ = ("total", "user1_wins", "user2_wins")
+
+    def __init__(self, total: int = 0, user1_wins: int = 0, user2_wins: int = 0):
+        self.total = total
+        self.user1_wins = user1_wins
+        self.user2_wins = user2_wins
+
+    def astuple(self) -> Tuple[int, int, int]:
+        return (self.total, self.user1_wins, self.user2_wins)
+
+    def copy(self) -> "PairRecord":
+        return PairRecord(*self.astuple())
+
+    def wins_of(self, key: Tuple[str, str], user_id: str) -> int:
+        """键为 key 的对战中 user_id 的胜场"""
+        return self.user1_wins if user_id == key[0] else self.user2_wins
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, PairRecord) and self.astuple() == other.astuple()
+
+    def __repr__(self) -> str:
+        return f"PairRecord{self.astuple()}"
+
+
+def pair_key(user1_id: str, user2_id: str) -> Tuple[str, str]:
+    """对战记录的键：两个ID按字符串排序"""
+    return (user1_id, user2_id) if user1_id < user2_id else (user2_id, user1_id)
+
+
+def pair_values(key, stats) -> Optional[Tuple[str, str, int, int, int]]:
+    """
+    取出对战记录的 (user1_id, user2_id, total, user1_wins, user2_wins)
+    兼容旧版 f"{user1_id}_{user2_id}" -> {total, f"{uid}_wins"} 格式
+    """
+    if isinstance(stats, PairRecord):
+        return (*key, *stats.astuple())
+    ids = sorted(k[:-len("_wins")] for k in stats if k.endswith("_wins"))
+    if len(ids) != 2:
+        return None
+    user1_id, user2_id = ids
+    return user1_id, user2_id, stats.get("total", 0), stats.get(f"{user1_id}_wins", 0), stats.get(f"{user2_id}_wins", 0)
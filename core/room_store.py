@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+from typing import Dict, List, Optional
+
+from .writer import BackgroundWriter
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class RoomStore:
+    """
+    进行中房间的持久化
+    rooms.journal 为追加日志，每行一次房间状态变化：{"id", "g", "room"} 写入最新状态，{"id", "del": 1} 表示房间结束。
+    put()/delete() 只登记到内存（同一房间只保留最新一条），由后台线程合并追加；
+    日志行数超过存活房间数的若干倍时整体重写为只含存活房间的版本，
+    因此启动恢复的耗时只与进行中的房间数有关，与战绩规模无关。
+    """
+
+    def __init__(self, data_dir: str, flush_interval: Optional[float] = 2.0, flush_batch: int = 100):
+        self.path = os.path.join(data_dir, "rooms.journal")
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._pending: Dict[int, Optional[str]] = {}  # room_id -> 待追加的行，None 表示房间结束
+        self._live: Dict[int, str] = {}     # room_id -> 存活房间的最新一行，用于重写日志
+        self._lines = 0                     # 日志文件当前行数
+        self._stale = False                 # 文件中有 load() 之后不再对应存活房间的旧记录，下次写入时整体重写
+        self._file = None
+        self._writer = None
+        if flush_interval is not None:
+            self._writer = BackgroundWriter(
+                self.flush, interval=flush_interval, max_pending=flush_batch, name="roulette-rooms"
+            )
+
+    def load(self) -> List[Dict]:
+        """
+        读取上次保存的存活房间
+        :return: [{"g": 群号, "room": Room.to_state()}, ...]
+        """
+        states: Dict[int, Dict] = {}
+        if not os.path.exists(self.path):
+            return []
+        # 恢复后的房间会以新的 room_id 重新登记，旧文件在下次写入时整体替换
+        self._stale = True
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中途崩溃留下的残缺行
+                        continue
+                    if entry.get("del"):
+                        states.pop(entry["id"], None)
+                    else:
+                        states[entry["id"]] = {"g": entry["g"], "room": entry["room"]}
+        except OSError as e:
+            print(f"[Roulette] 读取房间存档失败: {e}")
+        return list(states.values())
+
+    def put(self, group_id: str, state: Dict):
+        """登记房间的最新状态"""
+        line = _dumps({"id": state["room_id"], "g": group_id, "room": state})
+        with self._lock:
+            self._pending[state["room_id"]] = line
+        self._mark_dirty()
+
+    def delete(self, room_id: int):
+        """登记房间已结束"""
+        with self._lock:
+            self._pending[room_id] = None
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        if self._writer:
+            self._writer.mark_dirty()
+        else:
+            self.flush()
+
+    def flush(self):
+        """追加登记的变化，日志过长时重写"""
+        with self._io_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return
+            lines = []
+            for room_id, line in pending.items():
+                if line is None:
+                    # 从未写入过的房间结束时无需记录
+                    if self._live.pop(room_id, None) is not None:
+                        lines.append(_dumps({"id": room_id, "del": 1}))
+                else:
+                    self._live[room_id] = line
+                    lines.append(line)
+            try:
+                if self._stale or self._lines + len(lines) > 4 * len(self._live) + 64:
+                    self._rewrite()
+                elif lines:
+                    if self._file is None:
+                        self._file = open(self.path, 'a', encoding='utf-8')
+                    self._file.write("".join(line + "\n" for line in lines))
+                    self._file.flush()
+                    self._lines += len(lines)
+            except Exception as e:
+                print(f"[Roulette] 写入房间存档失败: {e}")
+
+    def _rewrite(self):
+        """调用方持有 _io_lock"""
+        if self._file:
+            self._file.close()
+            self._file = None
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write("".join(line + "\n" for line in self._live.values()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.path)
+        self._lines = len(self._live)
+        self._stale = False
+
+    def close(self):
+        """停止后台写入线程并写完剩余变化"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        self.flush()
+        with self._io_lock:
+            if self._file:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,257 @@
+import os
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote, unquote
+
+from .snapshot import RecordMap, Snapshot, encode_snapshot, write_snapshot
+
+
+# 分片标签：(日志代数, 日志内位置)，表示分片已包含该位置及之前的全部日志记录
+Label = Tuple[int, int]
+
+
+def new_group() -> Dict:
+    return {"users": RecordMap(), "pvp": RecordMap(kind="pvp")}
+
+
+class GroupShards:
+    """
+    按群分片的战绩
+    每个群一个快照文件 groups/<群号>.<代>.<位置>.bin，首次访问时才打开；
+    已加载的群按最近使用顺序排列，常驻内存的记录数（已解码或有改动的记录，见 RecordMap.resident）
+    超过 memory_budget 时淘汰最久未用且已落盘的群。各群的记录数在取得、重新绑定和淘汰时更新，维护为累计值。
+    启动时日志中属于未加载群的记录暂存为积压，加载该群时再补上。
+    """
+
+    def __init__(self, shard_dir: str, apply: Callable[[str, Dict, Dict], None], memory_budget: int = 200000):
+        """
+        :param shard_dir: 分片目录
+        :param apply: 把一条日志记录应用到群数据的函数 apply(group_id, group, entry)
+        :param memory_budget: 已加载群常驻内存的记录总数上限
+        """
+        self.shard_dir = shard_dir
+        os.makedirs(shard_dir, exist_ok=True)
+        self.memory_budget = memory_budget
+        self._apply = apply
+        self._files: Dict[str, Tuple[Label, str]] = {}  # group_id -> (标签, 路径)
+        self._loaded: OrderedDict[str, Dict] = OrderedDict()
+        self._snapshots: Dict[str, Snapshot] = {}
+        self._backlog: Dict[str, List[Dict]] = {}
+        self._dirty: Dict[str, int] = {}  # group_id -> 改动计数
+        self._costs: Dict[str, int] = {}  # group_id -> 上次更新时常驻内存的记录数
+        self._resident = 0  # _costs 之和
+        self.on_evict: Optional[Callable[[str], None]] = None
+        self._scan()
+
+    def _scan(self):
+        """扫描分片目录，只保留每个群最新的分片文件"""
+        stale = []
+        for name in os.listdir(self.shard_dir):
+            parts = name.rsplit(".", 3)
+            if len(parts) != 4 or parts[3] != "bin" or not (parts[1].isdigit() and parts[2].isdigit()):
+                continue
+            group_id = unquote(parts[0])
+            label = (int(parts[1]), int(parts[2]))
+            path = os.path.join(self.shard_dir, name)
+            current = self._files.get(group_id)
+            if current is None or current[0] < label:
+                if current:
+                    stale.append(current[1])
+                self._files[group_id] = (label, path)
+            else:
+                stale.append(path)
+        for path in stale:
+            self._remove(path)
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"[Roulette] 删除旧分片 {path} 失败: {e}")
+
+    def _path(self, group_id: str, label: Label) -> str:
+        return os.path.join(self.shard_dir, f"{quote(group_id, safe='')}.{label[0]}.{label[1]}.bin")
+
+    def __contains__(self, group_id: str) -> bool:
+        return group_id in self._loaded or group_id in self._files or group_id in self._backlog
+
+    def ids(self) -> List[str]:
+        return list({*self._files, *self._loaded, *self._backlog})
+
+    def loaded(self) -> List[str]:
+        return list(self._loaded)
+
+    def path_of(self, group_id: str) -> Optional[str]:
+        current = self._files.get(group_id)
+        return current[1] if current else None
+
+    def label_of(self, group_id: str) -> Optional[Label]:
+        current = self._files.get(group_id)
+        return current[0] if current else None
+
+    def add_backlog(self, group_id: str, label: Label, entry: Dict):
+        """登记启动回放时属于该群、且分片中尚未包含的日志记录"""
+        current = self.label_of(group_id)
+        if current is None or label > current:
+            self._backlog.setdefault(group_id, []).append(entry)
+
+    def get(self, group_id: str, create: bool = False) -> Optional[Dict]:
+        """取得群数据，必要时打开分片并补上积压记录"""
+        group = self._loaded.get(group_id)
+        if group is not None:
+            self._loaded.move_to_end(group_id)
+            # 上次取得之后的读写可能解码了更多记录
+            self._update_cost(group_id, group)
+            self._evict()
+            return group
+        if group_id not in self and not create:
+            return None
+
+        group = new_group()
+        current = self._files.get(group_id)
+        if current:
+            try:
+                snapshot = Snapshot(current[1])
+                group = {"users": snapshot.users(None), "pvp": snapshot.pvp(None)}
+                self._snapshots[group_id] = snapshot
+            except Exception as e:
+                print(f"[Roulette] 加载群 {group_id} 的战绩分片失败: {e}")
+        self._loaded[group_id] = group
+        self._costs[group_id] = 0
+
+        backlog = self._backlog.pop(group_id, None)
+        if backlog:
+            for entry in backlog:
+                self._apply(group_id, group, entry)
+            self.mark_dirty(group_id)
+        self._update_cost(group_id, group)
+        self._evict()
+        return group
+
+    def mark_dirty(self, group_id: str):
+        self._dirty[group_id] = self._dirty.get(group_id, 0) + 1
+
+    def dirty_count(self) -> int:
+        return len(self._dirty)
+
+    def _update_cost(self, group_id: str, group: Dict):
+        cost = group["users"].resident() + group["pvp"].resident()
+        self._resident += cost - self._costs.get(group_id, 0)
+        self._costs[group_id] = cost
+
+    def _evict(self):
+        """淘汰最久未用且没有未落盘改动的群，直到满足内存预算"""
+        if self._resident <= self.memory_budget:
+            return
+        for group_id in list(self._loaded)[:-1]:
+            if self._resident <= self.memory_budget:
+                break
+            if group_id in self._dirty:
+                continue
+            self._loaded.pop(group_id)
+            self._resident -= self._costs.pop(group_id, 0)
+            snapshot = self._snapshots.pop(group_id, None)
+            if snapshot:
+                snapshot.close()
+            if self.on_evict:
+                self.on_evict(group_id)
+
+    def freeze_dirty(self, load_backlog: bool = False) -> List[Tuple[str, Dict, int]]:
+        """
+        冻结有改动的群，留给 write() 在锁外序列化（调用方持有锁）
+        冻结的群在 rebind() 之前一直算作有改动，不会被淘汰
+        :param load_backlog: 是否先加载所有有积压记录的群（日志即将被截断时需要）
+        :return: [(group_id, {users, pvp} 只读视图, 改动计数), ...]
+        """
+        if load_backlog:
+            for group_id in list(self._backlog):
+                self.get(group_id)
+        frozen = []
+        for group_id, changes in self._dirty.items():
+            group = self._loaded[group_id]
+            view = {"users": group["users"].freeze(), "pvp": group["pvp"].freeze()}
+            frozen.append((group_id, view, changes))
+        return frozen
+
+    def write(self, label: Label, frozen: List[Tuple[str, Dict, int]]) -> List[Tuple[str, Snapshot, int]]:
+        """序列化并写入分片文件（不需要持有锁），返回新打开的快照"""
+        written = []
+        for group_id, view, changes in frozen:
+            path = self._path(group_id, label)
+            try:
+                write_snapshot(path, encode_snapshot([(None, view["users"].items(), view["pvp"].items())]))
+                written.append((group_id, Snapshot(path), changes))
+            except Exception as e:
+                print(f"[Roulette] 保存群 {group_id} 的战绩分片失败: {e}")
+        return written
+
+    def rebind(self, label: Label, frozen: List[Tuple[str, Dict, int]],
+               written: List[Tuple[str, Snapshot, int]]) -> List[Snapshot]:
+        """
+        切换到新写入的分片，写入失败的群解除冻结（调用方持有锁）
+        :return: 需要在锁外关闭的旧快照
+        """
+        stale = []
+        done = {group_id for group_id, _, _ in written}
+        for group_id, _, _ in frozen:
+            group = self._loaded.get(group_id)
+            if group_id not in done and group is not None:
+                group["users"].thaw()
+                group["pvp"].thaw()
+        for group_id, snapshot, changes in written:
+            old = self._files.get(group_id)
+            self._files[group_id] = (label, snapshot.path)
+            if old and old[1] != snapshot.path:
+                stale.append(old[1])
+
+            old_snapshot = self._snapshots.get(group_id)
+            group = self._loaded.get(group_id)
+            if group is None:
+                snapshot.close()
+                continue
+            # 序列化之后没有新改动时，新分片包含全部数据，可以释放已解码的记录
+            clean = self._dirty.get(group_id) == changes
+            users_off, users_count, pvp_off, pvp_count = snapshot.scopes.get(None, (0, 0, 0, 0))
+            group["users"].rebase(snapshot, users_off, users_count, keep_overlay=not clean)
+            group["pvp"].rebase(snapshot, pvp_off, pvp_count, keep_overlay=not clean)
+            self._snapshots[group_id] = snapshot
+            if old_snapshot:
+                stale.append(old_snapshot)
+            if clean:
+                self._dirty.pop(group_id, None)
+            self._update_cost(group_id, group)
+        self._evict()
+        return stale
+
+    @staticmethod
+    def release(stale: List):
+        """关闭旧快照并删除旧分片文件（不需要持有锁）"""
+        for item in stale:
+            if isinstance(item, Snapshot):
+                item.close()
+        for item in stale:
+            if isinstance(item, str):
+                GroupShards._remove(item)
+
+    def import_scopes(self, snapshot: Snapshot, label: Label):
+        """把旧版整体快照中的群数据拆分为分片（只处理还没有分片的群）"""
+        for name in snapshot.scopes:
+            if name is None or name in self._files:
+                continue
+            users, pvp = snapshot.users(name), snapshot.pvp(name)
+            data = encode_snapshot([(None, users.items(), pvp.items())])
+            path = self._path(name, label)
+            write_snapshot(path, data)
+            self._files[name] = (label, path)
+
+    def close(self):
+        for snapshot in self._snapshots.values():
+            snapshot.close()
+        self._snapshots.clear()
+        self._loaded.clear()
+        self._costs.clear()
+        self._resident = 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.ids())
@@ -0,0 +1,345 @@
+import glob
+import mmap
+import os
+import re
+import struct
+from collections.abc import MutableMapping
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .records import PairRecord, UserRecord, pair_values, user_values
+
+
+# 二进制战绩快照
+#
+# 文件布局（小端）：
+#   头部      magic, version, 作用域数, 作用域表偏移, 字符串表偏移
+#   记录区    每个作用域一段用户记录 + 一段对战记录，均为定长记录，按键排序
+#             （版本 1 的对战记录按 f"{user1_id}_{user2_id}" 排序，版本 2 按 (user1_id, user2_id) 排序）
+#   字符串表  数量, (数量+1) 个偏移, 拼接后的 UTF-8 字节
+#   作用域表  每项：名称字符串号（全局为 NO_NAME）, 用户区偏移/条数, 对战区偏移/条数
+#
+# 打开时只解析头部和作用域表，记录在首次访问时按二分查找解码。
+
+MAGIC = b"RLTS"
+VERSION = 2
+NO_NAME = 0xFFFFFFFF
+
+HEADER = struct.Struct("<4sIIQQ")
+SCOPE = struct.Struct("<IQIQI")
+USER = struct.Struct("<I6I")   # user_id 字符串号 + 6 个计数
+PVP = struct.Struct("<II3I")   # user1/user2 字符串号 + total, user1_wins, user2_wins
+U32 = struct.Struct("<I")
+
+SNAPSHOT_PATTERN = re.compile(r"roulette_stats\.(\d+)\.bin$")
+GENERATION_PATTERN = re.compile(r"roulette_stats\.(\d+)\.(?:bin|journal|windows|ratings)$")
+
+
+class Snapshot:
+    """只读、内存映射的快照文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # 空文件无法映射
+            self._file.close()
+            raise ValueError(f"快照文件为空: {path}")
+        magic, version, scope_count, scope_off, strtab_off = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or not 1 <= version <= VERSION:
+            self.close()
+            raise ValueError(f"无法识别的快照文件: {path}")
+        self.version = version
+
+        self._str_count = U32.unpack_from(self._mm, strtab_off)[0]
+        self._str_offsets = strtab_off + 4
+        self._str_data = self._str_offsets + (self._str_count + 1) * 4
+
+        # 作用域名 -> (用户区偏移, 条数, 对战区偏移, 条数)，全局作用域的名称为 None
+        self.scopes: Dict[Optional[str], Tuple[int, int, int, int]] = {}
+        for i in range(scope_count):
+            name_id, users_off, users_count, pvp_off, pvp_count = SCOPE.unpack_from(
+                self._mm, scope_off + i * SCOPE.size
+            )
+            name = None if name_id == NO_NAME else self.string(name_id)
+            self.scopes[name] = (users_off, users_count, pvp_off, pvp_count)
+
+    def string(self, index: int) -> str:
+        start, end = struct.unpack_from("<II", self._mm, self._str_offsets + index * 4)
+        return self._mm[self._str_data + start:self._str_data + end].decode("utf-8")
+
+    def users(self, scope: Optional[str]) -> "RecordMap":
+        users_off, users_count, _, _ = self.scopes.get(scope, (0, 0, 0, 0))
+        return RecordMap(self, users_off, users_count, "users")
+
+    def pvp(self, scope: Optional[str]) -> "RecordMap":
+        _, _, pvp_off, pvp_count = self.scopes.get(scope, (0, 0, 0, 0))
+        return RecordMap(self, pvp_off, pvp_count, "pvp")
+
+    def close(self):
+        try:
+            self._mm.close()
+        finally:
+            self._file.close()
+
+
+class RecordMap(MutableMapping):
+    """
+    以快照为底、内存字典为上层的记录表
+    用户表以 user_id 为键、值为 UserRecord；对战表以 (user1_id, user2_id) 为键、值为 PairRecord
+    读取时先查上层，未命中再在快照中二分查找并解码缓存；写入只落在上层。
+    合并快照时用 freeze() 把上层冻结为只读视图在锁外序列化，冻结期间读到冻结层的记录先复制到新上层再交给调用方。
+    """
+
+    def __init__(self, snapshot: Optional[Snapshot] = None, offset: int = 0, count: int = 0, kind: str = "users"):
+        self._snapshot = snapshot if count else None
+        self._offset = offset
+        self._count = count if snapshot else 0
+        self._kind = kind
+        self._record = USER if kind == "users" else PVP
+        self._overlay: Dict[str, Dict] = {}
+        self._frozen: Dict[str, Dict] = {}  # 正在锁外序列化的上层，不再修改
+        self._new_keys = 0  # 上层中快照里不存在的键数量
+
+    def _decode(self, index: int) -> Tuple[str, Dict]:
+        snapshot = self._snapshot
+        values = self._record.unpack_from(snapshot._mm, self._offset + index * self._record.size)
+        if self._kind == "users":
+            return snapshot.string(values[0]), UserRecord(*values[1:])
+        return (snapshot.string(values[0]), snapshot.string(values[1])), PairRecord(*values[2:])
+
+    def _key_at(self, index: int):
+        """快照中第 index 条记录的排序键"""
+        snapshot = self._snapshot
+        values = self._record.unpack_from(snapshot._mm, self._offset + index * self._record.size)
+        if self._kind == "users":
+            return snapshot.string(values[0])
+        if snapshot.version == 1:
+            return f"{snapshot.string(values[0])}_{snapshot.string(values[1])}"
+        return snapshot.string(values[0]), snapshot.string(values[1])
+
+    def _find(self, key) -> int:
+        """在快照中二分查找键，找不到返回 -1"""
+        if self._kind == "pvp" and self._snapshot.version == 1:
+            key = f"{key[0]}_{key[1]}"
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_key = self._key_at(mid)
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return mid
+        return -1
+
+    def __getitem__(self, key: str) -> Dict:
+        value = self._overlay.get(key)
+        if value is not None:
+            return value
+        value = self._frozen.get(key)
+        if value is not None:
+            # 调用方会原地修改记录，冻结层中的对象留给序列化
+            value = self._overlay[key] = value.copy()
+            return value
+        index = self._find(key) if self._snapshot else -1
+        if index < 0:
+            raise KeyError(key)
+        _, value = self._decode(index)
+        self._overlay[key] = value
+        return value
+
+    def __setitem__(self, key: str, value: Dict):
+        if key not in self._overlay and key not in self._frozen and (not self._snapshot or self._find(key) < 0):
+            self._new_keys += 1
+        self._overlay[key] = value
+
+    def __delitem__(self, key: str):
+        raise TypeError("战绩记录不支持删除")
+
+    def __contains__(self, key) -> bool:
+        if key in self._overlay or key in self._frozen:
+            return True
+        return bool(self._snapshot) and self._find(key) >= 0
+
+    def __len__(self) -> int:
+        return self._count + self._new_keys
+
+    def resident(self) -> int:
+        """已解码或写入、常驻内存的记录数；快照中未访问的记录只占文件映射，不计入"""
+        return len(self._overlay) + len(self._frozen)
+
+    def __iter__(self) -> Iterator[str]:
+        for key, _ in self.iter_items():
+            yield key
+
+    def iter_items(self) -> Iterator[Tuple[str, Dict]]:
+        """遍历全部记录，快照中未访问过的记录即时解码但不缓存"""
+        overlay = {**self._frozen, **self._overlay} if self._frozen else self._overlay
+        seen = set()
+        for index in range(self._count):
+            key, value = self._decode(index)
+            cached = overlay.get(key)
+            if cached is not None:
+                seen.add(key)
+                value = cached
+            yield key, value
+        if len(seen) != len(overlay):
+            for key, value in list(overlay.items()):
+                if key not in seen:
+                    yield key, value
+
+    def items(self):
+        return self.iter_items()
+
+    def values(self):
+        return (value for _, value in self.iter_items())
+
+    def freeze(self) -> "RecordMap":
+        """
+        冻结当前上层，返回与它共用快照的只读视图，可在锁外序列化（调用方持有锁）
+        之后的写入落在新的上层；由冻结视图写出的快照 rebase() 之后丢弃冻结层，写出失败时 thaw()
+        """
+        if self._frozen:
+            self.thaw()
+        self._frozen, self._overlay = self._overlay, {}
+        view = RecordMap(self._snapshot, self._offset, self._count, self._kind)
+        view._overlay = self._frozen
+        return view
+
+    def thaw(self):
+        """把冻结层并回上层（调用方持有锁）"""
+        frozen, self._frozen = self._frozen, {}
+        frozen.update(self._overlay)
+        self._overlay = frozen
+
+    def rebase(self, snapshot: Optional[Snapshot], offset: int, count: int, keep_overlay: bool):
+        """切换到新的快照文件；新快照已包含冻结层，上层数据也已包含时可一并丢弃"""
+        self._frozen = {}
+        self._snapshot = snapshot if count else None
+        self._offset = offset
+        self._count = count if snapshot else 0
+        if not keep_overlay:
+            self._overlay = {}
+            self._new_keys = 0
+        else:
+            self._new_keys = sum(1 for key in self._overlay if self._find(key) < 0) if self._snapshot else len(self._overlay)
+
+
+def encode_snapshot(scopes: Iterable[Tuple[Optional[str], Iterable[Tuple[str, Dict]], Iterable[Tuple[str, Dict]]]]) -> bytes:
+    """
+    把若干作用域编码为快照字节
+    :param scopes: [(作用域名或 None, 用户 (user_id, stats) 迭代器, 对战 (key, stats) 迭代器), ...]
+                   stats 可以是记录对象，也可以是旧版 JSON 中的字典
+    """
+    strings: Dict[str, int] = {}
+
+    def intern(text: str) -> int:
+        index = strings.get(text)
+        if index is None:
+            index = strings[text] = len(strings)
+        return index
+
+    body: List[bytes] = []
+    offset = HEADER.size
+    scope_entries = []
+    for name, users, pvp in scopes:
+        user_rows = sorted(users, key=lambda item: item[0])
+        users_off = offset
+        chunk = b"".join(
+            USER.pack(intern(user_id), *user_values(stats))
+            for user_id, stats in user_rows
+        )
+        body.append(chunk)
+        offset += len(chunk)
+
+        pvp_rows = [row for row in (pair_values(key, stats) for key, stats in pvp) if row]
+        pvp_rows.sort(key=lambda row: (row[0], row[1]))
+        pvp_off = offset
+        chunk = b"".join(
+            PVP.pack(intern(user1_id), intern(user2_id), *counts)
+            for user1_id, user2_id, *counts in pvp_rows
+        )
+        body.append(chunk)
+        offset += len(chunk)
+
+        name_id = NO_NAME if name is None else intern(name)
+        scope_entries.append((name_id, users_off, len(user_rows), pvp_off, len(pvp_rows)))
+
+    strtab_off = offset
+    encoded = [text.encode("utf-8") for text in strings]
+    positions = [0]
+    for data in encoded:
+        positions.append(positions[-1] + len(data))
+    strtab = U32.pack(len(encoded)) + struct.pack(f"<{len(positions)}I", *positions) + b"".join(encoded)
+    scope_off = strtab_off + len(strtab)
+    scope_table = b"".join(SCOPE.pack(*entry) for entry in scope_entries)
+
+    header = HEADER.pack(MAGIC, VERSION, len(scope_entries), scope_off, strtab_off)
+    return b"".join([header, *body, strtab, scope_table])
+
+
+def snapshot_path(data_dir: str, generation: int) -> str:
+    return os.path.join(data_dir, f"roulette_stats.{generation}.bin")
+
+
+def list_snapshots(data_dir: str) -> List[Tuple[int, str]]:
+    """按代数从新到旧列出快照文件"""
+    found = []
+    for path in glob.glob(os.path.join(data_dir, "roulette_stats.*.bin")):
+        match = SNAPSHOT_PATTERN.search(os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    found.sort(reverse=True)
+    return found
+
+
+def list_generation_files(data_dir: str) -> List[Tuple[int, str]]:
+    """列出各代的快照、日志、近期汇总和等级分文件（含没有快照的第 0 代日志）"""
+    found = []
+    for path in glob.glob(os.path.join(data_dir, "roulette_stats.*.*")):
+        match = GENERATION_PATTERN.search(os.path.basename(path))
+        if match:
+            found.append((int(match.group(1)), path))
+    return found
+
+
+def write_snapshot(path: str, data: bytes):
+    """写入快照文件（先写临时文件再改名）"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, path)
+
+
+def convert_json(data_dir: str) -> str:
+    """把 roulette_stats.json 转换为二进制快照，返回快照路径"""
+    import json
+
+    with open(os.path.join(data_dir, "roulette_stats.json"), "r", encoding="utf-8") as f:
+        stats = json.load(f)
+    scopes = [(None, stats.get("users", {}).items(), stats.get("pvp", {}).items())]
+    for group_id, group in stats.get("groups", {}).items():
+        scopes.append((group_id, group.get("users", {}).items(), group.get("pvp", {}).items()))
+
+    snapshots = list_snapshots(data_dir)
+    path = snapshot_path(data_dir, snapshots[0][0] + 1 if snapshots else 1)
+    write_snapshot(path, encode_snapshot(scopes))
+    return path
+
+
+if __name__ == "__main__":
+    # 转换工具：python -m core.snapshot <数据目录>
+    import sys
+
+    if len(sys.argv) != 2:
+        print("用法: python -m core.snapshot <包含 roulette_stats.json 的数据目录>")
+        sys.exit(1)
+    if list_snapshots(sys.argv[1]):
+        print("[Roulette] 目录中已有二进制快照，为避免覆盖新数据，跳过转换")
+        sys.exit(1)
+    print(f"[Roulette] 已生成快照: {convert_json(sys.argv[1])}")
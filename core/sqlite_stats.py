@@ -0,0 +1,745 @@
+import itertools
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .elo import DEFAULT_K, DEFAULT_RATING, RATED_MIN_GAMES, EloRatings, check_coverage, rating_delta
+from .metrics import metrics
+from .ranking import CounterTable
+from .records import PairRecord, UserRecord
+from .stats import StatsManager, has_saved_stats
+from .windows import RING_DAYS, today, window_days
+from .writer import BackgroundWriter
+
+
+# 全局战绩使用空字符串作为 group_id
+GLOBAL_SCOPE = ""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    group_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    losses INTEGER NOT NULL DEFAULT 0,
+    win_streak INTEGER NOT NULL DEFAULT 0,
+    max_win_streak INTEGER NOT NULL DEFAULT 0,
+    current_streak INTEGER NOT NULL DEFAULT 0,
+    win_rate REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, user_id)
+);
+-- 赌狗榜、胜率榜的完整排序键（含 user_id），按索引顺序读出前几名即可，无需排序
+DROP INDEX IF EXISTS idx_users_total;
+DROP INDEX IF EXISTS idx_users_win_rate;
+CREATE INDEX IF NOT EXISTS idx_users_active ON users (group_id, total, user_id);
+CREATE INDEX IF NOT EXISTS idx_users_rate ON users (group_id, win_rate, total, user_id);
+CREATE TABLE IF NOT EXISTS pvp (
+    group_id TEXT NOT NULL,
+    user1_id TEXT NOT NULL,
+    user2_id TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    user1_wins INTEGER NOT NULL DEFAULT 0,
+    user2_wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, user1_id, user2_id)
+);
+CREATE INDEX IF NOT EXISTS idx_pvp_user2 ON pvp (group_id, user2_id);
+CREATE TABLE IF NOT EXISTS daily (
+    group_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    user_id TEXT NOT NULL,
+    total INTEGER NOT NULL DEFAULT 0,
+    wins INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, day, user_id)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_user ON daily (group_id, user_id, day);
+CREATE TABLE IF NOT EXISTS ratings (
+    group_id TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    rating REAL NOT NULL,
+    games INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (group_id, user_id)
+);
+DROP INDEX IF EXISTS idx_ratings_rating;
+CREATE INDEX IF NOT EXISTS idx_ratings_board ON ratings (group_id, rating, games, user_id);
+"""
+
+USER_FIELDS = ("total", "wins", "losses", "win_streak", "max_win_streak", "current_streak")
+
+LOSER_UPSERT = """
+INSERT INTO users (group_id, user_id, total, losses, win_rate) VALUES (?, ?, 1, 1, 0)
+ON CONFLICT (group_id, user_id) DO UPDATE SET
+    total = total + 1,
+    losses = losses + 1,
+    current_streak = 0,
+    win_rate = CAST(wins AS REAL) / (total + 1)
+"""
+
+WINNER_UPSERT = """
+INSERT INTO users (group_id, user_id, total, wins, max_win_streak, current_streak, win_rate)
+VALUES (?, ?, 1, 1, 1, 1, 1)
+ON CONFLICT (group_id, user_id) DO UPDATE SET
+    total = total + 1,
+    wins = wins + 1,
+    current_streak = current_streak + 1,
+    max_win_streak = MAX(max_win_streak, current_streak + 1),
+    win_rate = CAST(wins + 1 AS REAL) / (total + 1)
+"""
+
+PVP_UPSERT = """
+INSERT INTO pvp (group_id, user1_id, user2_id, total, user1_wins, user2_wins) VALUES (?, ?, ?, 1, ?, ?)
+ON CONFLICT (group_id, user1_id, user2_id) DO UPDATE SET
+    total = total + 1,
+    user1_wins = user1_wins + excluded.user1_wins,
+    user2_wins = user2_wins + excluded.user2_wins
+"""
+
+DAILY_UPSERT = """
+INSERT INTO daily (group_id, day, user_id, total, wins) VALUES (?, ?, ?, 1, ?)
+ON CONFLICT (group_id, day, user_id) DO UPDATE SET
+    total = total + 1,
+    wins = wins + excluded.wins
+"""
+
+RATING_UPSERT = """
+INSERT INTO ratings (group_id, user_id, rating, games) VALUES (?, ?, ?, 1)
+ON CONFLICT (group_id, user_id) DO UPDATE SET
+    rating = excluded.rating,
+    games = games + 1
+"""
+
+# 近期排行：合并窗口内的按天汇总
+WINDOW_BOARD = """
+SELECT user_id, SUM(total) AS total, SUM(wins) AS wins, CAST(SUM(wins) AS REAL) / SUM(total) AS win_rate
+FROM daily WHERE group_id = ? AND day > ?
+GROUP BY user_id HAVING SUM(total) >= ?
+ORDER BY {order} LIMIT ?
+"""
+
+
+def _copy_saved_stats(data_dir: str, dest: str):
+    """把数据目录中 StatsManager 的战绩文件（roulette_stats.* 与 groups/，不含数据库）复制到 dest"""
+    for name in os.listdir(data_dir):
+        path = os.path.join(data_dir, name)
+        if name.startswith("roulette_stats.") and not name.startswith("roulette_stats.db") and os.path.isfile(path):
+            shutil.copy2(path, dest)
+    groups = os.path.join(data_dir, "groups")
+    if os.path.isdir(groups):
+        shutil.copytree(groups, os.path.join(dest, "groups"))
+
+
+class SqliteStatsManager:
+    """
+    SQLite 战绩管理器
+    接口与 StatsManager 一致，数据保存在 roulette_stats.db：
+    每局结果是若干单行 upsert，排行榜走 (group_id, win_rate, total, user_id) / (group_id, total, user_id) 索引扫描。
+    upsert 先留在当前事务中，由后台线程按 flush_interval 秒或 flush_batch 局合并提交。
+    日/周/月排行使用 daily 表的按天汇总，超过 30 天的行在提交时按天清理。
+    按置信分数排行与百分位使用各范围的数组化计数（CounterTable），首次查询时从 users 表装载，之后随每局结果更新。
+    对决的等级分保存在 ratings 表，与战绩在同一事务中更新。
+
+    shared=True 为多进程共享模式（多个 AstrBot 进程使用同一数据目录）：
+    数据库切换为 WAL，每局结果在一个 BEGIN IMMEDIATE 短事务中立即提交，
+    写锁只在这几条 upsert 期间持有，其他进程的写入最多等待 busy_timeout 秒。
+    upsert 都是在库中现有值上累加，各进程的结果自然合并，不会互相覆盖。
+    """
+
+    def __init__(self, data_dir: str, flush_interval: Optional[float] = 2.0, flush_batch: int = 100,
+                 shared: bool = False, busy_timeout: float = 5.0, rating_k: float = DEFAULT_K,
+                 auto_import: bool = True):
+        """
+        :param shared: 多进程共享模式
+        :param busy_timeout: 等待其他连接释放写锁的最长秒数
+        :param rating_k: 等级分的 K 值，更改后需调用 rebuild_ratings() 重算
+        :param auto_import: 数据库为空时自动导入数据目录中已有的战绩文件
+        """
+        self.data_dir = data_dir
+        self.shared = shared
+        self.rating_k = rating_k
+        os.makedirs(data_dir, exist_ok=True)
+        self.db_file = os.path.join(data_dir, "roulette_stats.db")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.db_file, timeout=busy_timeout, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        if shared:
+            # WAL 下读者与写者互不阻塞；synchronous=NORMAL 时提交不做 fsync，只在检查点落盘
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._pruned_day = 0  # 最近一次清理过期汇总的日期
+        # 数组化计数：范围 -> CounterTable；共享模式下其他进程提交过写入（data_version 变化）时整体作废
+        self._tables: Dict[str, CounterTable] = {}
+        self._tables_version = None
+
+        # 首次启用时自动导入已有的战绩文件
+        if auto_import and self._is_empty() and has_saved_stats(data_dir):
+            self.import_json(data_dir, only_if_empty=True)
+
+        self._writer = None
+        if flush_interval is not None and not shared:
+            self._writer = BackgroundWriter(self.flush, interval=flush_interval, max_pending=flush_batch)
+
+    def _is_empty(self) -> bool:
+        row = self._conn.execute("SELECT 1 FROM users LIMIT 1").fetchone()
+        return row is None
+
+    def _has_group(self, group_id: str) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM users WHERE group_id = ? LIMIT 1", (group_id,)
+        ).fetchone()
+        return row is not None
+
+    def _scope(self, group_id: Optional[str]) -> str:
+        """与 StatsManager 一致：群内没有数据时退回全局数据（调用方持有锁）"""
+        if group_id and self._has_group(group_id):
+            return group_id
+        return GLOBAL_SCOPE
+
+    def _get_table(self, scope: str) -> CounterTable:
+        """获取数组化计数，不存在时从 users 表装载一次（调用方持有锁）"""
+        if self.shared:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            if version != self._tables_version:
+                self._tables.clear()
+                self._tables_version = version
+        table = self._tables.get(scope)
+        if table is None:
+            table = self._tables[scope] = CounterTable.from_counts(self._conn.execute(
+                "SELECT user_id, total, wins FROM users WHERE group_id = ?", (scope,)
+            ))
+        return table
+
+    def _score_board(self, group_id: Optional[str], window: Optional[str], min_games: int, limit: int,
+                     sort_by: str, lowest: bool) -> List[Tuple[str, float, Dict]]:
+        """按置信分数取排行，与 StatsManager 一样在数组化计数上打分，分数相同时按局数、user_id 排"""
+        with self._lock:
+            scope = self._scope(group_id)
+            if window:
+                since = today() - window_days(window)
+                counts = self._conn.execute(
+                    "SELECT user_id, SUM(total), SUM(wins) FROM daily WHERE group_id = ? AND day > ? GROUP BY user_id",
+                    (scope, since),
+                ).fetchall()
+            else:
+                board = self._get_table(scope).top(limit, sort_by, lowest=lowest, min_games=min_games)
+                rows = self._conn.execute(
+                    f"SELECT * FROM users WHERE group_id = ? AND user_id IN ({', '.join('?' * len(board))})",
+                    (scope, *(user_id for user_id, _, _ in board)),
+                ).fetchall() if board else []
+        if not window:
+            stats = {row["user_id"]: self._row_to_stats(row) for row in rows}
+            return [(user_id, wins / total, stats[user_id]) for user_id, total, wins in board]
+        # 窗口内的汇总临时建成数组化计数，在锁外打分
+        board = CounterTable.from_counts(counts).top(limit, sort_by, lowest=lowest, min_games=min_games)
+        return [
+            (user_id, wins / total, {"total": total, "wins": wins, "losses": total - wins})
+            for user_id, total, wins in board
+        ]
+
+    def data_version(self) -> int:
+        """
+        其他连接（包括其他进程）每提交一次就会变化的版本号（PRAGMA data_version）
+        本进程自己的写入不改变它，可据此判断缓存的查询结果是否已被其他实例的写入作废
+        """
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _prune_daily(self):
+        """每天清理一次滚出窗口的按天汇总（调用方持有锁并处于写事务中）"""
+        day = today()
+        if day != self._pruned_day:
+            self._conn.execute("DELETE FROM daily WHERE day <= ?", (day - RING_DAYS,))
+            self._pruned_day = day
+
+    def flush(self):
+        """提交尚未提交的战绩写入，每天顺带清理一次滚出窗口的按天汇总"""
+        with self._lock, metrics.timer("roulette_stats_seconds", op="flush"):
+            if self._conn and self._conn.in_transaction:
+                try:
+                    self._prune_daily()
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    print(f"[Roulette] 保存战绩数据失败: {e}")
+
+    def close(self):
+        """停止后台写入线程并关闭数据库连接"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        with self._lock:
+            if self._conn:
+                self._conn.commit()
+                self._conn.close()
+                self._conn = None
+
+    def import_json(self, data_dir: str, only_if_empty: bool = False, keep_source: bool = False) -> Optional[int]:
+        """
+        从 StatsManager 的战绩文件（快照、日志或旧版 roulette_stats.json）导入数据
+        :param data_dir: 战绩所在目录
+        :param only_if_empty: 只在数据库仍为空时导入（多个进程同时首次启动时只有一个导入）
+        :param keep_source: 不改动战绩所在目录：复制到临时目录后再读取
+            （StatsManager 打开时会把 JSON 转换为快照、拆分群分片、追加日志）
+        :return: 导入的记录数（用户与对战记录），因数据库已有数据而跳过时为 None
+        """
+        if not keep_source:
+            return self._import_dir(data_dir, only_if_empty)
+        with tempfile.TemporaryDirectory(prefix="roulette-import-") as tmp_dir:
+            _copy_saved_stats(data_dir, tmp_dir)
+            return self._import_dir(tmp_dir, only_if_empty)
+
+    def _import_dir(self, data_dir: str, only_if_empty: bool) -> Optional[int]:
+        source = StatsManager(data_dir, flush_interval=None)
+        try:
+            return self._import_from(source, only_if_empty)
+        finally:
+            source.close()
+
+    def _import_from(self, source: StatsManager, only_if_empty: bool = False) -> Optional[int]:
+        # 群战绩按需加载，逐个群导入
+        scopes = itertools.chain([(GLOBAL_SCOPE, source.stats)], source.iter_groups())
+        count = 0
+
+        with self._lock:
+            self._conn.commit()
+            with self._conn:
+                # 先拿到写锁再检查，其他进程的导入或写入要么已完成、要么等这次导入结束
+                self._conn.execute("BEGIN IMMEDIATE")
+                if only_if_empty and not self._is_empty():
+                    return None
+                self._tables.clear()
+                for scope, data in scopes:
+                    count += len(data["users"]) + len(data["pvp"])
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO users (group_id, user_id, total, wins, losses, "
+                        "win_streak, max_win_streak, current_streak, win_rate) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (
+                            (scope, user_id, *stats.astuple(), stats.win_rate)
+                            for user_id, stats in data["users"].items()
+                        ),
+                    )
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO pvp (group_id, user1_id, user2_id, total, "
+                        "user1_wins, user2_wins) VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            (scope, user1_id, user2_id, *pvp_stats.astuple())
+                            for (user1_id, user2_id), pvp_stats in data["pvp"].items()
+                        ),
+                    )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO daily (group_id, day, user_id, total, wins) VALUES (?, ?, ?, ?, ?)",
+                    (
+                        (scope or GLOBAL_SCOPE, day, user_id, total, wins)
+                        for day, scope, user_id, total, wins in source.windows
+                    ),
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO ratings (group_id, user_id, rating, games) VALUES (?, ?, ?, ?)",
+                    (
+                        (scope or GLOBAL_SCOPE, user_id, rating, games)
+                        for scope, user_id, rating, games in source.ratings.items()
+                    ),
+                )
+        print(f"[Roulette] 已导入战绩：{len(source.stats['users'])} 名用户")
+        return count
+
+    def iter_records(self, group_id: Optional[str] = None, page_size: int = 5000) -> Iterator[Tuple]:
+        """
+        流式导出战绩记录，按主键分页查询，每页只短暂持有锁
+        :param group_id: 只导出该群，None 表示全局与全部群
+        :return: 与 StatsManager.iter_records() 相同
+        """
+        for kind, table, keys in (
+            ("user", "users", ("group_id", "user_id")),
+            ("pvp", "pvp", ("group_id", "user1_id", "user2_id")),
+        ):
+            columns = ", ".join(keys)
+            after = None  # 上一页最后一行的主键
+            while True:
+                conditions, params = [], []
+                if group_id is not None:
+                    conditions.append("group_id = ?")
+                    params.append(group_id)
+                if after is not None:
+                    conditions.append(f"({columns}) > ({', '.join('?' * len(keys))})")
+                    params.extend(after)
+                where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+                with self._lock:
+                    rows = self._conn.execute(
+                        f"SELECT * FROM {table} {where}ORDER BY {columns} LIMIT ?", (*params, page_size)
+                    ).fetchall()
+                for row in rows:
+                    scope = row["group_id"] or None
+                    if kind == "user":
+                        yield kind, scope, row["user_id"], UserRecord(*(row[k] for k in USER_FIELDS))
+                    else:
+                        yield kind, scope, (row["user1_id"], row["user2_id"]), PairRecord(
+                            row["total"], row["user1_wins"], row["user2_wins"]
+                        )
+                if len(rows) < page_size:
+                    break
+                after = tuple(rows[-1][k] for k in keys)
+
+    def import_records(self, records: Iterable[Tuple], batch_size: int = 10000) -> int:
+        """
+        批量导入战绩记录（覆盖同一范围内同一用户 / 同一对玩家的原有记录）
+        每批一次 executemany，全部导入后只提交一次；共享模式下每批单独提交，不长时间占用写锁。
+        中途出错时已导入的批次保留。不计入日/周/月排行
+        :param records: 与 iter_records() 相同格式的记录
+        :return: 导入的记录数
+        """
+        count = 0
+        users, pvp = [], []
+
+        def apply():
+            with self._lock:
+                self._tables.clear()
+                if self.shared:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO users (group_id, user_id, total, wins, losses, "
+                        "win_streak, max_win_streak, current_streak, win_rate) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        users,
+                    )
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO pvp (group_id, user1_id, user2_id, total, "
+                        "user1_wins, user2_wins) VALUES (?, ?, ?, ?, ?, ?)",
+                        pvp,
+                    )
+                except sqlite3.Error:
+                    if self.shared:
+                        self._conn.rollback()
+                    raise
+                if self.shared:
+                    self._conn.commit()
+            users.clear()
+            pvp.clear()
+
+        try:
+            for kind, scope, key, value in records:
+                scope = scope or GLOBAL_SCOPE
+                if kind == "user":
+                    users.append((scope, key, *value.astuple(), value.win_rate))
+                else:
+                    pvp.append((scope, *key, *value.astuple()))
+                count += 1
+                if len(users) + len(pvp) >= batch_size:
+                    apply()
+            apply()
+        finally:
+            self.flush()
+        return count
+
+    def record_game_result(self, loser_id: str, winner_ids: List[str], is_pvp: bool = False, group_id: str = None):
+        """
+        记录游戏结果；共享模式下在本次调用中提交，可能等待其他进程的写锁，事件循环中应放到线程里调用
+        提交成功后才更新数组化计数
+        :param loser_id: 失败者ID
+        :param winner_ids: 胜利者ID列表
+        :param is_pvp: 是否为双人对战
+        :param group_id: 群组ID
+        """
+        scopes = [GLOBAL_SCOPE]
+        if group_id:
+            scopes.append(group_id)
+        day = today()
+
+        with self._lock, metrics.timer("roulette_stats_seconds", op="record"):
+            try:
+                if self.shared:
+                    self._conn.execute("BEGIN IMMEDIATE")
+                for scope in scopes:
+                    self._conn.execute(LOSER_UPSERT, (scope, loser_id))
+                    self._conn.executemany(
+                        WINNER_UPSERT, ((scope, winner_id) for winner_id in winner_ids)
+                    )
+                    self._conn.execute(DAILY_UPSERT, (scope, day, loser_id, 0))
+                    self._conn.executemany(
+                        DAILY_UPSERT, ((scope, day, winner_id, 1) for winner_id in winner_ids)
+                    )
+                    if is_pvp and len(winner_ids) == 1:
+                        winner_id = winner_ids[0]
+                        user1_id, user2_id = sorted([loser_id, winner_id])
+                        self._conn.execute(PVP_UPSERT, (
+                            scope, user1_id, user2_id,
+                            int(winner_id == user1_id), int(winner_id == user2_id),
+                        ))
+                        self._rate_duel(scope, winner_id, loser_id)
+                if self.shared:
+                    self._prune_daily()
+                    self._conn.commit()
+            except sqlite3.Error as e:
+                if self.shared and self._conn.in_transaction:
+                    self._conn.rollback()
+                self._tables.clear()
+                print(f"[Roulette] 保存战绩数据失败: {e}")
+                return
+            for scope in scopes:
+                table = self._tables.get(scope)
+                if table is not None:
+                    table.add(loser_id, 1, 0)
+                    for winner_id in winner_ids:
+                        table.add(winner_id, 1, 1)
+        if self._writer:
+            self._writer.mark_dirty()
+        elif not self.shared:
+            self.flush()
+
+    def _rate_duel(self, scope: str, winner_id: str, loser_id: str):
+        """一场对决计入该范围的等级分（调用方持有锁，处于记录本局的事务中）"""
+        ratings = dict(self._conn.execute(
+            "SELECT user_id, rating FROM ratings WHERE group_id = ? AND user_id IN (?, ?)",
+            (scope, winner_id, loser_id),
+        ).fetchall())
+        winner_rating = ratings.get(winner_id, DEFAULT_RATING)
+        loser_rating = ratings.get(loser_id, DEFAULT_RATING)
+        delta = rating_delta(winner_rating, loser_rating, self.rating_k)
+        self._conn.executemany(RATING_UPSERT, (
+            (scope, winner_id, winner_rating + delta),
+            (scope, loser_id, loser_rating - delta),
+        ))
+
+    def count_duels(self) -> int:
+        """战绩中记录的对决总场数（全局对战记录之和）"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(total), 0) FROM pvp WHERE group_id = ?", (GLOBAL_SCOPE,)
+            ).fetchone()[0]
+
+    def rebuild_ratings(self, duels: Iterable[Tuple[Optional[str], str, str]], force: bool = False) -> int:
+        """
+        按顺序重放对决，整体替换 ratings 表
+        重放在内存中进行，只在最后替换时持有锁；共享模式下替换在一个事务中完成
+        :param duels: (群号或 None, 胜者, 败者)，见 core.elo.iter_duels()
+        :param force: 对局历史没有覆盖全部对决时仍然替换
+        :return: 重放的对决场数
+        :raises ValueError: 与 StatsManager.rebuild_ratings() 相同
+        """
+        recorded = self.count_duels()
+        ratings = EloRatings(k=self.rating_k)
+        count = ratings.rebuild(duels)
+        check_coverage(count, recorded, force)
+        with self._lock:
+            if self.shared:
+                self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM ratings")
+                self._conn.executemany(
+                    "INSERT INTO ratings (group_id, user_id, rating, games) VALUES (?, ?, ?, ?)",
+                    (
+                        (scope or GLOBAL_SCOPE, user_id, rating, games)
+                        for scope, user_id, rating, games in ratings.items()
+                    ),
+                )
+            except sqlite3.Error:
+                if self.shared:
+                    self._conn.rollback()
+                raise
+            if self.shared:
+                self._conn.commit()
+        self.flush()
+        return count
+
+    @staticmethod
+    def _row_to_stats(row: sqlite3.Row) -> Dict:
+        stats = {k: row[k] for k in USER_FIELDS}
+        if "rating" in row.keys() and row["rating"] is not None:
+            stats["rating"], stats["rated_games"] = row["rating"], row["rated_games"]
+        return stats
+
+    def board_scope(self, group_id: Optional[str]) -> Optional[str]:
+        """排行榜实际使用的数据范围：群号，群内没有数据时为 None（全局）"""
+        with self._lock:
+            return self._scope(group_id) or None
+
+    def get_user_stats(self, user_id: str, group_id: str = None, window: str = None) -> Optional[Dict]:
+        """
+        获取用户战绩
+        :param window: 时间窗口 day/week/month，给出时按排行榜的范围统计，只有 total/wins/losses
+        """
+        if window:
+            since = today() - window_days(window)
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT SUM(total) AS total, SUM(wins) AS wins FROM daily "
+                    "WHERE group_id = ? AND user_id = ? AND day > ?",
+                    (self._scope(group_id), user_id, since),
+                ).fetchone()
+            return self._window_stats(row) if row["total"] else None
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT u.*, r.rating, r.games AS rated_games FROM users u "
+                "LEFT JOIN ratings r ON r.group_id = u.group_id AND r.user_id = u.user_id "
+                "WHERE u.group_id = ? AND u.user_id = ?",
+                (self._scope(group_id), user_id),
+            ).fetchone()
+            return self._row_to_stats(row) if row else None
+
+    def get_pvp_stats(self, user1_id: str, user2_id: str, group_id: str = None) -> Optional[Dict]:
+        """获取两个用户之间的对战记录"""
+        user1_id, user2_id = sorted([user1_id, user2_id])
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM pvp WHERE group_id = ? AND user1_id = ? AND user2_id = ?",
+                (group_id or GLOBAL_SCOPE, user1_id, user2_id),
+            ).fetchone()
+
+        if not row or not row["total"]:
+            return None
+
+        total = row["total"]
+        user1_wins = row["user1_wins"]
+        user2_wins = row["user2_wins"]
+        return {
+            "total": total,
+            f"{user1_id}_wins": user1_wins,
+            f"{user2_id}_wins": user2_wins,
+            f"{user1_id}_win_rate": user1_wins / total * 100,
+            f"{user2_id}_win_rate": user2_wins / total * 100,
+        }
+
+    def _window_board(self, group_id: Optional[str], window: str, min_games: int, limit: int, order: str) -> List[sqlite3.Row]:
+        """近期排行：按 (group_id, day) 主键前缀取出窗口内的行再聚合"""
+        since = today() - window_days(window)
+        with self._lock:
+            return self._conn.execute(
+                WINDOW_BOARD.format(order=order),
+                (self._scope(group_id), since, min_games, limit),
+            ).fetchall()
+
+    @staticmethod
+    def _window_stats(row: sqlite3.Row) -> Dict:
+        return {"total": row["total"], "wins": row["wins"], "losses": row["total"] - row["wins"]}
+
+    def get_top_players(self, group_id: str = None, min_games: int = 5, limit: int = 5, window: str = None,
+                        sort_by: str = "rate") -> List[Tuple[str, float, Dict]]:
+        """
+        获取胜率排行榜
+        :param group_id: 群组ID
+        :param min_games: 最少参与局数
+        :param limit: 返回前N名
+        :param window: 时间窗口 day/week/month，None 表示全部战绩
+        :param sort_by: 排序方式 rate/wilson/bayes，wilson/bayes 需对范围内全部用户打分
+        :return: [(user_id, win_rate, stats), ...]
+        """
+        if sort_by != "rate":
+            return self._score_board(group_id, window, min_games, limit, sort_by, lowest=False)
+        if window:
+            rows = self._window_board(group_id, window, min_games, limit, "win_rate DESC, total DESC, user_id DESC")
+            return [(row["user_id"], row["win_rate"], self._window_stats(row)) for row in rows]
+        with self._lock:
+            # +total：不让 total 条件改走 idx_users_active 后再整体排序
+            rows = self._conn.execute(
+                "SELECT * FROM users WHERE group_id = ? AND +total >= ? "
+                "ORDER BY win_rate DESC, total DESC, user_id DESC LIMIT ?",
+                (self._scope(group_id), min_games, limit),
+            ).fetchall()
+        return [(row["user_id"], row["win_rate"], self._row_to_stats(row)) for row in rows]
+
+    def get_unlucky_players(self, group_id: str = None, min_games: int = 5, limit: int = 5, window: str = None,
+                            sort_by: str = "rate") -> List[Tuple[str, float, Dict]]:
+        """
+        获取散财排行榜（胜率最低）
+        """
+        if sort_by != "rate":
+            return self._score_board(group_id, window, min_games, limit, sort_by, lowest=True)
+        if window:
+            rows = self._window_board(group_id, window, min_games, limit, "win_rate ASC, total ASC, user_id ASC")
+            return [(row["user_id"], row["win_rate"], self._window_stats(row)) for row in rows]
+        with self._lock:
+            # +total：不让 total 条件改走 idx_users_active 后再整体排序
+            rows = self._conn.execute(
+                "SELECT * FROM users WHERE group_id = ? AND +total >= ? "
+                "ORDER BY win_rate ASC, total ASC, user_id ASC LIMIT ?",
+                (self._scope(group_id), min_games, limit),
+            ).fetchall()
+        return [(row["user_id"], row["win_rate"], self._row_to_stats(row)) for row in rows]
+
+    def get_active_players(self, group_id: str = None, limit: int = 5, window: str = None) -> List[Tuple[str, int, Dict]]:
+        """
+        获取赌狗排行榜（参与局数最多）
+        """
+        if window:
+            rows = self._window_board(group_id, window, 0, limit, "total DESC, user_id DESC")
+            return [(row["user_id"], row["total"], self._window_stats(row)) for row in rows]
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM users WHERE group_id = ? ORDER BY total DESC, user_id DESC LIMIT ?",
+                (self._scope(group_id), limit),
+            ).fetchall()
+        return [(row["user_id"], row["total"], self._row_to_stats(row)) for row in rows]
+
+    def get_rating_board(self, group_id: str = None, min_games: int = RATED_MIN_GAMES,
+                         limit: int = 5) -> List[Tuple[str, float, Dict]]:
+        """
+        获取等级分排行榜，走 (group_id, rating, games, user_id) 索引
+        :param min_games: 最少对决场数
+        :return: [(user_id, 等级分, stats), ...]，stats 含 rating / rated_games
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT u.*, r.rating, r.games AS rated_games FROM ratings r "
+                "JOIN users u ON u.group_id = r.group_id AND u.user_id = r.user_id "
+                "WHERE r.group_id = ? AND r.games >= ? "
+                "ORDER BY r.rating DESC, r.games DESC, r.user_id DESC LIMIT ?",
+                (self._scope(group_id), min_games, limit),
+            ).fetchall()
+        return [(row["user_id"], row["rating"], self._row_to_stats(row)) for row in rows]
+
+    def get_percentile(self, user_id: str, group_id: str = None, sort_by: str = "rate",
+                       min_games: int = 5) -> Optional[float]:
+        """
+        用户在排行范围内的百分位：达标用户中分数严格低于该用户的占比（0~1）
+        在数组化计数上做一次整列比较，不扫描 users 表
+        :return: 局数不足 min_games 或没有记录时为 None
+        """
+        with self._lock:
+            return self._get_table(self._scope(group_id)).percentile(user_id, sort_by, min_games)
+
+    def get_rivals(self, user_id: str, group_id: str = None, limit: int = 5) -> List[Tuple[str, int, int, int]]:
+        """
+        获取用户的宿敌（对战次数最多的对手）
+        用户在主键前缀 / idx_pvp_user2 两侧各走一次索引
+        :return: [(对手ID, 对战次数, 用户胜场, 用户负场), ...]
+        """
+        with self._lock:
+            scope = self._scope(group_id)
+            rows = self._conn.execute(
+                "SELECT user2_id AS rival_id, total, user1_wins AS wins, user2_wins AS losses "
+                "FROM pvp WHERE group_id = ? AND user1_id = ? "
+                "UNION ALL "
+                "SELECT user1_id, total, user2_wins, user1_wins "
+                "FROM pvp WHERE group_id = ? AND user2_id = ? "
+                "ORDER BY total DESC, rival_id LIMIT ?",
+                (scope, user_id, scope, user_id, limit),
+            ).fetchall()
+        return [(row["rival_id"], row["total"], row["wins"], row["losses"]) for row in rows]
+
+
+if __name__ == "__main__":
+    # 迁移工具：python -m core.sqlite_stats <数据目录>
+    import sys
+
+    if len(sys.argv) != 2:
+        print("用法: python -m core.sqlite_stats <包含 roulette_stats.json 的数据目录>")
+        sys.exit(1)
+    data_dir = sys.argv[1]
+    if not has_saved_stats(data_dir):
+        print(f"[Roulette] {data_dir} 中没有可导入的战绩文件")
+        sys.exit(1)
+    manager = SqliteStatsManager(data_dir, flush_interval=None, auto_import=False)
+    try:
+        if not manager._is_empty():
+            print(f"[Roulette] {manager.db_file} 已有数据，跳过导入")
+        else:
+            imported = manager.import_json(data_dir, only_if_empty=True, keep_source=True)
+            if imported is None:
+                print(f"[Roulette] {manager.db_file} 已有数据，跳过导入")
+            else:
+                print(f"[Roulette] 已导入 {imported} 条记录到 {manager.db_file}")
+    finally:
+        manager.close()
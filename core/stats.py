@@ -1,148 +1,699 @@
 import json
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from pathlib import Path
 import threading
+import time
+
+from .elo import DEFAULT_K, RATED_MIN_GAMES, EloRatings, check_coverage
+from .metrics import metrics
+from .rank_index import RankIndex
+from .ranking import CounterTable
+from .records import PairRecord, UserRecord, pair_key
+from .shards import GroupShards
+from .snapshot import (
+    RecordMap,
+    Snapshot,
+    convert_json,
+    encode_snapshot,
+    list_generation_files,
+    list_snapshots,
+    snapshot_path,
+    write_snapshot,
+)
+from .windows import WindowedCounters, today, window_days
+from .writer import BackgroundWriter
+
+
+# 胜率排行索引只收录参与局数达到该值的用户（与排行榜默认门槛一致）
+RANKED_MIN_GAMES = 5
+
+
+def has_saved_stats(data_dir: str) -> bool:
+    """数据目录中是否已有 JSON 或二进制格式的战绩"""
+    return bool(list_snapshots(data_dir)) or os.path.exists(os.path.join(data_dir, "roulette_stats.json"))
 
 
 class StatsManager:
-    """战绩管理器"""
+    """
+    战绩管理器
+    二进制快照 roulette_stats.<代>.bin + 同代追加日志 roulette_stats.<代>.journal：
+    每局结果只追加一行日志，日志累计 compact_every 条后合并生成下一代快照，启动时回放快照与日志尾部。
+    快照通过内存映射打开，用户记录在首次访问时才解码；旧的 roulette_stats.json 会在首次启动时自动转换。
+    群战绩按群分片保存在 groups/ 下（见 GroupShards），全局快照只包含全局战绩，一局结果只重写所在群的分片。
+    近 30 天的按天汇总（见 WindowedCounters）随快照保存为 roulette_stats.<代>.windows，日志记录带上对局日期用于回放。
+    对决的等级分（见 EloRatings）同样随快照保存为 roulette_stats.<代>.ratings，由日志中的对决记录按顺序回放。
+    日志写入由后台线程按 flush_interval 秒或 flush_batch 局合并执行；flush_interval 为 None 时同步写入。
+    """
     
-    def __init__(self, data_dir: str):
+    def __init__(
+        self,
+        data_dir: str,
+        compact_every: int = 1000,
+        flush_interval: Optional[float] = 2.0,
+        flush_batch: int = 100,
+        group_memory_budget: int = 200000,
+        rating_k: float = DEFAULT_K,
+    ):
+        """
+        :param rating_k: 等级分的 K 值，更改后需调用 rebuild_ratings() 重算
+        """
         self.data_dir = data_dir
         os.makedirs(data_dir, exist_ok=True)
-        self.data_file = os.path.join(data_dir, "roulette_stats.json")
+        self.compact_every = max(1, compact_every)
+        self._generation = 0
+        self._snapshot: Optional[Snapshot] = None
+        self._journal_count = 0  # 当前日志中尚未合并进快照的记录数
+        self._position = 0  # 当前代日志中已分配的位置（含尚未写入的记录），用作分片标签
+        self._journal = None
+        self._pending: List[Dict] = []  # 已应用到内存、尚未写入日志的结果
+        self._applied = 0  # 已应用到内存的结果数，用于判断序列化之后是否又有改动
         self._lock = threading.Lock()
+        self._io_lock = threading.Lock()  # 串行化文件写入
         self.stats: Dict = {
-            "users": {},  # user_id -> {total, wins, losses, win_streak, max_win_streak, current_streak}
-            "pvp": {},    # f"{user1_id}_{user2_id}" -> {total, user1_wins, user2_wins}
-            "groups": {}, # group_id -> {users: {}, pvp: {}}
+            "users": RecordMap(),  # user_id -> UserRecord(total, wins, losses, win_streak, max_win_streak, current_streak)
+            "pvp": RecordMap(kind="pvp"),  # (user1_id, user2_id) -> PairRecord(total, user1_wins, user2_wins)
         }
+        # 群战绩分片：group_id -> {users, pvp}，按需加载
+        self.groups = GroupShards(
+            os.path.join(data_dir, "groups"), self._apply_group_entry, group_memory_budget
+        )
+        self.groups.on_evict = self._drop_group_indexes
+        # 排行索引：None 表示全局，其余为 group_id -> (胜率索引, 局数索引)，首次查询时建立
+        self._indexes: Dict[Optional[str], Tuple[RankIndex, RankIndex]] = {}
+        # 对手邻接索引：范围 -> user_id -> 交过手的对手集合，首次查询时建立
+        self._rivals: Dict[Optional[str], Dict[str, set]] = {}
+        # 数组化计数：范围 -> CounterTable，按置信分数排行或计算百分位时首次建立
+        self._tables: Dict[Optional[str], CounterTable] = {}
+        # 日/周/月排行的按天汇总（全局与各群）
+        self.windows = WindowedCounters()
+        # 全局与各群的等级分
+        self.ratings = EloRatings(k=rating_k)
         self._load_data()
+        self._replay_journal()
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._writer = None
+        if flush_interval is not None:
+            self._writer = BackgroundWriter(self.flush, interval=flush_interval, max_pending=flush_batch)
+    
+    @property
+    def journal_file(self) -> str:
+        return os.path.join(self.data_dir, f"roulette_stats.{self._generation}.journal")
+    
+    def _windows_file(self, generation: int) -> str:
+        return os.path.join(self.data_dir, f"roulette_stats.{generation}.windows")
+
+    def _ratings_file(self, generation: int) -> str:
+        return os.path.join(self.data_dir, f"roulette_stats.{generation}.ratings")
     
     def _load_data(self):
-        """加载数据"""
-        if os.path.exists(self.data_file):
+        """加载数据：映射最新一代快照，必要时先从 JSON 转换"""
+        snapshots = list_snapshots(self.data_dir)
+        json_file = os.path.join(self.data_dir, "roulette_stats.json")
+        if not snapshots and os.path.exists(json_file):
+            try:
+                path = convert_json(self.data_dir)
+                # 旧版本的日志接在 JSON 之后，顺延给转换出的第一代快照
+                legacy_journal = os.path.join(self.data_dir, "roulette_stats.journal")
+                if os.path.exists(legacy_journal):
+                    os.replace(legacy_journal, path[:-len(".bin")] + ".journal")
+                snapshots = list_snapshots(self.data_dir)
+            except Exception as e:
+                print(f"[Roulette] 转换 JSON 战绩数据失败: {e}")
+
+        for generation, path in snapshots:
             try:
-                with open(self.data_file, 'r', encoding='utf-8') as f:
-                    self.stats = json.load(f)
-                # 兼容旧数据
-                if "users" not in self.stats:
-                    self.stats["users"] = {}
-                if "pvp" not in self.stats:
-                    self.stats["pvp"] = {}
-                if "groups" not in self.stats:
-                    self.stats["groups"] = {}
+                self._snapshot = Snapshot(path)
             except Exception as e:
-                print(f"[Roulette] 加载战绩数据失败: {e}")
+                print(f"[Roulette] 加载战绩快照 {path} 失败: {e}")
+                continue
+            self._generation = generation
+            break
+        else:
+            return
+
+        # 旧版快照中包含群战绩时拆分为分片，分片标签为快照所在代的起点
+        try:
+            self.groups.import_scopes(self._snapshot, (self._generation, 0))
+        except Exception as e:
+            print(f"[Roulette] 拆分群战绩分片失败: {e}")
+        self._bind_snapshot(keep_overlay=False)
+        self._load_windows()
+        self._load_ratings()
+        self._remove_old_generations()
+    
+    def _load_windows(self):
+        """加载与当前快照同代的按天汇总"""
+        windows_file = self._windows_file(self._generation)
+        if not os.path.exists(windows_file):
+            return
+        try:
+            with open(windows_file, 'r', encoding='utf-8') as f:
+                self.windows.load(json.load(f))
+        except Exception as e:
+            print(f"[Roulette] 加载近期战绩汇总失败: {e}")
+
+    def _load_ratings(self):
+        """加载与当前快照同代的等级分"""
+        ratings_file = self._ratings_file(self._generation)
+        if not os.path.exists(ratings_file):
+            return
+        try:
+            with open(ratings_file, 'r', encoding='utf-8') as f:
+                self.ratings.load(json.load(f))
+        except Exception as e:
+            print(f"[Roulette] 加载等级分失败: {e}")
+    
+    def _bind_snapshot(self, keep_overlay: bool):
+        """让全局记录表以当前快照为底（调用方持有锁或处于初始化阶段）"""
+        snapshot = self._snapshot
+        users_off, users_count, pvp_off, pvp_count = snapshot.scopes.get(None, (0, 0, 0, 0))
+        self.stats["users"].rebase(snapshot, users_off, users_count, keep_overlay)
+        self.stats["pvp"].rebase(snapshot, pvp_off, pvp_count, keep_overlay)
+    
+    def _remove_old_generations(self):
+        """删除比当前代更旧的快照、日志、近期汇总和等级分文件"""
+        for generation, old_file in list_generation_files(self.data_dir):
+            if generation >= self._generation:
+                continue
+            try:
+                os.remove(old_file)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[Roulette] 删除旧战绩文件 {old_file} 失败: {e}")
+    
+    def _replay_journal(self):
+        """回放快照之后追加的日志记录"""
+        if not os.path.exists(self.journal_file):
+            return
+        try:
+            with open(self.journal_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 写入中途崩溃留下的残缺行，忽略
+                        print(f"[Roulette] 跳过损坏的战绩日志记录: {line[:50]}")
+                        continue
+                    self._journal_count += 1
+                    self._position += 1
+                    self._applied += 1
+                    self._apply_to(self.stats, None, entry["l"], entry["w"], entry["p"])
+                    self._rate_duel(entry["l"], entry["w"], entry["p"], entry.get("g"))
+                    # 旧版日志没有对局日期，不计入近期排行
+                    if "t" in entry:
+                        self.windows.add(entry["t"], None, entry["l"], entry["w"])
+                        if entry.get("g"):
+                            self.windows.add(entry["t"], entry["g"], entry["l"], entry["w"])
+                    # 群战绩先积压，分片中尚未包含的记录在该群首次加载时补上
+                    if entry.get("g"):
+                        self.groups.add_backlog(entry["g"], (self._generation, self._position), entry)
+        except Exception as e:
+            print(f"[Roulette] 回放战绩日志失败: {e}")
+    
+    @staticmethod
+    def _encode_stats(users: RecordMap, pvp: RecordMap) -> bytes:
+        """把冻结的全局战绩视图编码为快照（不需要持有锁）"""
+        return encode_snapshot([(None, users.items(), pvp.items())])
+    
+    def _save_data(self, users: RecordMap, pvp: RecordMap, applied: int, windows: List, ratings: Dict) -> bool:
+        """
+        写入下一代快照并切换到新的空日志（调用方持有 _io_lock）
+        :param users: 冻结的全局用户表视图，见 RecordMap.freeze()
+        :param pvp: 冻结的全局对战表视图
+        :param applied: 序列化时的 _applied 值
+        :param windows: 序列化时的按天汇总
+        :param ratings: 序列化时的等级分
+        """
+        with metrics.timer("roulette_stats_seconds", op="save"):
+            return self._write_generation(users, pvp, applied, windows, ratings)
     
-    def _save_data(self):
-        """保存数据"""
+    def _write_generation(self, users: RecordMap, pvp: RecordMap, applied: int, windows: List, ratings: Dict) -> bool:
+        generation = self._generation + 1
+        path = snapshot_path(self.data_dir, generation)
         try:
-            with open(self.data_file, 'w', encoding='utf-8') as f:
-                json.dump(self.stats, f, ensure_ascii=False, indent=2)
+            data = self._encode_stats(users, pvp)
+            # 先写汇总与等级分：快照改名成功之前，新一代的这些文件不会被读取
+            write_snapshot(
+                self._windows_file(generation),
+                json.dumps(windows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            )
+            write_snapshot(
+                self._ratings_file(generation),
+                json.dumps(ratings, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            )
+            write_snapshot(path, data)
+            snapshot = Snapshot(path)
         except Exception as e:
             print(f"[Roulette] 保存战绩数据失败: {e}")
+            return False
+
+        with self._lock:
+            old_snapshot = self._snapshot
+            self._snapshot = snapshot
+            self._generation = generation
+            # 序列化之后应用的结果会写进新一代日志，位置从新日志起点重新计数
+            self._position = self._applied - applied
+            # 序列化之后没有新结果时，新快照包含全部数据，可以释放已解码的记录
+            self._bind_snapshot(keep_overlay=self._applied != applied)
+        if old_snapshot:
+            old_snapshot.close()
+        if self._journal:
+            self._journal.close()
+        self._journal = open(self.journal_file, 'a', encoding='utf-8')
+        self._remove_old_generations()
+        return True
+    
+    def _append_journal(self, entries: List[Dict]):
+        """追加日志记录（调用方持有 _io_lock）"""
+        try:
+            self._journal.write(
+                "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries)
+            )
+            self._journal.flush()
+        except Exception as e:
+            print(f"[Roulette] 写入战绩日志失败: {e}")
+    
+    def flush(self, compact: bool = False):
+        """
+        把内存中尚未落盘的结果写入日志并重写有改动的群分片，日志达到阈值时合并生成下一代快照
+        由后台写入线程调用，也可在任意线程中手动调用
+        :param compact: 是否强制合并快照
+        """
+        with metrics.timer("roulette_stats_seconds", op="flush"):
+            self._flush(compact)
+    
+    def _flush(self, compact: bool):
+        with self._io_lock:
+            with self._lock:
+                entries, self._pending = self._pending, []
+                compact = compact or self._journal_count + len(entries) >= self.compact_every
+                label = (self._generation, self._position)
+                # 日志即将被截断时，积压记录必须先落进分片
+                shards = self.groups.freeze_dirty(load_backlog=compact)
+                if compact:
+                    # 锁内只冻结，保证快照与已应用的结果一致；编码在锁外进行，不阻塞记录与查询
+                    users, pvp = self.stats["users"].freeze(), self.stats["pvp"].freeze()
+                    applied = self._applied
+                    windows = self.windows.dump()
+                    ratings = self.ratings.dump()
+                self._journal_count += len(entries)
+
+            # 先写日志再写分片，分片标签不会超过已落盘的日志位置
+            if entries:
+                self._append_journal(entries)
+            if shards:
+                written = self.groups.write(label, shards)
+                with self._lock:
+                    stale = self.groups.rebind(label, shards, written)
+                self.groups.release(stale)
+            if compact:
+                saved = self._save_data(users, pvp, applied, windows, ratings)
+                with self._lock:
+                    if saved:
+                        self._journal_count = 0
+                    else:
+                        # 没有切换到新快照，冻结层并回上层
+                        self.stats["users"].thaw()
+                        self.stats["pvp"].thaw()
+    
+    def iter_groups(self):
+        """依次加载并给出每个群的战绩 (group_id, {users, pvp})，遍历期间不应并发写入"""
+        for group_id in self.groups.ids():
+            with self._lock:
+                group = self.groups.get(group_id)
+            if group is not None:
+                yield group_id, group
+    
+    def iter_records(self, group_id: Optional[str] = None) -> Iterator[Tuple]:
+        """
+        流式导出战绩记录：先合并一次快照，再直接读取快照与分片文件，不占用内存中的记录表，
+        导出期间的新结果不影响正在读取的文件（导出内容不早于调用时刻）
+        :param group_id: 只导出该群，None 表示全局与全部群
+        :return: ("user", 群号或 None, user_id, UserRecord) 与 ("pvp", 群号或 None, (user1_id, user2_id), PairRecord)
+        """
+        self.flush(compact=True)
+        if group_id is None:
+            with self._io_lock:
+                snapshot = Snapshot(self._snapshot.path) if self._snapshot else None
+            if snapshot:
+                yield from self._iter_snapshot(snapshot, None)
+            group_ids = sorted(self.groups.ids())
+        else:
+            group_ids = [group_id] if group_id in self.groups else []
+        for scope in group_ids:
+            with self._io_lock:
+                with self._lock:
+                    path = self.groups.path_of(scope)
+                snapshot = Snapshot(path) if path else None
+            if snapshot:
+                yield from self._iter_snapshot(snapshot, scope)
+
+    @staticmethod
+    def _iter_snapshot(snapshot: Snapshot, scope: Optional[str]) -> Iterator[Tuple]:
+        try:
+            for user_id, stats in snapshot.users(None).iter_items():
+                yield "user", scope, user_id, stats
+            for key, pvp_stats in snapshot.pvp(None).iter_items():
+                yield "pvp", scope, key, pvp_stats
+        finally:
+            snapshot.close()
+
+    def import_records(self, records: Iterable[Tuple], batch_size: int = 10000) -> int:
+        """
+        批量导入战绩记录（覆盖同一范围内同一用户 / 同一对玩家的原有记录）
+        每批在锁内直接写入记录表，不经过日志；全部导入后只合并一次快照
+        导入的是累计值，没有对局日期，不计入日/周/月排行
+        :param records: 与 iter_records() 相同格式的记录
+        :return: 导入的记录数
+        """
+        count = 0
+        touched = set()
+        batch = []
+
+        def apply():
+            # 持有 _io_lock：批次不会落在一次合并的序列化与切换快照之间而被丢弃
+            with self._io_lock, self._lock:
+                for kind, scope, key, value in batch:
+                    target = self.stats if scope is None else self.groups.get(scope, create=True)
+                    target["users" if kind == "user" else "pvp"][key] = value
+                    if scope is not None:
+                        self.groups.mark_dirty(scope)
+                    touched.add(scope)
+                # 不再与快照一致的排行与对手索引在下次查询时重建
+                for scope in touched:
+                    self._indexes.pop(scope, None)
+                    self._rivals.pop(scope, None)
+                    self._tables.pop(scope, None)
+            batch.clear()
+
+        for record in records:
+            batch.append(record)
+            count += 1
+            if len(batch) >= batch_size:
+                apply()
+        if batch:
+            apply()
+        if count:
+            self.flush(compact=True)
+        return count
+
+    def compact(self):
+        """立即把日志合并进快照"""
+        self.flush(compact=True)
+    
+    def close(self):
+        """停止后台写入线程并合并日志"""
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+        if self._pending or self._journal_count:
+            self.flush(compact=True)
+        with self._io_lock:
+            if self._journal:
+                self._journal.close()
+                self._journal = None
+            if self._snapshot:
+                self._snapshot.close()
+                self._snapshot = None
+            self.groups.close()
     
     def record_game_result(self, loser_id: str, winner_ids: List[str], is_pvp: bool = False, group_id: str = None):
         """
-        记录游戏结果
+        记录游戏结果：只更新内存并登记待写入，文件 I/O 由后台线程合并完成
         :param loser_id: 失败者ID
         :param winner_ids: 胜利者ID列表
         :param is_pvp: 是否为双人对战
         :param group_id: 群组ID
         """
+        start = time.perf_counter()
+        day = today()
         with self._lock:
-            targets = [self.stats]
+            self._apply_result(loser_id, winner_ids, is_pvp, group_id)
+            self._rate_duel(loser_id, winner_ids, is_pvp, group_id)
+            self.windows.add(day, None, loser_id, winner_ids)
             if group_id:
-                if group_id not in self.stats["groups"]:
-                    self.stats["groups"][group_id] = {"users": {}, "pvp": {}}
-                targets.append(self.stats["groups"][group_id])
-
-            for target in targets:
-                # 记录失败者
-                if loser_id not in target["users"]:
-                    target["users"][loser_id] = {
-                        "total": 0,
-                        "wins": 0,
-                        "losses": 0,
-                        "win_streak": 0,
-                        "max_win_streak": 0,
-                        "current_streak": 0
-                    }
-                
-                user_stats = target["users"][loser_id]
-                user_stats["total"] += 1
-                user_stats["losses"] += 1
-                user_stats["current_streak"] = 0  # 输了重置连胜
-                
-                # 记录胜利者
-                for winner_id in winner_ids:
-                    if winner_id not in target["users"]:
-                        target["users"][winner_id] = {
-                            "total": 0,
-                            "wins": 0,
-                            "losses": 0,
-                            "win_streak": 0,
-                            "max_win_streak": 0,
-                            "current_streak": 0
-                        }
-                    
-                    winner_stats = target["users"][winner_id]
-                    winner_stats["total"] += 1
-                    winner_stats["wins"] += 1
-                    winner_stats["current_streak"] += 1
-                    
-                    # 更新最高连胜
-                    if winner_stats["current_streak"] > winner_stats["max_win_streak"]:
-                        winner_stats["max_win_streak"] = winner_stats["current_streak"]
-                
-                # 如果是双人对战，记录PVP战绩
-                if is_pvp and len(winner_ids) == 1:
-                    winner_id = winner_ids[0]
-                    # 确保顺序一致，小ID在前
-                    user1_id, user2_id = sorted([loser_id, winner_id])
-                    pvp_key = f"{user1_id}_{user2_id}"
-                    
-                    if pvp_key not in target["pvp"]:
-                        target["pvp"][pvp_key] = {
-                            "total": 0,
-                            f"{user1_id}_wins": 0,
-                            f"{user2_id}_wins": 0
-                        }
-                    
-                    pvp_stats = target["pvp"][pvp_key]
-                    pvp_stats["total"] += 1
-                    pvp_stats[f"{winner_id}_wins"] += 1
+                self.windows.add(day, group_id, loser_id, winner_ids)
+            self._pending.append({"l": loser_id, "w": winner_ids, "p": is_pvp, "g": group_id, "t": day})
+        metrics.observe("roulette_stats_seconds", time.perf_counter() - start, op="record")
+        if self._writer:
+            self._writer.mark_dirty()
+        else:
+            self.flush()
+    
+    def _apply_result(self, loser_id: str, winner_ids: List[str], is_pvp: bool, group_id: Optional[str]):
+        """把一局结果应用到内存数据（调用方持有锁）"""
+        self._applied += 1
+        self._position += 1
+        self._apply_to(self.stats, None, loser_id, winner_ids, is_pvp)
+        if group_id:
+            group = self.groups.get(group_id, create=True)
+            self._apply_to(group, group_id, loser_id, winner_ids, is_pvp)
+            self.groups.mark_dirty(group_id)
+    
+    def _rate_duel(self, loser_id: str, winner_ids: List[str], is_pvp: bool, group_id: Optional[str]):
+        """双人对决计入全局与所在群的等级分（调用方持有锁）"""
+        if not is_pvp or len(winner_ids) != 1:
+            return
+        self.ratings.update(None, winner_ids[0], loser_id)
+        if group_id:
+            self.ratings.update(group_id, winner_ids[0], loser_id)
+
+    def count_duels(self) -> int:
+        """战绩中记录的对决总场数（全局对战记录之和）"""
+        with self._lock:
+            return sum(record.total for record in self.stats["pvp"].values())
+
+    def rebuild_ratings(self, duels: Iterable[Tuple[Optional[str], str, str]], force: bool = False) -> int:
+        """
+        按顺序重放对决，整体替换等级分并合并一次快照
+        重放在锁外进行，期间新结束的对决只计入被替换掉的旧分数
+        :param duels: (群号或 None, 胜者, 败者)，见 core.elo.iter_duels()
+        :param force: 对局历史没有覆盖全部对决时仍然替换
+        :return: 重放的对决场数
+        :raises ValueError: 重放的场数少于战绩中的对决场数且未指定 force，此时等级分保持不变
+        """
+        recorded = self.count_duels()
+        ratings = EloRatings(k=self.ratings.k, initial=self.ratings.initial)
+        count = ratings.rebuild(duels)
+        check_coverage(count, recorded, force)
+        with self._lock:
+            self.ratings = ratings
+        self.flush(compact=True)
+        return count
+
+    def _apply_group_entry(self, group_id: str, group: Dict, entry: Dict):
+        """补上群分片积压的日志记录"""
+        self._apply_to(group, group_id, entry["l"], entry["w"], entry["p"])
+    
+    def _apply_to(self, target: Dict, scope: Optional[str], loser_id: str, winner_ids: List[str], is_pvp: bool):
+        """
+        把一局结果应用到一个范围的战绩（调用方持有锁）
+        :param target: {"users": ..., "pvp": ...}
+        :param scope: 范围，None 表示全局
+        """
+        # 记录失败者
+        if loser_id not in target["users"]:
+            target["users"][loser_id] = UserRecord()
+        
+        user_stats = target["users"][loser_id]
+        user_stats.total += 1
+        user_stats.losses += 1
+        user_stats.current_streak = 0  # 输了重置连胜
+        
+        # 记录胜利者
+        for winner_id in winner_ids:
+            if winner_id not in target["users"]:
+                target["users"][winner_id] = UserRecord()
+            
+            winner_stats = target["users"][winner_id]
+            winner_stats.total += 1
+            winner_stats.wins += 1
+            winner_stats.current_streak += 1
             
-            self._save_data()
+            # 更新最高连胜
+            if winner_stats.current_streak > winner_stats.max_win_streak:
+                winner_stats.max_win_streak = winner_stats.current_streak
+        
+        # 如果是双人对战，记录PVP战绩
+        if is_pvp and len(winner_ids) == 1:
+            winner_id = winner_ids[0]
+            # 确保顺序一致，小ID在前
+            key = pair_key(loser_id, winner_id)
+            pvp_stats = target["pvp"].get(key)
+            if pvp_stats is None:
+                pvp_stats = target["pvp"][key] = PairRecord()
+            
+            pvp_stats.total += 1
+            if winner_id == key[0]:
+                pvp_stats.user1_wins += 1
+            else:
+                pvp_stats.user2_wins += 1
+
+            # 同步已建立的对手邻接索引
+            rivals = self._rivals.get(scope)
+            if rivals is not None:
+                rivals.setdefault(loser_id, set()).add(winner_id)
+                rivals.setdefault(winner_id, set()).add(loser_id)
+
+        # 同步已建立的排行索引与数组化计数
+        indexes = self._indexes.get(scope)
+        if indexes:
+            for user_id in (loser_id, *winner_ids):
+                self._index_user(indexes, user_id, target["users"][user_id])
+        table = self._tables.get(scope)
+        if table is not None:
+            for user_id in (loser_id, *winner_ids):
+                stats = target["users"][user_id]
+                table.set(user_id, stats.total, stats.wins)
+
+    @staticmethod
+    def _index_user(indexes: Tuple[RankIndex, RankIndex], user_id: str, stats: UserRecord):
+        """更新单个用户在排行索引中的位置"""
+        rate_index, active_index = indexes
+        total = stats.total
+        active_index.update(user_id, total)
+        if total >= RANKED_MIN_GAMES:
+            rate_index.update(user_id, stats.wins / total, total)
+        else:
+            rate_index.discard(user_id)
+    
+    def _drop_group_indexes(self, group_id: str):
+        """群被卸载时丢弃它的索引"""
+        self._indexes.pop(group_id, None)
+        self._rivals.pop(group_id, None)
+        self._tables.pop(group_id, None)
+    
+    def _get_rivals(self, scope: Optional[str]) -> Dict[str, set]:
+        """获取对手邻接索引，不存在时遍历一次对战表建立（调用方持有锁）"""
+        rivals = self._rivals.get(scope)
+        if rivals is None:
+            pvp = self.stats["pvp"] if scope is None else self.groups.get(scope)["pvp"]
+            rivals = {}
+            for user1_id, user2_id in pvp:
+                rivals.setdefault(user1_id, set()).add(user2_id)
+                rivals.setdefault(user2_id, set()).add(user1_id)
+            self._rivals[scope] = rivals
+        return rivals
     
-    def get_user_stats(self, user_id: str, group_id: str = None) -> Optional[Dict]:
-        """获取用户战绩"""
+    def _scope_of(self, group_id: Optional[str]) -> Optional[str]:
+        """排行榜数据范围：群内没有数据时退回全局（调用方持有锁）"""
+        if group_id and group_id in self.groups:
+            return group_id
+        return None
+    
+    def _scope_users(self, scope: Optional[str]) -> Dict:
+        if scope is None:
+            return self.stats["users"]
+        return self.groups.get(scope)["users"]
+    
+    def _get_indexes(self, scope: Optional[str]) -> Tuple[RankIndex, RankIndex]:
+        """获取排行索引，不存在时整体排序建立一次（调用方持有锁）"""
+        indexes = self._indexes.get(scope)
+        if indexes is None:
+            users = self._scope_users(scope)
+            rate_index, active_index = RankIndex(), RankIndex()
+            rate_index.bulk_load(
+                (user_id, (stats.wins / stats.total, stats.total))
+                for user_id, stats in users.items()
+                if stats.total >= RANKED_MIN_GAMES
+            )
+            active_index.bulk_load(
+                (user_id, (stats.total,)) for user_id, stats in users.items()
+            )
+            indexes = self._indexes[scope] = (rate_index, active_index)
+        return indexes
+    
+    def _get_table(self, scope: Optional[str]) -> CounterTable:
+        """获取数组化计数，不存在时遍历一次用户表建立（调用方持有锁）"""
+        table = self._tables.get(scope)
+        if table is None:
+            table = self._tables[scope] = CounterTable.from_counts(
+                (user_id, stats.total, stats.wins) for user_id, stats in self._scope_users(scope).items()
+            )
+        return table
+
+    def _rate_board(self, group_id: Optional[str], min_games: int, limit: int, highest: bool,
+                    sort_by: str = "rate") -> List[Tuple[str, float, Dict]]:
+        """按胜率（或置信分数）取排行（调用方持有锁）"""
+        scope = self._scope_of(group_id)
+        users = self._scope_users(scope)
+
+        if sort_by != "rate" or min_games < RANKED_MIN_GAMES:
+            # 置信分数，或门槛低于索引收录条件：对数组化计数整列打分
+            board = self._get_table(scope).top(limit, sort_by, lowest=not highest, min_games=min_games)
+            return [(user_id, wins / total, users[user_id].to_dict()) for user_id, total, wins in board]
+
+        rate_index, _ = self._get_indexes(scope)
+        ordered = rate_index.highest() if highest else rate_index.lowest()
+        result = []
+        for user_id in ordered:
+            if len(result) >= limit:
+                break
+            stats = users[user_id]
+            if stats.total >= min_games:
+                result.append((user_id, stats.wins / stats.total, stats.to_dict()))
+        return result
+    
+    def data_version(self) -> int:
+        """与 SqliteStatsManager 一致；战绩文件只由本进程写入，始终为 0"""
+        return 0
+
+    def board_scope(self, group_id: Optional[str]) -> Optional[str]:
+        """排行榜实际使用的数据范围：群号，群内没有数据时为 None（全局）"""
+        with self._lock:
+            return self._scope_of(group_id)
+
+    def get_user_stats(self, user_id: str, group_id: str = None, window: str = None) -> Optional[Dict]:
+        """
+        获取用户战绩
+        :param window: 时间窗口 day/week/month，给出时按排行榜的范围统计，只有 total/wins/losses
+        """
+        if window:
+            days = window_days(window)
+            with self._lock:
+                total, wins = self.windows.user_counts(self._scope_of(group_id), days, user_id)
+            return self._window_stats(total, wins) if total else None
         with self._lock:
-            if group_id and group_id in self.stats["groups"]:
-                return self.stats["groups"][group_id]["users"].get(user_id)
-            return self.stats["users"].get(user_id)
+            if group_id and group_id in self.groups:
+                scope = group_id
+                stats = self.groups.get(group_id)["users"].get(user_id)
+            else:
+                scope = None
+                stats = self.stats["users"].get(user_id)
+            if not stats:
+                return None
+            return self._with_rating(stats.to_dict(), self.ratings.get(scope, user_id))
+
+    @staticmethod
+    def _with_rating(stats: Dict, rating: Optional[Tuple[float, int]]) -> Dict:
+        """打过对决的用户附上 rating（等级分）与 rated_games（对决场数）"""
+        if rating:
+            stats["rating"], stats["rated_games"] = rating
+        return stats
     
     def get_pvp_stats(self, user1_id: str, user2_id: str, group_id: str = None) -> Optional[Dict]:
         """获取两个用户之间的对战记录"""
         with self._lock:
-            user1_id, user2_id = sorted([user1_id, user2_id])
-            pvp_key = f"{user1_id}_{user2_id}"
+            user1_id, user2_id = key = pair_key(user1_id, user2_id)
 
             pvp_stats = None
-            if group_id and group_id in self.stats["groups"]:
-                pvp_stats = self.stats["groups"][group_id]["pvp"].get(pvp_key)
+            if group_id and group_id in self.groups:
+                pvp_stats = self.groups.get(group_id)["pvp"].get(key)
 
             if not pvp_stats and not group_id:
-                pvp_stats = self.stats["pvp"].get(pvp_key)
+                pvp_stats = self.stats["pvp"].get(key)
 
             if not pvp_stats:
                 return None
 
-            user1_wins = pvp_stats.get(f"{user1_id}_wins", 0)
-            user2_wins = pvp_stats.get(f"{user2_id}_wins", 0)
-            total = pvp_stats["total"]
+            user1_wins = pvp_stats.user1_wins
+            user2_wins = pvp_stats.user2_wins
+            total = pvp_stats.total
 
             # 计算胜率
             user1_win_rate = (user1_wins / total * 100) if total > 0 else 0
@@ -157,67 +708,130 @@ class StatsManager:
                 f"{user2_id}_win_rate": user2_win_rate
             }
     
-    def get_top_players(self, group_id: str = None, min_games: int = 5, limit: int = 5) -> List[Tuple[str, float, Dict]]:
+    def _window_board(self, group_id: Optional[str], window: str, limit: int, key, min_games: int = 0,
+                      lowest: bool = False) -> List[Tuple[str, int, int]]:
+        """近期排行：合并窗口内的按天汇总，返回 [(user_id, 局数, 胜场), ...]"""
+        days = window_days(window)
+        with self._lock:
+            return self.windows.board(self._scope_of(group_id), days, limit, key, min_games, lowest)
+
+    def _window_score_board(self, group_id: Optional[str], window: str, limit: int, sort_by: str,
+                            lowest: bool, min_games: int) -> List[Tuple[str, float, Dict]]:
+        """近期排行按置信分数排序：窗口内的汇总临时建成数组化计数"""
+        days = window_days(window)
+        with self._lock:
+            merged = self.windows.merge(self._scope_of(group_id), days)
+        table = CounterTable.from_counts((user_id, total, wins) for user_id, (total, wins) in merged.items())
+        board = table.top(limit, sort_by, lowest=lowest, min_games=min_games)
+        return [(user_id, wins / total, self._window_stats(total, wins)) for user_id, total, wins in board]
+
+    @staticmethod
+    def _window_stats(total: int, wins: int) -> Dict:
+        return {"total": total, "wins": wins, "losses": total - wins}
+
+    def get_top_players(self, group_id: str = None, min_games: int = 5, limit: int = 5, window: str = None,
+                        sort_by: str = "rate") -> List[Tuple[str, float, Dict]]:
         """
         获取胜率排行榜
         :param group_id: 群组ID
         :param min_games: 最少参与局数
         :param limit: 返回前N名
-        :return: [(user_id, win_rate, stats), ...]
+        :param window: 时间窗口 day/week/month，None 表示全部战绩
+        :param sort_by: 排序方式 rate/wilson/bayes（见 core.ranking），返回的仍是原始胜率
+        :return: [(user_id, win_rate, stats), ...]，按窗口统计时 stats 只有 total/wins/losses
         """
+        if window and sort_by != "rate":
+            return self._window_score_board(group_id, window, limit, sort_by, False, min_games)
+        if window:
+            board = self._window_board(group_id, window, limit, lambda total, wins: (wins / total, total), min_games)
+            return [(user_id, wins / total, self._window_stats(total, wins)) for user_id, total, wins in board]
         with self._lock:
-            qualified_users = []
-            
-            source = self.stats["users"]
-            if group_id and group_id in self.stats["groups"]:
-                source = self.stats["groups"][group_id]["users"]
-            
-            for user_id, stats in source.items():
-                if stats["total"] >= min_games:
-                    win_rate = stats["wins"] / stats["total"] if stats["total"] > 0 else 0
-                    qualified_users.append((user_id, win_rate, stats))
-            
-            # 按胜率降序排序
-            qualified_users.sort(key=lambda x: x[1], reverse=True)
-            
-            return qualified_users[:limit]
+            return self._rate_board(group_id, min_games, limit, highest=True, sort_by=sort_by)
 
-    def get_unlucky_players(self, group_id: str = None, min_games: int = 5, limit: int = 5) -> List[Tuple[str, float, Dict]]:
+    def get_unlucky_players(self, group_id: str = None, min_games: int = 5, limit: int = 5, window: str = None,
+                            sort_by: str = "rate") -> List[Tuple[str, float, Dict]]:
         """
         获取散财排行榜（胜率最低）
         """
+        if window and sort_by != "rate":
+            return self._window_score_board(group_id, window, limit, sort_by, True, min_games)
+        if window:
+            board = self._window_board(
+                group_id, window, limit, lambda total, wins: (wins / total, total), min_games, lowest=True
+            )
+            return [(user_id, wins / total, self._window_stats(total, wins)) for user_id, total, wins in board]
         with self._lock:
-            qualified_users = []
-            
-            source = self.stats["users"]
-            if group_id and group_id in self.stats["groups"]:
-                source = self.stats["groups"][group_id]["users"]
-            
-            for user_id, stats in source.items():
-                if stats["total"] >= min_games:
-                    win_rate = stats["wins"] / stats["total"] if stats["total"] > 0 else 0
-                    qualified_users.append((user_id, win_rate, stats))
-            
-            # 按胜率升序排序
-            qualified_users.sort(key=lambda x: x[1])
-            
-            return qualified_users[:limit]
+            return self._rate_board(group_id, min_games, limit, highest=False, sort_by=sort_by)
 
-    def get_active_players(self, group_id: str = None, limit: int = 5) -> List[Tuple[str, int, Dict]]:
+    def get_active_players(self, group_id: str = None, limit: int = 5, window: str = None) -> List[Tuple[str, int, Dict]]:
         """
         获取赌狗排行榜（参与局数最多）
         """
+        if window:
+            board = self._window_board(group_id, window, limit, lambda total, wins: (total,))
+            return [(user_id, total, self._window_stats(total, wins)) for user_id, total, wins in board]
         with self._lock:
+            scope = self._scope_of(group_id)
+            users = self._scope_users(scope)
+            _, active_index = self._get_indexes(scope)
+
             qualified_users = []
-            
-            source = self.stats["users"]
-            if group_id and group_id in self.stats["groups"]:
-                source = self.stats["groups"][group_id]["users"]
-            
-            for user_id, stats in source.items():
-                qualified_users.append((user_id, stats["total"], stats))
-            
-            # 按参与局数降序排序
-            qualified_users.sort(key=lambda x: x[1], reverse=True)
-            
-            return qualified_users[:limit]
+            for user_id in active_index.highest():
+                if len(qualified_users) >= limit:
+                    break
+                stats = users[user_id]
+                qualified_users.append((user_id, stats.total, stats.to_dict()))
+            return qualified_users
+
+    def get_rating_board(self, group_id: str = None, min_games: int = RATED_MIN_GAMES,
+                         limit: int = 5) -> List[Tuple[str, float, Dict]]:
+        """
+        获取等级分排行榜
+        :param min_games: 最少对决场数
+        :return: [(user_id, 等级分, stats), ...]，stats 含 rating / rated_games
+        """
+        with self._lock:
+            scope = self._scope_of(group_id)
+            users = self._scope_users(scope)
+            return [
+                (user_id, rating, self._with_rating(users[user_id].to_dict(), (rating, games)))
+                for user_id, rating, games in self.ratings.board(scope, limit, min_games)
+            ]
+
+    def get_percentile(self, user_id: str, group_id: str = None, sort_by: str = "rate",
+                       min_games: int = RANKED_MIN_GAMES) -> Optional[float]:
+        """
+        用户在排行范围内的百分位：达标用户中分数严格低于该用户的占比（0~1）
+        按胜率且门槛与索引收录条件一致时直接在胜率索引中计数，否则对数组化计数做一次整列比较
+        :return: 局数不足 min_games 或没有记录时为 None
+        """
+        with self._lock:
+            scope = self._scope_of(group_id)
+            if sort_by != "rate" or min_games != RANKED_MIN_GAMES:
+                return self._get_table(scope).percentile(user_id, sort_by, min_games)
+            stats = self._scope_users(scope).get(user_id)
+            if stats is None or stats.total < RANKED_MIN_GAMES:
+                return None
+            rate_index, _ = self._get_indexes(scope)
+            return rate_index.count_below(stats.wins / stats.total) / len(rate_index)
+
+    def get_rivals(self, user_id: str, group_id: str = None, limit: int = 5) -> List[Tuple[str, int, int, int]]:
+        """
+        获取用户的宿敌（对战次数最多的对手）
+        只查找该用户交过手的对手，耗时与对手数成正比
+        :param user_id: 用户ID
+        :param group_id: 群组ID
+        :param limit: 返回前N名
+        :return: [(对手ID, 对战次数, 用户胜场, 用户负场), ...]
+        """
+        with self._lock:
+            scope = self._scope_of(group_id)
+            pvp = self.stats["pvp"] if scope is None else self.groups.get(scope)["pvp"]
+            rivals = []
+            for rival_id in self._get_rivals(scope).get(user_id, ()):
+                key = pair_key(user_id, rival_id)
+                pvp_stats = pvp[key]
+                wins = pvp_stats.wins_of(key, user_id)
+                rivals.append((rival_id, pvp_stats.total, wins, pvp_stats.total - wins))
+        rivals.sort(key=lambda item: (-item[1], item[0]))
+        return rivals[:limit]
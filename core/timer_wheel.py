@@ -0,0 +1,140 @@
+import asyncio
+import inspect
+import math
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+
+class TimerHandle:
+    """
+    定时器句柄
+    只保存回调与少量参数（群号、房间号、玩家号等），不引用消息事件或房间对象
+    """
+
+    __slots__ = ("deadline", "callback", "args", "rounds", "slot", "cancelled", "_wheel")
+
+    def __init__(self, wheel: "TimingWheel", deadline: float, callback: Callable, args: tuple):
+        self.deadline = deadline  # 到期的墙钟时间（time.time()），便于持久化后按原时间恢复
+        self.callback = callback
+        self.args = args
+        self.rounds = 0
+        self.slot = 0
+        self.cancelled = False
+        self._wheel = wheel
+
+    def cancel(self):
+        """取消定时器，O(1)，重复调用无副作用"""
+        self._wheel.cancel(self)
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline - time.time())
+
+
+class TimingWheel:
+    """
+    哈希时间轮
+    slots 个格子，每 tick 秒转动一格；定时器放进 (当前格 + 所需格数) % slots，
+    超过一圈的记录剩余圈数。登记与取消都是 O(1)，所有定时器共用一个驱动任务，
+    没有定时器时驱动任务退出，下次登记时再启动。
+    到期回调在事件循环中执行，返回协程时作为独立任务运行。
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 512):
+        self.tick = max(0.01, tick)
+        self._slots: List[Dict[TimerHandle, None]] = [{} for _ in range(max(1, slots))]
+        self._cursor = 0
+        self._count = 0
+        self._task: Optional[asyncio.Task] = None
+        self._running: Set[asyncio.Task] = set()  # 到期回调产生的任务，防止被回收
+
+    def __len__(self) -> int:
+        return self._count
+
+    def schedule(self, delay: float, callback: Callable, *args) -> TimerHandle:
+        """
+        登记定时器，需在事件循环线程中调用
+        :param delay: 延迟秒数，按 tick 向上取整，至少一格
+        :param callback: 到期时调用 callback(*args)，可以是协程函数
+        """
+        return self.schedule_at(time.time() + delay, callback, *args)
+
+    def schedule_at(self, deadline: float, callback: Callable, *args) -> TimerHandle:
+        """按墙钟时间登记定时器，已过期的在下一格触发"""
+        handle = TimerHandle(self, deadline, callback, args)
+        ticks = max(1, math.ceil((deadline - time.time()) / self.tick))
+        handle.slot = (self._cursor + ticks) % len(self._slots)
+        handle.rounds = (ticks - 1) // len(self._slots)
+        self._slots[handle.slot][handle] = None
+        self._count += 1
+        self.start()
+        return handle
+
+    def start(self):
+        """
+        确保驱动任务在运行
+        不在事件循环中调用时（如插件初始化时恢复定时器）只登记不启动，留待 start() 或下次登记时启动
+        """
+        if self._count and (self._task is None or self._task.done()):
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                return
+            self._task = loop.create_task(self._run())
+
+    def cancel(self, handle: TimerHandle):
+        if handle.cancelled:
+            return
+        handle.cancelled = True
+        if self._slots[handle.slot].pop(handle, 0) is None:
+            self._count -= 1
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time() + self.tick
+        while self._count:
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            next_tick += self.tick
+            # 事件循环被阻塞时 sleep(0) 连续补转，不丢格
+            self._advance()
+
+    def _advance(self):
+        self._cursor = (self._cursor + 1) % len(self._slots)
+        slot = self._slots[self._cursor]
+        due = []
+        for handle in slot:
+            if handle.rounds:
+                handle.rounds -= 1
+            else:
+                due.append(handle)
+        for handle in due:
+            del slot[handle]
+            self._count -= 1
+            handle.cancelled = True
+            self._fire(handle)
+
+    def _fire(self, handle: TimerHandle):
+        try:
+            result = handle.callback(*handle.args)
+        except Exception as e:
+            print(f"[Roulette] 定时任务执行失败: {e}")
+            return
+        if inspect.isawaitable(result):
+            task = asyncio.ensure_future(result)
+            self._running.add(task)
+            task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self._running.discard(task)
+        if not task.cancelled() and task.exception():
+            print(f"[Roulette] 定时任务执行失败: {task.exception()}")
+
+    def close(self):
+        """停止驱动任务并丢弃全部定时器（已在执行的回调任务不受影响）"""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for slot in self._slots:
+            for handle in slot:
+                handle.cancelled = True
+            slot.clear()
+        self._count = 0
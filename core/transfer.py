@@ -0,0 +1,241 @@
+import csv
+import json
+import os
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .records import USER_FIELDS, PairRecord, UserRecord, pair_key
+
+
+# 战绩与对局历史的导入导出
+#
+# NDJSON 每行一条记录，type 区分种类：
+#   {"type": "user", "group_id": 群号或 null（全局）, "user_id", total, wins, losses, win_streak, max_win_streak, current_streak}
+#   {"type": "pvp", "group_id", "user1_id", "user2_id", "total", "user1_wins", "user2_wins"}
+#   {"type": "game", ...}  对局历史，字段同 history/ 中的每行（见 core.history）
+# CSV 的列为下面的 STATS_COLUMNS（用户与对战记录共用，不适用的列留空）；对局历史只能单独导出为 CSV，列为 HISTORY_COLUMNS。
+# 导入只接受 user / pvp 记录，覆盖同一范围内的原有记录；game 记录会被跳过。
+
+KINDS = ("users", "pvp", "history")
+STATS_COLUMNS = ("type", "group_id", "user_id", "user1_id", "user2_id", *USER_FIELDS, "user1_wins", "user2_wins")
+HISTORY_COLUMNS = ("ts", "st", "g", "m", "p", "l", "w", "o", "b", "r", "bt")
+PVP_FIELDS = ("total", "user1_wins", "user2_wins")
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> str:
+    """按参数或扩展名确定格式：ndjson / csv"""
+    fmt = (fmt or os.path.splitext(path)[1].lstrip(".") or "ndjson").lower()
+    if fmt in ("json", "jsonl"):
+        fmt = "ndjson"
+    if fmt not in ("ndjson", "csv"):
+        raise ValueError(f"不支持的格式: {fmt}")
+    return fmt
+
+
+def iter_rows(stats, history=None, kinds: Iterable[str] = ("users", "pvp"),
+              group_id: Optional[str] = None) -> Iterator[Dict]:
+    """
+    流式给出待导出的记录
+    :param stats: StatsManager 或 SqliteStatsManager
+    :param history: HistoryLog，导出对局历史时需要
+    :param kinds: users / pvp / history 的组合
+    :param group_id: 只导出该群
+    """
+    kinds = set(kinds)
+    if kinds & {"users", "pvp"}:
+        for kind, scope, key, value in stats.iter_records(group_id):
+            if kind == "user" and "users" in kinds:
+                yield {"type": "user", "group_id": scope, "user_id": key, **value.to_dict()}
+            elif kind == "pvp" and "pvp" in kinds:
+                yield {
+                    "type": "pvp", "group_id": scope, "user1_id": key[0], "user2_id": key[1],
+                    **dict(zip(PVP_FIELDS, value.astuple())),
+                }
+    if "history" in kinds and history is not None:
+        for event in history.iter_events(group_id=group_id):
+            yield {"type": "game", **event}
+
+
+def write_rows(rows: Iterable[Dict], f, fmt: str, columns: Tuple[str, ...] = STATS_COLUMNS) -> int:
+    """逐行写出，返回记录数"""
+    count = 0
+    if fmt == "ndjson":
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n")
+            count += 1
+        return count
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(_csv_value(row.get(column)) for column in columns)
+        count += 1
+    return count
+
+
+def _csv_value(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        # 对局历史中的参与者 / 胜者列表
+        return " ".join(value)
+    return str(value)
+
+
+def export_file(stats, path: str, fmt: Optional[str] = None, kinds: Iterable[str] = ("users", "pvp"),
+                history=None, group_id: Optional[str] = None) -> int:
+    """
+    导出到文件（先写临时文件再改名）
+    :return: 导出的记录数
+    """
+    fmt = detect_format(path, fmt)
+    kinds = set(kinds)
+    unknown = kinds - set(KINDS)
+    if unknown:
+        raise ValueError(f"未知的导出内容: {', '.join(sorted(unknown))}")
+    columns = STATS_COLUMNS
+    if fmt == "csv" and "history" in kinds:
+        if kinds != {"history"}:
+            raise ValueError("CSV 格式下对局历史只能单独导出")
+        columns = HISTORY_COLUMNS
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8", newline="") as f:
+        count = write_rows(iter_rows(stats, history, kinds, group_id), f, fmt, columns)
+    os.replace(tmp_file, path)
+    return count
+
+
+def _int(row: Dict, field: str) -> int:
+    value = row.get(field)
+    value = int(value) if value not in (None, "") else 0
+    if value < 0:
+        raise ValueError(f"{field} 不能为负数")
+    return value
+
+
+def parse_row(row: Dict) -> Optional[Tuple]:
+    """
+    把一行转换为 iter_records() 格式的记录，对局历史等无需导入的行返回 None
+    :raises ValueError: 行内容不完整或不合法
+    """
+    kind = row.get("type")
+    scope = row.get("group_id") or None
+    scope = str(scope) if scope is not None else None
+    if kind == "user":
+        user_id = row.get("user_id")
+        if not user_id:
+            raise ValueError("缺少 user_id")
+        return "user", scope, str(user_id), UserRecord(*(_int(row, field) for field in USER_FIELDS))
+    if kind == "pvp":
+        user1_id, user2_id = str(row.get("user1_id") or ""), str(row.get("user2_id") or "")
+        if not user1_id or not user2_id or user1_id == user2_id:
+            raise ValueError("user1_id / user2_id 不合法")
+        total, user1_wins, user2_wins = (_int(row, field) for field in PVP_FIELDS)
+        key = pair_key(user1_id, user2_id)
+        if key[0] != user1_id:
+            user1_wins, user2_wins = user2_wins, user1_wins
+        return "pvp", scope, key, PairRecord(total, user1_wins, user2_wins)
+    if kind == "game":
+        return None
+    raise ValueError(f"未知的记录类型: {kind}")
+
+
+def _ndjson_rows(f) -> Iterator:
+    for text in f:
+        if not text.strip():
+            continue
+        try:
+            yield json.loads(text)
+        except json.JSONDecodeError as e:
+            yield e
+
+
+def iter_file(f, fmt: str, skipped: List[int]) -> Iterator[Tuple]:
+    """
+    流式读取导入文件，无法解析或不合法的行跳过并计数
+    :param skipped: 单元素列表，累加跳过的行数
+    """
+    rows = _ndjson_rows(f) if fmt == "ndjson" else csv.DictReader(f)
+    for number, row in enumerate(rows, 1):
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise ValueError("不是一个对象")
+            record = parse_row(row)
+        except (TypeError, ValueError) as e:
+            if skipped[0] < 20:
+                print(f"[Roulette] 导入第 {number} 条记录不合法，已跳过: {e}")
+            skipped[0] += 1
+            continue
+        if record is None:
+            skipped[0] += 1
+            continue
+        yield record
+
+
+def import_file(stats, path: str, fmt: Optional[str] = None, batch_size: int = 10000) -> Tuple[int, int]:
+    """
+    从文件批量导入战绩，整个文件只在最后落盘一次
+    :return: (导入的记录数, 跳过的行数)
+    """
+    fmt = detect_format(path, fmt)
+    skipped = [0]
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        count = stats.import_records(iter_file(f, fmt, skipped), batch_size=batch_size)
+    return count, skipped[0]
+
+
+if __name__ == "__main__":
+    # 命令行工具：python -m core.transfer export|import ...
+    # 导入会直接改写数据目录中的战绩，请先停止 AstrBot（运行中请使用 /转盘数据 导入）
+    import argparse
+    import sys
+
+    from .history import HistoryLog
+    from .sqlite_stats import SqliteStatsManager
+    from .stats import StatsManager
+
+    parser = argparse.ArgumentParser(prog="python -m core.transfer", description="转盘战绩导入导出")
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json", help="战绩存储方式，与插件配置一致")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export_parser = sub.add_parser("export", help="导出战绩 / 对局历史")
+    export_parser.add_argument("data_dir")
+    export_parser.add_argument("-o", "--output", help="输出文件，默认写到标准输出")
+    export_parser.add_argument("--format", choices=("ndjson", "csv"), help="默认按输出文件扩展名，标准输出时为 ndjson")
+    export_parser.add_argument("--kinds", default="users,pvp", help="导出内容，users / pvp / history 逗号分隔")
+    export_parser.add_argument("--group", help="只导出该群")
+    export_parser.add_argument("--history-dir", help="对局历史目录，默认 <数据目录>/history")
+    import_parser = sub.add_parser("import", help="从 NDJSON / CSV 批量导入战绩")
+    import_parser.add_argument("data_dir")
+    import_parser.add_argument("input")
+    import_parser.add_argument("--format", choices=("ndjson", "csv"), help="默认按扩展名")
+    import_parser.add_argument("--batch", type=int, default=10000, help="每批写入的记录数")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        parser.error(f"数据目录不存在: {args.data_dir}")
+    if args.backend == "sqlite":
+        manager = SqliteStatsManager(args.data_dir, flush_interval=None)
+    else:
+        manager = StatsManager(args.data_dir, flush_interval=None)
+    try:
+        if args.command == "import":
+            imported, skipped = import_file(manager, args.input, args.format, args.batch)
+            print(f"[Roulette] 已导入 {imported} 条记录，跳过 {skipped} 行", file=sys.stderr)
+        else:
+            kinds = [kind.strip() for kind in args.kinds.split(",") if kind.strip()]
+            history = None
+            if "history" in kinds:
+                history = HistoryLog(args.history_dir or os.path.join(args.data_dir, "history"), flush_interval=None)
+            try:
+                if args.output:
+                    count = export_file(manager, args.output, args.format, kinds, history, args.group)
+                else:
+                    fmt = args.format or "ndjson"
+                    columns = HISTORY_COLUMNS if fmt == "csv" and kinds == ["history"] else STATS_COLUMNS
+                    count = write_rows(iter_rows(manager, history, kinds, args.group), sys.stdout, fmt, columns)
+                print(f"[Roulette] 已导出 {count} 条记录", file=sys.stderr)
+            finally:
+                if history:
+                    history.close()
+    finally:
+        manager.close()
@@ -1,44 +1,207 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional, Tuple
+
 from astrbot.core.message.components import At
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 from astrbot.core.platform.sources.aiocqhttp.aiocqhttp_message_event import (
     AiocqhttpMessageEvent,
 )
 
+from .metrics import metrics
+
+class NameCache:
+    """
+    昵称缓存
+    以 (group_id, user_id) 为键的 LRU 缓存，条目在 ttl 秒后过期；
+    None 表示“不在群内”的否定结果，同样会被缓存。
+    查询失败时退回的昵称（陌生人昵称或 user_id）只缓存 fallback_ttl 秒，平台恢复后尽快改正。
+    同一个键的并发查询共享同一次平台请求。
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 600, fallback_ttl: float = 30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.fallback_ttl = fallback_ttl
+        self._data: OrderedDict[tuple, tuple[float, Optional[str]]] = OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        self._rosters: dict[str, float] = {}  # group_id -> 群成员列表过期时间
+
+    def get(self, key: tuple) -> tuple[bool, Optional[str]]:
+        """返回 (是否命中, 昵称)"""
+        item = self._data.get(key)
+        if item is not None:
+            expire_at, name = item
+            if expire_at > time.monotonic():
+                self._data.move_to_end(key)
+                return True, name
+            del self._data[key]
+        # 群成员列表仍然有效时，列表里没有的人就是非群成员
+        group_id = key[0]
+        if group_id and self._rosters.get(group_id, 0) > time.monotonic():
+            return True, None
+        return False, None
+
+    def set(self, key: tuple, name: Optional[str], ttl: Optional[float] = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), name)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set_roster(self, group_id: str, members: dict[str, str]):
+        """写入整群成员昵称，并在 ttl 内对不在列表中的用户给出否定结果"""
+        for user_id, name in members.items():
+            self.set((group_id, user_id), name)
+        self._rosters[group_id] = time.monotonic() + self.ttl
+
+    def has_roster(self, group_id: str) -> bool:
+        return self._rosters.get(group_id, 0) > time.monotonic()
+
+    async def get_or_load(
+        self, key: tuple, loader: Callable[[], Awaitable[Tuple[Optional[str], bool]]]
+    ) -> Optional[str]:
+        """
+        命中缓存直接返回，否则发起（或等待已在进行的）查询
+        :param loader: 返回 (昵称, 是否为平台确认的结果)，未确认的退回值按 fallback_ttl 缓存
+        """
+        hit, name = self.get(key)
+        if hit:
+            metrics.inc("roulette_name_cache_total", result="hit")
+            return name
+        future = self._inflight.get(key)
+        if future is not None:
+            metrics.inc("roulette_name_cache_total", result="coalesced")
+            return await asyncio.shield(future)
+        metrics.inc("roulette_name_cache_total", result="miss")
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            name, confirmed = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免无人等待时出现 “exception was never retrieved” 警告
+            future.exception()
+            raise
+        else:
+            if confirmed:
+                self.set(key, name)
+            elif self.fallback_ttl > 0:
+                metrics.inc("roulette_name_fallback_total")
+                self.set(key, name, self.fallback_ttl)
+            future.set_result(name)
+            return name
+        finally:
+            self._inflight.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+        self._rosters.clear()
+
+
+# 进程内共享的昵称缓存
+name_cache = NameCache()
+
+
 async def get_name(event: AstrMessageEvent, user_id: str|int, group_id: str|int = None) -> str:
     """
-    获取指定群友的昵称
+    获取指定群友的昵称（带缓存）
     :param event: 消息事件
     :param user_id: 用户ID
     :param group_id: 指定群组ID，如果不传则从 event 获取
     :return: 昵称，如果用户不在群内且无法获取陌生人信息则返回 None
     """
-    if event.get_platform_name() == "aiocqhttp" and str(user_id).isdigit():
+    if event.get_platform_name() == "aiocqhttp":
         assert isinstance(event, AiocqhttpMessageEvent)
-        gid = group_id or event.get_group_id()
-        try:
-            if gid:
-                member_info = await event.bot.get_group_member_info(
-                    group_id=int(gid), user_id=int(user_id)
-                )
-                nickname = member_info.get("card") or member_info.get("nickname")
-                return (nickname or str(user_id)).strip() or str(user_id)
-            else:
-                stranger_info = await event.bot.get_stranger_info(user_id=int(user_id))
-                return (stranger_info.get("nickname") or str(user_id)).strip()
-        except Exception as e:
-            # 如果是群成员不存在 (retcode 1200)，在要求严格检查群成员时返回 None
-            if "1200" in str(e) or "不存在" in str(e):
-                return None
-            
-            # 其他异常尝试获取陌生人信息
-            try:
-                stranger_info = await event.bot.get_stranger_info(user_id=int(user_id))
-                return (stranger_info.get("nickname") or str(user_id)).strip()
-            except Exception:
-                return str(user_id)
+        return await get_member_name(event.bot, user_id, group_id or event.get_group_id())
     else:
         return str(user_id)
 
+
+def event_bot(event: AstrMessageEvent):
+    """
+    取出事件所属平台的协议端客户端，供定时任务在事件结束后继续调用平台接口
+    客户端由整个平台共享，持有它不会让单条消息事件常驻内存；非 aiocqhttp 平台返回 None
+    """
+    if event.get_platform_name() == "aiocqhttp":
+        assert isinstance(event, AiocqhttpMessageEvent)
+        return event.bot
+    return None
+
+
+async def get_member_name(bot, user_id: str|int, group_id: str|int = None) -> Optional[str]:
+    """
+    不依赖消息事件的昵称查询（带缓存）
+    :param bot: aiocqhttp 客户端，为 None 时直接返回 user_id
+    :param user_id: 用户ID
+    :param group_id: 群组ID
+    """
+    if bot is None or not str(user_id).isdigit():
+        return str(user_id)
+    gid = str(group_id or "")
+    return await name_cache.get_or_load(
+        (gid, str(user_id)), lambda: _fetch_name(bot, user_id, gid)
+    )
+
+
+async def _fetch_name(bot, user_id: str|int, gid: str) -> Tuple[Optional[str], bool]:
+    """向平台查询昵称，返回 (昵称, 是否为平台确认的结果)"""
+    with metrics.track_rpc("get_name"):
+        return await _query_name(bot, user_id, gid)
+
+
+async def _query_name(bot, user_id: str|int, gid: str) -> Tuple[Optional[str], bool]:
+    try:
+        if gid:
+            member_info = await bot.get_group_member_info(
+                group_id=int(gid), user_id=int(user_id)
+            )
+            nickname = member_info.get("card") or member_info.get("nickname")
+            return (nickname or str(user_id)).strip() or str(user_id), True
+        else:
+            stranger_info = await bot.get_stranger_info(user_id=int(user_id))
+            return (stranger_info.get("nickname") or str(user_id)).strip(), True
+    except Exception as e:
+        # 如果是群成员不存在 (retcode 1200)，在要求严格检查群成员时返回 None
+        if "1200" in str(e) or "不存在" in str(e):
+            return None, True
+        
+        # 其他异常（超时、断线等）尝试获取陌生人信息，两者都只是临时的退回值
+        try:
+            stranger_info = await bot.get_stranger_info(user_id=int(user_id))
+            return (stranger_info.get("nickname") or str(user_id)).strip(), False
+        except Exception:
+            return str(user_id), False
+
+
+async def preload_group_roster(event: AstrMessageEvent, group_id: str|int = None) -> bool:
+    """
+    通过 get_group_member_list 一次性预热整群昵称
+    :param event: 消息事件
+    :param group_id: 指定群组ID，如果不传则从 event 获取
+    :return: 是否成功预热（缓存仍有效时直接返回 True）
+    """
+    gid = str(group_id or event.get_group_id() or "")
+    if not gid or event.get_platform_name() != "aiocqhttp":
+        return False
+    if name_cache.has_roster(gid):
+        return True
+    assert isinstance(event, AiocqhttpMessageEvent)
+    try:
+        with metrics.track_rpc("get_group_member_list"):
+            members = await event.bot.get_group_member_list(group_id=int(gid))
+    except Exception as e:
+        from astrbot import logger
+        logger.warning(f"获取群 {gid} 成员列表失败: {e}")
+        return False
+    name_cache.set_roster(gid, {
+        str(m["user_id"]): (m.get("card") or m.get("nickname") or str(m["user_id"])).strip()
+        or str(m["user_id"])
+        for m in members
+    })
+    return True
+
 def get_at_id(event: AstrMessageEvent) -> str:
     """获取@的 QQ 号"""
     return next(
@@ -51,25 +214,19 @@ def get_at_id(event: AstrMessageEvent) -> str:
     )
 
 
-async def ban(event: AstrMessageEvent, duration: int, user_id: str|int = None):
+async def ban_member(bot, group_id: str|int, user_id: str|int, duration: int):
     """
-    禁言用户
-    :param event: 消息事件
+    不依赖消息事件的禁言，失败时抛出异常（由调用方或动作队列决定是否重试）
+    :param bot: aiocqhttp 客户端，为 None 时不做任何事
+    :param group_id: 群组ID
+    :param user_id: 要禁言的用户ID
     :param duration: 禁言时长（秒）
-    :param user_id: 要禁言的用户ID，如果不传则禁言消息发送者
     """
-    if event.get_platform_name() == "aiocqhttp":
-        assert isinstance(event, AiocqhttpMessageEvent)
-        try:
-            # 如果未指定 user_id，默认禁言消息发送者
-            target_user_id = user_id if user_id is not None else event.get_sender_id()
-            
-            await event.bot.set_group_ban(
-                group_id=int(event.get_group_id()),
-                user_id=int(target_user_id),
-                duration=duration,
-            )
-        except Exception as e:
-            # 禁言失败时记录错误但不中断流程
-            from astrbot import logger
-            logger.error(f"禁言用户 {target_user_id} 失败: {e}")
+    if bot is None:
+        return
+    with metrics.track_rpc("ban"):
+        await bot.set_group_ban(
+            group_id=int(group_id),
+            user_id=int(user_id),
+            duration=duration,
+        )
@@ -0,0 +1,129 @@
+import heapq
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+# 时间窗口 -> 覆盖的天数（含今天，按自然日滚动）
+WINDOWS: Dict[str, int] = {"day": 1, "week": 7, "month": 30}
+RING_DAYS = max(WINDOWS.values())
+
+
+def today() -> int:
+    """当前日期的序号（本地时间，date.toordinal）"""
+    return date.today().toordinal()
+
+
+def window_days(window: str) -> int:
+    days = WINDOWS.get(window)
+    if days is None:
+        raise ValueError(f"未知的时间窗口: {window}")
+    return days
+
+
+class WindowedCounters:
+    """
+    按天汇总的近期战绩
+    环形数组的每一格是一天的 {范围: {user_id: (局数, 胜场)}}，格子按 日期 % 天数 复用，
+    写入新的一天时整格替换，过期数据 O(1) 滚出；查询窗口只合并窗口内的几格。
+    计数元组整体替换、不原地修改，dump() 只需浅复制各格的字典。
+    """
+
+    def __init__(self, days: int = RING_DAYS):
+        self.days = days
+        self._ring: List[Tuple[int, Dict[Optional[str], Dict[str, Tuple[int, int]]]]] = [(0, {})] * days
+        self._newest = 0
+
+    def _bucket(self, day: int) -> Optional[Dict[Optional[str], Dict[str, Tuple[int, int]]]]:
+        """取得某天的格子，已滚出窗口的日期返回 None"""
+        if day <= self._newest - self.days:
+            return None
+        slot = day % self.days
+        slot_day, buckets = self._ring[slot]
+        if slot_day != day:
+            buckets = {}
+            self._ring[slot] = (day, buckets)
+        self._newest = max(self._newest, day)
+        return buckets
+
+    def add(self, day: int, scope: Optional[str], loser_id: str, winner_ids: Iterable[str]):
+        """
+        记录一局结果
+        :param day: 对局日期序号
+        :param scope: 范围，None 表示全局
+        """
+        buckets = self._bucket(day)
+        if buckets is None:
+            return
+        users = buckets.setdefault(scope, {})
+        total, wins = users.get(loser_id, (0, 0))
+        users[loser_id] = (total + 1, wins)
+        for winner_id in winner_ids:
+            total, wins = users.get(winner_id, (0, 0))
+            users[winner_id] = (total + 1, wins + 1)
+
+    def merge(self, scope: Optional[str], days: int, now: Optional[int] = None) -> Dict[str, List[int]]:
+        """合并最近 days 天（含 now 当天）的计数：user_id -> [局数, 胜场]"""
+        now = today() if now is None else now
+        merged: Dict[str, List[int]] = {}
+        for day, buckets in self._ring:
+            if not now - days < day <= now:
+                continue
+            for user_id, (total, wins) in buckets.get(scope, {}).items():
+                counts = merged.get(user_id)
+                if counts is None:
+                    merged[user_id] = [total, wins]
+                else:
+                    counts[0] += total
+                    counts[1] += wins
+        return merged
+
+    def user_counts(self, scope: Optional[str], days: int, user_id: str, now: Optional[int] = None) -> Tuple[int, int]:
+        """单个用户最近 days 天（含 now 当天）的 (局数, 胜场)"""
+        now = today() if now is None else now
+        total = wins = 0
+        for day, buckets in self._ring:
+            if now - days < day <= now:
+                counts = buckets.get(scope, {}).get(user_id)
+                if counts:
+                    total += counts[0]
+                    wins += counts[1]
+        return total, wins
+
+    def board(self, scope: Optional[str], days: int, limit: int, key, min_games: int = 0,
+              lowest: bool = False) -> List[Tuple[str, int, int]]:
+        """
+        窗口内排行
+        :param key: 排序函数 key(total, wins)，返回元组，取最大的 limit 个；相同时 user_id 大者在前
+        :param lowest: 改为取最小的 limit 个，相同时 user_id 小者在前
+        :return: [(user_id, 局数, 胜场), ...]
+        """
+        rows = (
+            (user_id, total, wins)
+            for user_id, (total, wins) in self.merge(scope, days).items()
+            if total >= min_games
+        )
+        pick = heapq.nsmallest if lowest else heapq.nlargest
+        return pick(limit, rows, key=lambda row: (*key(row[1], row[2]), row[0]))
+
+    def dump(self) -> List:
+        """序列化为 JSON 可写的结构，全局范围记为空字符串"""
+        return [
+            [day, {scope or "": users.copy() for scope, users in buckets.items()}]
+            for day, buckets in self._ring
+            if buckets
+        ]
+
+    def load(self, data: List):
+        for day, buckets in sorted(data, key=lambda item: item[0]):
+            target = self._bucket(day)
+            if target is None:
+                continue
+            for scope, users in buckets.items():
+                target[scope or None] = {user_id: (total, wins) for user_id, (total, wins) in users.items()}
+
+    def __iter__(self) -> Iterator[Tuple[int, Optional[str], str, int, int]]:
+        """遍历全部计数 (日期, 范围, user_id, 局数, 胜场)"""
+        for day, buckets in self._ring:
+            for scope, users in buckets.items():
+                for user_id, (total, wins) in users.items():
+                    yield day, scope, user_id, total, wins
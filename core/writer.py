@@ -0,0 +1,51 @@
+import threading
+from typing import Callable
+
+
+class BackgroundWriter:
+    """
+    后台落盘线程
+    调用方只需 mark_dirty()，线程按 interval 秒或累计 max_pending 次改动合并执行一次 flush，
+    把文件 I/O 挪出事件循环；close() 会做最后一次 flush。
+    """
+
+    def __init__(self, flush: Callable[[], None], interval: float = 2.0, max_pending: int = 100, name: str = "roulette-writer"):
+        self._flush = flush
+        self.interval = max(0.01, interval)
+        self.max_pending = max(1, max_pending)
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def mark_dirty(self, count: int = 1):
+        """登记待写入的改动"""
+        with self._cond:
+            self._pending += count
+            if self._pending >= self.max_pending:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or self._pending >= self.max_pending,
+                    timeout=self.interval,
+                )
+                pending, self._pending = self._pending, 0
+                closed = self._closed
+            if pending:
+                try:
+                    self._flush()
+                except Exception as e:
+                    print(f"[Roulette] 后台写入失败: {e}")
+            if closed:
+                return
+
+    def close(self):
+        """停止线程，返回前完成最后一次写入"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
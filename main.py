@@ -1,5 +1,7 @@
+import os
 import random
 import asyncio
+import time
 
 from astrbot import logger
 from astrbot.api.event import filter, MessageChain
@@ -8,21 +10,92 @@ from astrbot.api.message_components import Plain as Comp_Plain, At as Comp_At
 from astrbot.core.config.astrbot_config import AstrBotConfig
 from astrbot.core.platform.astr_message_event import AstrMessageEvent
 
-from .core.utils import ban, get_at_id, get_name
-from .core.model import GameManager
+from .core.utils import ban_member, event_bot, get_at_id, get_member_name, get_name, name_cache, preload_group_roster
+from .core.actions import ActionQueue
+from .core.board_cache import BoardCache
+from .core.elo import RATED_MIN_GAMES, history_dirs, iter_duels
+from .core.ranking import SORT_KEYS
+from .core.room_store import RoomStore
+from .core.model import ALREADY_JOINED, BANG, LAST_ROUND, NO_ROOM, NOT_YOUR_TURN, GameManager
 from .core.stats import StatsManager
+from .core.sqlite_stats import SqliteStatsManager
+from .core.history import HistoryLog
+from .core.timer_wheel import TimerHandle, TimingWheel
+from .core.transfer import export_file, import_file
+from .core.metrics import current_command, metrics
+
+
+# 排行榜时间窗口参数，如 /赌圣榜 周
+BOARD_WINDOWS = {"日": "day", "今日": "day", "周": "week", "本周": "week", "月": "month", "本月": "month"}
+BOARD_WINDOW_TITLES = {"day": "今日", "week": "近7天", "month": "近30天"}
+BOARD_SIZE = 5
+BOARD_CANDIDATES = 10  # 排行榜多取几名候选，已退群的用户被略过时依次递补
 
 
 class RoulettePlugin(Star):
     def __init__(self, context: Context, config: AstrBotConfig):
         super().__init__(context)
-        self.gm = GameManager()
         data_dir = StarTools.get_data_dir("astrbot_plugin_roulette")
-        self.stats = StatsManager(data_dir)
+        # 多个进程共用数据目录时，战绩放在共享的 SQLite 库中，房间存档、对局历史等按实例分开
+        instance_id = str(config.get("instance_id", "")).strip()
+        instance_dir = os.path.join(data_dir, "instances", instance_id) if instance_id else data_dir
+        os.makedirs(instance_dir, exist_ok=True)
+        flush_interval = config.get("stats_flush_interval", 2)
+        flush_batch = config.get("stats_flush_batch", 100)
+        rating_k = config.get("elo_k", 32)
+        self.data_dir = data_dir
+        # 全部超时共用一个时间轮，定时器只携带群号、房间号、玩家号等少量参数；
+        # 定时器登记在各自的房间上，房间结束时由 GameManager 统一取消
+        self.timers = TimingWheel(tick=1.0)
+        # 进行中的房间随每次状态变化写入 rooms.journal，重启或重载插件后恢复
+        self.room_store = RoomStore(instance_dir, flush_interval=flush_interval, flush_batch=flush_batch)
+        self.gm = GameManager(timers=self.timers, store=self.room_store)
+        self._reaper: TimerHandle | None = None
+        # 禁言与定时提示经动作队列异步发出：按群/全局限速、限制并发、失败重试，用尽重试的写入死信文件
+        self.actions = ActionQueue(
+            rate=config.get("action_rate_limit", 10),
+            group_rate=config.get("action_group_rate_limit", 1),
+            concurrency=config.get("action_concurrency", 4),
+            max_attempts=config.get("action_max_attempts", 4),
+            dead_letter_file=os.path.join(instance_dir, "dead_letters.ndjson"),
+        )
+        if instance_id:
+            if config.get("stats_backend", "json") != "sqlite":
+                logger.info("已设置 instance_id，战绩改用 SQLite 多进程共享模式")
+            self.stats = SqliteStatsManager(data_dir, shared=True, rating_k=rating_k)
+        elif config.get("stats_backend", "json") == "sqlite":
+            self.stats = SqliteStatsManager(
+                data_dir, flush_interval=flush_interval, flush_batch=flush_batch, rating_k=rating_k
+            )
+        else:
+            self.stats = StatsManager(
+                data_dir,
+                compact_every=config.get("stats_compact_interval", 1000),
+                flush_interval=flush_interval,
+                flush_batch=flush_batch,
+                group_memory_budget=config.get("group_memory_budget", 200000),
+                rating_k=rating_k,
+            )
+        # 对局历史：每局结束后的完整信息，分段追加写入
+        self.history = HistoryLog(
+            os.path.join(instance_dir, "history"),
+            segment_bytes=config.get("history_segment_mb", 4) * 1024 * 1024,
+            flush_interval=flush_interval,
+            flush_batch=flush_batch,
+        )
         self.ban_duration: list[int] = [
             int(x) for x in config.get("ban_duration_str", "30-300").split("-")
         ]
         self.game_timeout: int = config.get("game_timeout", 3600)  # 游戏超时时长（秒）
+        name_cache.ttl = config.get("name_cache_ttl", 600)
+        self.board_sort: str = config.get("board_sort", "rate")
+        if self.board_sort not in SORT_KEYS:
+            logger.warning(f"未知的排行榜排序方式 {self.board_sort}，已改用 rate")
+            self.board_sort = "rate"
+        # 排行榜回复缓存：有人的战绩可能改变某个榜时才作废，ttl 兜底昵称变化
+        self.board_cache = BoardCache(ttl=config.get("board_cache_ttl", 300), sort_by=self.board_sort)
+        self._stats_version = self.stats.data_version()
+        self.preload_roster: bool = config.get("preload_group_roster", False)
         self.MAX_BAN_DURATION: int = 86400  # 24小时
         self.PERSUASION_QUOTES: list = [
             "赌博一时爽，一直赌博一直爽，但最后爽的只有赌场老板！",
@@ -44,43 +117,127 @@ class RoulettePlugin(Star):
             "听我一言，捷径虽诱人，赌路却凶险，慎行",
             "放手一搏,不如稳健前行",
         ]
-        # 用于存储超时任务，键为 group_id，值为 asyncio.Task 对象
-        self.timeout_tasks: dict[str, asyncio.Task] = {}
-        # 用于存储游戏超时任务
-        self.game_timeout_tasks: dict[str, asyncio.Task] = {}
+        # 定时器丢失的房间回收间隔（秒）
+        self.reap_interval: int = config.get("room_reap_interval", 300)
+
+        # 运行指标：导出时才读取的仪表，计数器与耗时由各模块自行登记
+        metrics.gauge("roulette_rooms", "进行中的房间数", self.gm.room_count)
+        metrics.gauge("roulette_room_timers", "各房间待触发的定时器数", self.gm.timer_count)
+        metrics.gauge("roulette_timers", "时间轮中待触发的定时器数", lambda: len(self.timers))
+        metrics.gauge("roulette_action_queue", "排队及执行中的平台动作数", lambda: len(self.actions))
+        metrics.gauge("roulette_name_cache_entries", "昵称缓存条目数", lambda: len(name_cache._data))
+        metrics.gauge("roulette_board_cache_entries", "排行榜回复缓存条目数", lambda: len(self.board_cache))
+        self.metrics_file = os.path.join(instance_dir, "metrics.prom")
+        # /转盘数据 导出、导入的文件目录
+        self.transfer_dir = os.path.join(instance_dir, "transfer")
+        metrics_interval = config.get("metrics_dump_interval", 0)
+        if metrics_interval > 0:
+            metrics.start_dump(self.metrics_file, metrics_interval)
+
+        self._restore_rooms()
+
+    async def initialize(self):
+        """插件初始化完成后启动时间轮（恢复的定时器可能登记于事件循环之外）"""
+        self.timers.start()
     
-    def _set_game_timeout(self, event: AstrMessageEvent, group_id: str, room):
-        """设置游戏超时任务"""
-        if self.game_timeout <= 0:
+    async def terminate(self):
+        """插件卸载时落盘战绩数据；进行中的房间保留在存档中，下次加载时恢复"""
+        metrics.stop_dump()
+        await self.actions.close()
+        self.timers.close()
+        self.room_store.close()
+        self.stats.close()
+        self.history.close()
+
+    def _restore_rooms(self):
+        """恢复上次未结束的房间，定时器沿用原来的到期时间（已过期的立即触发）"""
+        restored = self.gm.restore(self.room_store.load())
+        for group_id, room, deadlines in restored:
+            if "game" in deadlines:
+                self.gm.arm_at(group_id, room, "game", deadlines["game"], self._on_game_timeout, group_id, room.room_id)
+            else:
+                self._set_game_timeout(group_id, room)
+            if "last_round" in deadlines and room.players:
+                self.gm.arm_at(
+                    group_id, room, "last_round", deadlines["last_round"], self._task_auto_surrender,
+                    room.origin, None, room.players[room.next_idx], group_id, room.room_id,
+                )
+        if restored:
+            self._ensure_reaper()
+            logger.info(f"恢复了 {len(restored)} 个未结束的转盘房间")
+
+    def _submit_ban(self, bot, group_id: str, user_id: str, duration: int):
+        """把禁言交给动作队列，不等待平台响应"""
+        if bot is None:
             return
+        self.actions.submit(
+            "ban", group_id, lambda: ban_member(bot, group_id, user_id, duration), f"禁言 {user_id} {duration} 秒"
+        )
+
+    def _platform_bot(self, umo: str):
+        """按会话标识找回 aiocqhttp 客户端（恢复的房间没有原消息事件），找不到时返回 None"""
+        platform_id = umo.split(":", 1)[0]
+        try:
+            for platform in self.context.platform_manager.platform_insts:
+                meta = platform.meta()
+                if meta.id == platform_id and meta.name == "aiocqhttp":
+                    return platform.get_client()
+        except Exception as e:
+            logger.warning(f"获取平台 {platform_id} 的客户端失败: {e}")
+        return None
+
+    async def _record_game(self, group_id: str, room, loser_id: str, outcome: str):
+        """
+        记录一局有人受罚的结果：更新战绩并写入对局历史
+        战绩写入放到线程中：SQLite 共享模式每局提交一次，可能要等其他进程释放写锁（最长 busy_timeout 秒）
+        """
+        all_participants = room.get_all_participants()
+        winner_ids = [p for p in all_participants if p != loser_id]
+        is_pvp = len(room.players) == 2
         
-        # 取消已有的超时任务
-        if group_id in self.game_timeout_tasks:
-            self.game_timeout_tasks[group_id].cancel()
+        # 多人模式只记录败者，不记录胜者
+        if not is_pvp:
+            winner_ids = []
         
-        async def game_timeout_coro():
-            try:
-                await asyncio.sleep(self.game_timeout)
-                logger.info(f"群 {group_id} 的游戏超时，自动结束")
-                
-                # 清理房间
-                if room.players:
-                    self.gm.del_room(group_id=group_id, players=room.players)
-                else:
-                    self.gm.del_room(group_id=group_id)
-                
-                # 发送超时提示
-                # timeout_msg = f"⏱️ 转盘游戏超时（{self.game_timeout}秒无人开枪），已自动结束，无人受罚。"
-                # await event.send(MessageChain([Comp_Plain(timeout_msg)]))
-                
-                if group_id in self.game_timeout_tasks:
-                    del self.game_timeout_tasks[group_id]
-            except asyncio.CancelledError:
-                logger.info(f"群 {group_id} 的游戏超时任务被取消")
-        
-        self.game_timeout_tasks[group_id] = asyncio.create_task(game_timeout_coro())
+        await asyncio.to_thread(self.stats.record_game_result, loser_id, winner_ids, is_pvp, group_id)
+        self.board_cache.on_result(group_id, [loser_id, *winner_ids], self.stats.get_user_stats)
+        self.history.record(group_id, room, outcome, loser_id, winner_ids)
+
+    def _set_game_timeout(self, group_id: str, room):
+        """设置（或重置）房间的游戏超时定时器"""
+        if self.game_timeout <= 0:
+            return
+        self.gm.arm(group_id, room, "game", self.game_timeout, self._on_game_timeout, group_id, room.room_id)
+        self._ensure_reaper()
+
+    def _on_game_timeout(self, group_id: str, room_id: int):
+        """游戏超时：无人受罚，直接结束"""
+        room = self.gm.find_room(group_id, room_id)
+        # 房间已被其他指令结束时不再处理
+        if room and self.gm.teardown(group_id, room):
+            logger.info(f"群 {group_id} 的游戏超时，自动结束")
+            self.history.record(group_id, room, "expired")
+
+    def _ensure_reaper(self):
+        """有房间时保持周期回收定时器"""
+        if self.reap_interval > 0 and (self._reaper is None or self._reaper.cancelled):
+            self._reaper = self.timers.schedule(self.reap_interval, self._reap_rooms)
+
+    def _reap_rooms(self):
+        """回收定时器丢失、闲置超过游戏超时的房间，按游戏超时结束处理"""
+        self._reaper = None
+        if self.game_timeout > 0:
+            reaped = self.gm.reap(self.game_timeout)
+            for group_id, room in reaped:
+                self.history.record(group_id, room, "expired")
+            if reaped:
+                metrics.inc("roulette_rooms_reaped_total", len(reaped))
+                logger.warning(f"回收了 {len(reaped)} 个定时器丢失的转盘房间")
+        if self.gm.room_count():
+            self._ensure_reaper()
     
     @filter.command("转盘", alias={"轮盘", "开启转盘"})
+    @metrics.track_command("转盘")
     async def start_wheel(self, event: AstrMessageEvent):
         """转盘@某人 [秒数] 不@表示进入多人模式"""
         args = event.message_str.split()
@@ -115,7 +272,7 @@ class RoulettePlugin(Star):
             return
 
         kids = [sender_id, target_id, group_id]
-        room = self.gm.create_room(kids=kids, ban_time=duration)
+        room = self.gm.create_room(kids=kids, ban_time=duration, origin=event.unified_msg_origin)
         if not room:
             reply = ""
             if self.gm.has_room(sender_id, group_id): reply = "你在游戏中..."
@@ -126,6 +283,9 @@ class RoulettePlugin(Star):
             yield event.plain_result(reply)
             return
 
+        # 设置游戏超时（在任何 await 之前登记，处理中途出错房间也会按时结束）
+        self._set_game_timeout(group_id, room)
+
         if room.players:
             user_name = await get_name(event, sender_id)
             target_name = await get_name(event, target_id) if target_id else ""
@@ -146,71 +306,59 @@ class RoulettePlugin(Star):
             else:
                 yield event.plain_result("本群转盘开始，请开枪！")
         
-        # 设置游戏超时
-        self._set_game_timeout(event, group_id, room)
-        
         logger.info(
             f"转盘游戏创建成功：子弹在第{room.bullet}轮，禁言时长为{room.ban_time}秒"
         )
         return
 
     @filter.command("开枪")
+    @metrics.track_command("开枪")
     async def shoot_wheel(self, event: AstrMessageEvent):
         sender_id = event.get_sender_id()
         group_id = event.get_group_id()
         
-        # 查找房间（优先双人，其次多人）
-        room = self.gm.get_room(kids=[sender_id, "", group_id])
+        # 查找房间（优先双人，其次多人）并开枪，检查回合与推进轮次一次完成
+        result = self.gm.try_shoot(group_id, sender_id)
 
-        if not room:
+        if result.outcome == NO_ROOM:
             yield event.plain_result("请先开启转盘")
             return
         
-        if not room.can_shoot(sender_id):
-            # 多人模式下已参与过
-            if not room.players and sender_id in room.participated:
-                yield event.plain_result("你已经参与过本局游戏了！")
-            else:
-                yield event.plain_result("本轮不是你的回合")
+        if result.outcome == ALREADY_JOINED:
+            yield event.plain_result("你已经参与过本局游戏了！")
+            return
+        if result.outcome == NOT_YOUR_TURN:
+            yield event.plain_result("本轮不是你的回合")
             return
 
-        # 取消最后一发超时任务
-        if group_id in self.timeout_tasks:
-            self.timeout_tasks[group_id].cancel()
-            del self.timeout_tasks[group_id]
-        
-        # 取消游戏超时任务
-        if group_id in self.game_timeout_tasks:
-            self.game_timeout_tasks[group_id].cancel()
-            del self.game_timeout_tasks[group_id]
+        room = result.room
+        if result.outcome != BANG:
+            # 没中枪，游戏继续：重置游戏超时（中枪时房间连同定时器已一并注销）
+            self._set_game_timeout(group_id, room)
+            if result.next_player and 6 - result.round == 1:
+                # 双人模式最后一发：超时自动判负
+                self.gm.arm(
+                    group_id, room, "last_round", 180, self._task_auto_surrender,
+                    event.unified_msg_origin, event_bot(event), result.next_player, group_id, room.room_id,
+                )
 
         user_name = await get_name(event, sender_id)
 
-        if room.shoot(sender_id):
-            # 记录战绩
-            all_participants = room.get_all_participants()
-            winner_ids = [p for p in all_participants if p != sender_id]
-            is_pvp = len(room.players) == 2
-            
-            # 多人模式只记录败者，不记录胜者
-            if not is_pvp:
-                winner_ids = []
-                
-            self.stats.record_game_result(sender_id, winner_ids, is_pvp, group_id)
+        if result.outcome == BANG:
+            # 房间已在开枪时注销；记录战绩和对局历史
+            await self._record_game(group_id, room, sender_id, "shot")
             
-            await ban(event, room.ban_time)
+            self._submit_ban(event_bot(event), group_id, sender_id, room.ban_time)
             reply = f"Bang！{user_name}被禁言{room.ban_time}秒！{random.choice(self.PERSUASION_QUOTES)}"
             yield event.plain_result(reply)
-            # 使用包含所有参与者的列表来清理房间
-            self.gm.del_room(group_id=group_id, players=room.players)
         else:
-            # 没中枪
-            reply = f"【{user_name}】开了一枪没响，还剩【{6 - room.round}】发"
-            next_player_id = room.players[room.next_idx] if room.next_idx is not None else None
+            # 没中枪（轮次取开枪那一刻的值，await 期间房间可能已被推进）
+            reply = f"【{user_name}】开了一枪没响，还剩【{6 - result.round}】发"
+            next_player_id = result.next_player
             
             if next_player_id:
                 # 双人模式，@下一个玩家
-                is_last_round = (6 - room.round) == 1
+                is_last_round = (6 - result.round) == 1
                 if is_last_round:
                     # 最后一发，@玩家并给出警告
                     chain = []
@@ -225,131 +373,97 @@ class RoulettePlugin(Star):
                     chain.append(Comp_At(qq=next_player_id))
                     chain.append(Comp_Plain(" 该你了！"))
                     yield event.chain_result(chain)
-                
-                if is_last_round:
-                    task = asyncio.create_task(self._task_auto_surrender(event, next_player_id, group_id, room))
-                    self.timeout_tasks[group_id] = task
             else:
                 # 多人模式，没有指定下一个玩家
                 yield event.plain_result(reply)
-            
-            # 重新设置游戏超时（没中枪，游戏继续）
-            self._set_game_timeout(event, group_id, room)
     
-    async def _task_auto_surrender(self, event: AstrMessageEvent, next_player_id: str, group_id: str, room):
-        """最后一发超时自动认输任务，参考 filechecker 的延时复核实现"""
+    async def _task_auto_surrender(self, umo: str, bot, next_player_id: str, group_id: str, room_id: int):
+        """
+        最后一发超时自动认输，由时间轮在 180 秒后调用
+        :param umo: 会话标识，用于在原消息事件结束后发送提示
+        :param bot: 平台客户端（见 event_bot），用于禁言和查询昵称；恢复的房间为 None，触发时按 umo 查找
+        """
+        # 回调运行在独立任务中，其中的平台请求单独归属
+        current_command.set("超时认输")
         try:
-            player_name = await get_name(event, next_player_id)
-            await asyncio.sleep(180)
+            # 抢占房间，玩家已在最后时刻认输或退出时不再处罚
+            room = self.gm.find_room(group_id, room_id)
+            if not room or not self.gm.teardown(group_id, room):
+                return
+            if bot is None:
+                bot = self._platform_bot(umo)
+            player_name = await get_member_name(bot, next_player_id, group_id)
             logger.info(f"玩家 {player_name}({next_player_id}) 在群 {group_id} 的游戏超时。")
             
-            # 记录战绩
-            all_participants = room.get_all_participants()
-            winner_ids = [p for p in all_participants if p != next_player_id]
-            is_pvp = len(room.players) == 2
-            
-            # 多人模式只记录败者，不记录胜者
-            if not is_pvp:
-                winner_ids = []
-            
-            self.stats.record_game_result(next_player_id, winner_ids, is_pvp, group_id)
+            # 记录战绩和对局历史
+            await self._record_game(group_id, room, next_player_id, "timeout")
             
-            await ban(event, room.ban_time, user_id=next_player_id)
+            self._submit_ban(bot, group_id, next_player_id, room.ban_time)
             
             timeout_reply = (
                 f"玩家 {player_name} 在命运抉择面前犹豫了过久，已降下神罚！\n"
                 f"被禁言 {room.ban_time} 秒！"
             )
-            await event.send(MessageChain([Comp_Plain(timeout_reply)]))
-            
-            # 使用包含所有参与者的列表来清理房间
-            self.gm.del_room(group_id=group_id, players=room.players)
-            if group_id in self.timeout_tasks:
-                del self.timeout_tasks[group_id]
-            if group_id in self.game_timeout_tasks:
-                self.game_timeout_tasks[group_id].cancel()
-                del self.game_timeout_tasks[group_id]
-        except asyncio.CancelledError:
-            logger.info(f"群 {group_id} 的超时任务被取消。")
+            chain = MessageChain([Comp_Plain(timeout_reply)])
+            self.actions.submit("send", group_id, lambda: self.context.send_message(umo, chain), "超时判负提示")
         except Exception as e:
             logger.error(f"执行超时自动认输任务时出错: {e}", exc_info=True)
     
     @filter.command("认输", alias={"玩不起"})
+    @metrics.track_command("认输")
     async def surrender_game(self, event: AstrMessageEvent):
         user_id = event.get_sender_id()
         group_id = event.get_group_id()
         
-        # 查找房间（优先双人，其次多人）
-        room = self.gm.get_room(kids=[user_id, "", group_id])
+        # 查找房间（优先双人，其次多人），轮到自己时认输并注销房间
+        result = self.gm.try_surrender(group_id, user_id)
 
-        if not room:
+        if result.outcome == NO_ROOM:
             yield event.plain_result("你没有正在进行的转盘游戏")
             return
 
-        if not room.can_shoot(user_id):
+        if result.outcome == NOT_YOUR_TURN:
             yield event.plain_result("还没轮到你，不能认输哦！")
             return
 
-        if group_id in self.timeout_tasks:
-            self.timeout_tasks[group_id].cancel()
-            del self.timeout_tasks[group_id]
-        
-        if group_id in self.game_timeout_tasks:
-            self.game_timeout_tasks[group_id].cancel()
-            del self.game_timeout_tasks[group_id]
-        
+        room = result.room
+
         user_name = await get_name(event, user_id)
         
-        # 记录战绩
-        all_participants = room.get_all_participants()
-        winner_ids = [p for p in all_participants if p != user_id]
-        is_pvp = len(room.players) == 2
-        
-        # 多人模式只记录败者，不记录胜者
-        if not is_pvp:
-            winner_ids = []
-        
-        self.stats.record_game_result(user_id, winner_ids, is_pvp, group_id)
+        # 记录战绩和对局历史
+        await self._record_game(group_id, room, user_id, "surrender")
         
-        await ban(event, room.ban_time)
+        self._submit_ban(event_bot(event), group_id, user_id, room.ban_time)
         reply = (
             f"{user_name} 选择了认输，直面惩罚！"
             f"被禁言 {room.ban_time} 秒！{random.choice(self.PERSUASION_QUOTES)}"
         )
-        # 使用包含所有参与者的列表来清理房间
-        self.gm.del_room(group_id=group_id, players=room.players)
         yield event.plain_result(reply)
 
     @filter.command("退出", alias={"结束游戏"})
+    @metrics.track_command("退出")
     async def exit_game(self, event: AstrMessageEvent):
         user_id = event.get_sender_id()
         group_id = event.get_group_id()
         
-        # 查找房间（优先双人，其次多人）
-        room = self.gm.get_room(kids=[user_id, "", group_id])
+        # 查找房间（优先双人，其次多人），不是最后一发轮到自己时退出并注销房间
+        result = self.gm.try_exit(group_id, user_id)
 
-        if not room:
+        if result.outcome == NO_ROOM:
             yield event.plain_result("你没有正在进行的转盘游戏")
             return
 
-        is_last_round = (6 - room.round) == 1
-        if is_last_round and room.can_shoot(user_id):
+        if result.outcome == LAST_ROUND:
             yield event.plain_result("只剩最后一发，命运已定，无法退出！请选择【开枪】或【认输】。")
             return
 
-        if group_id in self.timeout_tasks:
-            self.timeout_tasks[group_id].cancel()
-            del self.timeout_tasks[group_id]
-        
-        if group_id in self.game_timeout_tasks:
-            self.game_timeout_tasks[group_id].cancel()
-            del self.game_timeout_tasks[group_id]
+        room = result.room
 
-        # 使用包含所有参与者的列表来清理房间
-        self.gm.del_room(group_id=group_id, players=room.players)
+        self.history.record(group_id, room, "exit")
         yield event.plain_result("游戏已由玩家主动退出，无人受罚。")
     
     @filter.command("结束转盘")
+    @metrics.track_command("结束转盘")
     async def admin_end_game(self, event: AstrMessageEvent):
         """管理员强制结束当前群的多人转盘游戏（不影响双人对决）"""
         if not event.is_admin():
@@ -371,19 +485,153 @@ class RoulettePlugin(Star):
             yield event.plain_result("当前是双人对决模式，无法强制结束。请让玩家自行【退出】或【认输】。")
             return
         
-        if group_id in self.timeout_tasks:
-            self.timeout_tasks[group_id].cancel()
-            del self.timeout_tasks[group_id]
-        
-        if group_id in self.game_timeout_tasks:
-            self.game_timeout_tasks[group_id].cancel()
-            del self.game_timeout_tasks[group_id]
+        if not self.gm.teardown(group_id, room):
+            yield event.plain_result("当前群没有进行中的转盘游戏")
+            return
         
-        # 清理多人模式房间
-        self.gm.del_room(group_id=group_id)
+        self.history.record(group_id, room, "admin")
         yield event.plain_result("管理员已强制结束当前群的多人转盘游戏，无人受罚。")
     
+    @filter.command("转盘状态")
+    @metrics.track_command("转盘状态")
+    async def runtime_status(self, event: AstrMessageEvent):
+        """管理员查看运行指标，加“导出”写入 Prometheus 文本格式的指标文件"""
+        if not event.is_admin():
+            yield event.plain_result("此指令仅限管理员使用")
+            return
+
+        args = event.message_str.split()
+        if len(args) >= 2 and args[-1] == "导出":
+            try:
+                await asyncio.to_thread(metrics.dump, self.metrics_file)
+            except Exception as e:
+                logger.error(f"写入指标文件失败: {e}")
+                yield event.plain_result("写入指标文件失败")
+                return
+            yield event.plain_result(f"指标已导出到 {self.metrics_file}")
+            return
+
+        def ms(histogram) -> str:
+            return f"{histogram.quantile(0.95) * 1000:g}ms"
+
+        gauges = metrics.gauge_values()
+        reply = "📈 转盘运行状态\n\u200b\n"
+        reply += f"进行中的房间: {gauges.get('roulette_rooms', 0)}\n"
+        reply += f"动作队列: 排队 {gauges.get('roulette_action_queue', 0)}，死信 {len(self.actions.dead_letters)}\n"
+        reaped = sum(metrics.counters("roulette_rooms_reaped_total").values())
+        reply += f"定时器: 房间 {gauges.get('roulette_room_timers', 0)} / 时间轮 {gauges.get('roulette_timers', 0)}，已回收滞留房间 {reaped:g}\n"
+
+        cache = {dict(key)["result"]: value for key, value in metrics.counters("roulette_name_cache_total").items()}
+        lookups = sum(cache.values())
+        hit_rate = (cache.get("hit", 0) + cache.get("coalesced", 0)) / lookups * 100 if lookups else 0
+        reply += f"昵称缓存: {gauges.get('roulette_name_cache_entries', 0)} 条，命中率 {hit_rate:.1f}%\n"
+        boards = {dict(key)["result"]: value for key, value in metrics.counters("roulette_board_cache_total").items()}
+        lookups = sum(boards.values())
+        hit_rate = boards.get("hit", 0) / lookups * 100 if lookups else 0
+        reply += f"排行榜缓存: {gauges.get('roulette_board_cache_entries', 0)} 条，命中率 {hit_rate:.1f}%\n\u200b\n"
+
+        reply += "战绩（次数 / p95）\n"
+        for key, histogram in sorted(metrics.histograms("roulette_stats_seconds").items()):
+            reply += f"   {dict(key)['op']}: {histogram.count} / ≤{ms(histogram)}\n"
+
+        reply += "平台请求（次数 / p95）\n"
+        for key, histogram in sorted(metrics.histograms("roulette_rpc_seconds").items()):
+            reply += f"   {dict(key)['rpc']}: {histogram.count} / ≤{ms(histogram)}\n"
+
+        rpc_by_command: dict[str, float] = {}
+        for key, value in metrics.counters("roulette_rpc_total").items():
+            command = dict(key)["command"]
+            rpc_by_command[command] = rpc_by_command.get(command, 0) + value
+
+        reply += "指令（次数 / p95 / 平台请求）\n"
+        for key, histogram in sorted(metrics.histograms("roulette_command_seconds").items()):
+            command = dict(key)["command"]
+            reply += f"   {command}: {histogram.count} / ≤{ms(histogram)} / {rpc_by_command.get(command, 0):g}\n"
+
+        yield event.plain_result(reply.rstrip())
+
+    @filter.command("转盘数据")
+    @metrics.track_command("转盘数据")
+    async def transfer_data(self, event: AstrMessageEvent):
+        """管理员导出（NDJSON / CSV）或批量导入战绩，文件位于数据目录下的 transfer/；也可按对局历史重算等级分"""
+        if not event.is_admin():
+            yield event.plain_result("此指令仅限管理员使用")
+            return
+
+        args = event.message_str.split()[1:]
+        usage = (
+            "用法：/转盘数据 导出 [csv] [历史]，/转盘数据 导入 文件名（文件放在 transfer/ 目录下），"
+            "或 /转盘数据 重算等级分 [强制]"
+        )
+        if not args or args[0] not in ("导出", "导入", "重算等级分"):
+            yield event.plain_result(usage)
+            return
+
+        if args[0] == "重算等级分":
+            try:
+                count = await asyncio.to_thread(self._rebuild_ratings, "强制" in args[1:])
+            except ValueError as e:
+                # 对局历史没有覆盖全部对决，等级分未改动
+                yield event.plain_result(f"{e}。\n等级分未改动，确认后使用 /转盘数据 重算等级分 强制")
+                return
+            except Exception as e:
+                logger.error(f"重算等级分失败: {e}")
+                yield event.plain_result("重算失败，详见日志")
+                return
+            finally:
+                self.board_cache.clear()
+            yield event.plain_result(f"已按 {count} 场对决重算等级分")
+            return
+
+        os.makedirs(self.transfer_dir, exist_ok=True)
+
+        if args[0] == "导出":
+            fmt = "csv" if "csv" in args[1:] else "ndjson"
+            kinds = ["history"] if "历史" in args[1:] else ["users", "pvp"]
+            name = f"roulette-{'history' if kinds == ['history'] else 'stats'}-{time.strftime('%Y%m%d-%H%M%S')}.{fmt}"
+            path = os.path.join(self.transfer_dir, name)
+            try:
+                count = await asyncio.to_thread(export_file, self.stats, path, fmt, kinds, self.history)
+            except Exception as e:
+                logger.error(f"导出数据失败: {e}")
+                yield event.plain_result("导出失败，详见日志")
+                return
+            yield event.plain_result(f"已导出 {count} 条记录到 {path}")
+            return
+
+        if len(args) < 2:
+            yield event.plain_result(usage)
+            return
+        # 只接受 transfer/ 目录下的文件名
+        path = os.path.join(self.transfer_dir, os.path.basename(args[1]))
+        if not os.path.isfile(path):
+            yield event.plain_result(f"找不到文件 {path}")
+            return
+        try:
+            imported, skipped = await asyncio.to_thread(import_file, self.stats, path)
+        except Exception as e:
+            logger.error(f"导入数据失败: {e}")
+            yield event.plain_result("导入失败，详见日志（已写入的批次会保留）")
+            return
+        finally:
+            self.board_cache.clear()
+        yield event.plain_result(f"已导入 {imported} 条记录，跳过 {skipped} 行")
+    
+    def _rebuild_ratings(self, force: bool = False) -> int:
+        """
+        按数据目录下全部实例的对局历史，以时间顺序重放对决重算等级分
+        :param force: 对局历史没有覆盖全部对决时仍然重算
+        """
+        self.history.flush()
+        logs = [HistoryLog(path, flush_interval=None) for path in history_dirs(self.data_dir)]
+        try:
+            return self.stats.rebuild_ratings(iter_duels(logs), force=force)
+        finally:
+            for log in logs:
+                log.close()
+
     @filter.command("我的战绩", alias={"转盘战绩", "查看战绩"})
+    @metrics.track_command("我的战绩")
     async def my_stats(self, event: AstrMessageEvent):
         """查看个人转盘战绩"""
         user_id = event.get_sender_id()
@@ -409,10 +657,16 @@ class RoulettePlugin(Star):
         reply += f"胜率: {win_rate:.1f}%\n"
         reply += f"最高连胜: {max_streak} 连胜\n"
         reply += f"当前连胜: {current_streak} 连胜"
+        if "rating" in stats:
+            reply += f"\n等级分: {stats['rating']:.0f}（{stats['rated_games']} 场对决）"
+        percentile = await asyncio.to_thread(self.stats.get_percentile, user_id, group_id, self.board_sort)
+        if percentile is not None:
+            reply += f"\n赌圣榜排名超过了 {percentile * 100:.0f}% 的玩家"
         
         yield event.plain_result(reply)
     
     @filter.command("对战记录")
+    @metrics.track_command("对战记录")
     async def pvp_stats(self, event: AstrMessageEvent):
         """查看与某人的对战记录，需要@对方"""
         sender_id = event.get_sender_id()
@@ -428,16 +682,14 @@ class RoulettePlugin(Star):
 
         group_id = event.get_group_id()
         pvp_stats = self.stats.get_pvp_stats(sender_id, target_id, group_id)
+        sender_name, target_name = await asyncio.gather(
+            get_name(event, sender_id), get_name(event, target_id)
+        )
 
         if not pvp_stats:
-            sender_name = await get_name(event, sender_id)
-            target_name = await get_name(event, target_id)
             yield event.plain_result(f"{sender_name} 和 {target_name} 还没有对战记录")
             return
 
-        sender_name = await get_name(event, sender_id)
-        target_name = await get_name(event, target_id)
-
         total = pvp_stats["total"]
         sender_wins = pvp_stats.get(f"{sender_id}_wins", 0)
         target_wins = pvp_stats.get(f"{target_id}_wins", 0)
@@ -458,61 +710,140 @@ class RoulettePlugin(Star):
             reply += f"双方势均力敌！"
 
         yield event.plain_result(reply)
+
+    @filter.command("宿敌")
+    @metrics.track_command("宿敌")
+    async def rivals(self, event: AstrMessageEvent):
+        """查看对战次数最多的对手，可@他人查看对方的宿敌"""
+        user_id = get_at_id(event) or event.get_sender_id()
+        group_id = event.get_group_id()
+        rivals = self.stats.get_rivals(user_id, group_id, limit=5)
+
+        user_name = await get_name(event, user_id)
+        if not rivals:
+            yield event.plain_result(f"{user_name} 还没有双人对决记录")
+            return
+
+        names = await asyncio.gather(*(get_name(event, rival_id) for rival_id, *_ in rivals))
+
+        reply = f"⚔️ {user_name} 的宿敌\n\u200b\n"
+        for i, (name, (rival_id, total, wins, losses)) in enumerate(zip(names, rivals), 1):
+            reply += f"{i}. {name or rival_id}\n"
+            reply += f"   交手{total}局 | {wins}胜{losses}负\n"
+
+        yield event.plain_result(reply.rstrip())
     
+    async def _resolve_board_names(self, event: AstrMessageEvent, group_id: str, board: list) -> list:
+        """
+        按名次为排行榜候选解析昵称，凑满 BOARD_SIZE 人为止
+        每轮只查询还差的人数，已退群的用户被略过，由后面的候选递补
+        :param board: [(user_id, value, stats), ...]
+        :return: [(user_id, value, stats, user_name), ...]
+        """
+        if self.preload_roster and group_id and board:
+            await preload_group_roster(event, group_id)
+        result = []
+        start = 0
+        while len(result) < BOARD_SIZE and start < len(board):
+            batch = board[start:start + BOARD_SIZE - len(result)]
+            start += len(batch)
+            names = await asyncio.gather(
+                *(get_name(event, user_id, group_id) for user_id, _, _ in batch)
+            )
+            result.extend(
+                (user_id, value, stats, user_name)
+                for (user_id, value, stats), user_name in zip(batch, names)
+                if user_name
+            )
+        return result
+
+    def _cached_board(self, group_id: str, board: str, window: str):
+        """取缓存的排行榜回复；其他实例写入过共享战绩库时先整体作废"""
+        version = self.stats.data_version()
+        if version != self._stats_version:
+            self._stats_version = version
+            self.board_cache.clear()
+        return self.board_cache.get(group_id, board, window)
+
+    def _cache_board(self, group_id: str, board: str, window: str, top_list: list, reply: str, version: int):
+        """缓存排行榜回复，榜单按统计后端返回的原始排行登记（含解析不到昵称的用户）"""
+        self.board_cache.put(
+            group_id, board, window, self.stats.board_scope(group_id), top_list, BOARD_CANDIDATES, reply, version
+        )
+
+    @staticmethod
+    def _board_window(event: AstrMessageEvent):
+        """解析排行榜的时间窗口参数，返回 (window, 标题前缀)"""
+        args = event.message_str.split()
+        window = BOARD_WINDOWS.get(args[-1]) if len(args) >= 2 else None
+        return window, BOARD_WINDOW_TITLES.get(window, "")
+
     @filter.command("赌圣榜", alias={"赌圣排行榜", "胜率排行"})
+    @metrics.track_command("赌圣榜")
     async def top_players(self, event: AstrMessageEvent):
-        """查看胜率排行榜（至少参与5局）"""
+        """查看胜率排行榜（至少参与5局），可加 日/周/月 查看近期排行"""
         group_id = event.get_group_id()
-        # 获取全局前 100 名，然后从中筛选出在当前群的
-        all_top_list = self.stats.get_top_players(group_id=None, min_games=5, limit=100)
+        window, title = self._board_window(event)
+        cached = self._cached_board(group_id, "top", window)
+        if cached is not None:
+            yield event.plain_result(cached)
+            return
+        version = self.board_cache.version()
+        # 直接取本群范围内的排行，只为最终上榜的 5 人（及递补的候选）解析昵称
+        top_list = self.stats.get_top_players(
+            group_id=group_id, min_games=5, limit=BOARD_CANDIDATES, window=window, sort_by=self.board_sort
+        )
         
-        qualified_list = []
-        for user_id, win_rate, stats in all_top_list:
-            user_name = await get_name(event, user_id, group_id)
-            if user_name:
-                qualified_list.append((user_id, win_rate, stats, user_name))
-            if len(qualified_list) >= 5:
-                break
+        qualified_list = await self._resolve_board_names(event, group_id, top_list)
         
         if not qualified_list:
-            yield event.plain_result("当前群暂时还没有符合条件的赌圣（至少参与5局）")
+            reply = f"当前群{title}暂时还没有符合条件的赌圣（至少参与5局）"
+            self._cache_board(group_id, "top", window, top_list, reply, version)
+            yield event.plain_result(reply)
             return
         
-        reply = "🏆 赌圣排行榜 TOP5\n\u200b\n"
+        reply = f"🏆 {title}赌圣排行榜 TOP5\n\u200b\n"
         
         medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
         
         for idx, (user_id, win_rate, stats, user_name) in enumerate(qualified_list):
             total = stats["total"]
             wins = stats["wins"]
-            max_streak = stats["max_win_streak"]
             
             reply += f"{medals[idx]} {user_name}\n"
             reply += f"   胜率: {win_rate*100:.1f}% ({wins}/{total})\n"
-            reply += f"   最高连胜: {max_streak}\n\u200b\n"
+            # 近期排行只统计胜负，没有连胜数据
+            if "max_win_streak" in stats:
+                reply += f"   最高连胜: {stats['max_win_streak']}\n"
+            reply += "\u200b\n"
         
+        self._cache_board(group_id, "top", window, top_list, reply, version)
         yield event.plain_result(reply)
 
     @filter.command("散财榜", alias={"散财排行榜", "倒霉榜", "输家榜"})
+    @metrics.track_command("散财榜")
     async def unlucky_players(self, event: AstrMessageEvent):
-        """查看散财排行榜（胜率最低，至少参与5局）"""
+        """查看散财排行榜（胜率最低，至少参与5局），可加 日/周/月 查看近期排行"""
         group_id = event.get_group_id()
-        # 获取全局排名，筛选出在当前群的
-        all_top_list = self.stats.get_unlucky_players(group_id=None, min_games=5, limit=100)
+        window, title = self._board_window(event)
+        cached = self._cached_board(group_id, "unlucky", window)
+        if cached is not None:
+            yield event.plain_result(cached)
+            return
+        version = self.board_cache.version()
+        top_list = self.stats.get_unlucky_players(
+            group_id=group_id, min_games=5, limit=BOARD_CANDIDATES, window=window, sort_by=self.board_sort
+        )
         
-        qualified_list = []
-        for user_id, win_rate, stats in all_top_list:
-            user_name = await get_name(event, user_id, group_id)
-            if user_name:
-                qualified_list.append((user_id, win_rate, stats, user_name))
-            if len(qualified_list) >= 5:
-                break
+        qualified_list = await self._resolve_board_names(event, group_id, top_list)
         
         if not qualified_list:
-            yield event.plain_result("当前群暂时还没有符合条件的散财达人（至少参与5局）")
+            reply = f"当前群{title}暂时还没有符合条件的散财达人（至少参与5局）"
+            self._cache_board(group_id, "unlucky", window, top_list, reply, version)
+            yield event.plain_result(reply)
             return
         
-        reply = "💸 散财排行榜 TOP5\n\u200b\n"
+        reply = f"💸 {title}散财排行榜 TOP5\n\u200b\n"
         
         medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
         
@@ -524,28 +855,31 @@ class RoulettePlugin(Star):
             reply += f"{medals[idx]} {user_name}\n"
             reply += f"   胜率: {win_rate*100:.1f}% (胜{wins}/负{losses})\n\u200b\n"
         
+        self._cache_board(group_id, "unlucky", window, top_list, reply, version)
         yield event.plain_result(reply)
 
     @filter.command("赌狗榜", alias={"赌狗排行榜"})
+    @metrics.track_command("赌狗榜")
     async def active_players(self, event: AstrMessageEvent):
-        """查看赌狗排行榜（参与局数最多）"""
+        """查看赌狗排行榜（参与局数最多），可加 日/周/月 查看近期排行"""
         group_id = event.get_group_id()
-        # 获取全局排名，筛选出在当前群的
-        all_top_list = self.stats.get_active_players(group_id=None, limit=100)
+        window, title = self._board_window(event)
+        cached = self._cached_board(group_id, "active", window)
+        if cached is not None:
+            yield event.plain_result(cached)
+            return
+        version = self.board_cache.version()
+        top_list = self.stats.get_active_players(group_id=group_id, limit=BOARD_CANDIDATES, window=window)
         
-        qualified_list = []
-        for user_id, total, stats in all_top_list:
-            user_name = await get_name(event, user_id, group_id)
-            if user_name:
-                qualified_list.append((user_id, total, stats, user_name))
-            if len(qualified_list) >= 5:
-                break
+        qualified_list = await self._resolve_board_names(event, group_id, top_list)
         
         if not qualified_list:
-            yield event.plain_result("暂时还没有战绩记录")
+            reply = f"{title}暂时还没有战绩记录"
+            self._cache_board(group_id, "active", window, top_list, reply, version)
+            yield event.plain_result(reply)
             return
         
-        reply = "🐶 赌狗排行榜 TOP5\n\u200b\n"
+        reply = f"🐶 {title}赌狗排行榜 TOP5\n\u200b\n"
         
         medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
         
@@ -556,9 +890,42 @@ class RoulettePlugin(Star):
             reply += f"{medals[idx]} {user_name}\n"
             reply += f"   总局数: {total} (胜{wins}/负{losses})\n\u200b\n"
         
+        self._cache_board(group_id, "active", window, top_list, reply, version)
         yield event.plain_result(reply)
     
+    @filter.command("等级分榜", alias={"天梯榜", "等级分排行"})
+    @metrics.track_command("等级分榜")
+    async def rating_players(self, event: AstrMessageEvent):
+        """查看双人对决的等级分排行榜（至少5场对决）"""
+        group_id = event.get_group_id()
+        cached = self._cached_board(group_id, "rating", None)
+        if cached is not None:
+            yield event.plain_result(cached)
+            return
+        version = self.board_cache.version()
+        top_list = self.stats.get_rating_board(group_id=group_id, min_games=RATED_MIN_GAMES, limit=BOARD_CANDIDATES)
+
+        qualified_list = await self._resolve_board_names(event, group_id, top_list)
+
+        if not qualified_list:
+            reply = f"当前群暂时还没有上榜的对决高手（至少{RATED_MIN_GAMES}场双人对决）"
+            self._cache_board(group_id, "rating", None, top_list, reply, version)
+            yield event.plain_result(reply)
+            return
+
+        reply = "⚔️ 等级分排行榜 TOP5\n\u200b\n"
+
+        medals = ["🥇", "🥈", "🥉", "4️⃣", "5️⃣"]
+
+        for idx, (user_id, rating, stats, user_name) in enumerate(qualified_list):
+            reply += f"{medals[idx]} {user_name}\n"
+            reply += f"   等级分: {rating:.0f} ({stats['rated_games']} 场对决)\n\u200b\n"
+
+        self._cache_board(group_id, "rating", None, top_list, reply, version)
+        yield event.plain_result(reply)
+
     @filter.command("转盘帮助", alias={"轮盘帮助"})
+    @metrics.track_command("转盘帮助")
     async def roulette_help(self, event: AstrMessageEvent):
         """显示转盘游戏帮助"""
         help_text = """🎰 俄罗斯转盘游戏帮助
@@ -573,12 +940,18 @@ class RoulettePlugin(Star):
 📊 战绩查询
 • /我的战绩 - 查看个人战绩统计
 • /对战记录@群友 - 查看与某人的对战记录
-• /赌圣榜 - 查看胜率最高排行榜TOP5
-• /散财榜 - 查看胜率最低排行榜TOP5
-• /赌狗榜 - 查看参与局数排行榜TOP5
+• /宿敌 [@群友] - 查看交手最多的对手TOP5
+• /赌圣榜 [日/周/月] - 查看胜率最高排行榜TOP5
+• /散财榜 [日/周/月] - 查看胜率最低排行榜TOP5
+• /赌狗榜 [日/周/月] - 查看参与局数排行榜TOP5
+• /等级分榜 - 查看双人对决等级分排行榜TOP5
 
 🛡️ 管理员指令
 • /结束转盘 - 强制结束多人游戏（不影响双人对决）
+• /转盘状态 [导出] - 查看运行指标，导出为 Prometheus 文本文件
+• /转盘数据 导出 [csv] [历史] - 导出战绩或对局历史
+• /转盘数据 导入 文件名 - 从 transfer/ 目录批量导入战绩
+• /转盘数据 重算等级分 [强制] - 按对局历史重算等级分（修改 K 值后使用；历史不全时需加“强制”）
 
 💡 游戏规则
 • 转盘有6发子弹位，随机一发是实弹
@@ -595,6 +968,8 @@ class RoulettePlugin(Star):
 • 失败：中枪、认输、超时均为失败
 • 胜率：胜利次数/总参与次数
 • 赌圣榜：至少参与5局才能上榜
+• 排行榜加 日/周/月 只统计今日/近7天/近30天的对局
+• 等级分：双人对决按 Elo 计分，初始1500分，赢强者加分多、输弱者扣分多
 
 ⚠️ 小赌怡情，大赌伤身！"""
         